@@ -0,0 +1,108 @@
+"""
+Load test: latency of trivial /run calls while slow runs are in flight
+
+Keeps N timeout-bound runs (`while True: pass`) active against the execution
+service and measures p50/p95/p99 latency of trivial runs and /health during
+that window. With a blocking event loop every trivial run waits for a slow
+one; with the async path they stay in the tens of milliseconds.
+
+Usage:
+    python benchmarks/load_test_run.py --url http://localhost:8001 --slow 2 --requests 200
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SLOW_PROGRAM = "while True:\n    pass\n"
+FAST_PROGRAM = "print(sum(range(100)))\n"
+
+
+def post_run(url: str, language: str, code: str, timeout: float) -> float:
+    """POST one /run request and return its latency in seconds"""
+    body = json.dumps({
+        "language": language,
+        "files": [{"name": "main", "content": code}],
+        "stdin": ""
+    }).encode()
+    request = urllib.request.Request(
+        f"{url}/run",
+        data=body,
+        headers={"Content-Type": "application/json"}
+    )
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def get_health(url: str, timeout: float) -> float:
+    started = time.perf_counter()
+    with urllib.request.urlopen(f"{url}/health", timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name: str, samples: list) -> dict:
+    summary = {
+        "name": name,
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(samples) * 1000, 1)
+    }
+    print(f"{name:<14} n={summary['count']:<5} p50={summary['p50_ms']:>8} ms  "
+          f"p95={summary['p95_ms']:>8} ms  p99={summary['p99_ms']:>8} ms")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--slow", type=int, default=2, help="timeout-bound runs kept in flight")
+    parser.add_argument("--requests", type=int, default=200, help="trivial runs to measure")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel trivial runs")
+    parser.add_argument("--language", default="python", choices=["python", "sql"], help="language of the trivial runs")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+
+    def keep_slow_run_busy():
+        while not stop.is_set():
+            try:
+                post_run(args.url, "python", SLOW_PROGRAM, timeout=60)
+            except Exception as e:
+                print(f"✗ slow run failed: {e}")
+                time.sleep(1)
+
+    slow_threads = [threading.Thread(target=keep_slow_run_busy, daemon=True) for _ in range(args.slow)]
+    for thread in slow_threads:
+        thread.start()
+
+    # Let the slow runs reach the service before measuring
+    time.sleep(1)
+    print(f"Measuring with {args.slow} timeout-bound runs in flight against {args.url}")
+
+    fast_code = FAST_PROGRAM if args.language == "python" else "SELECT 1"
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        health = list(pool.map(lambda _: get_health(args.url, 30), range(args.requests // 4 or 1)))
+        runs = list(pool.map(lambda _: post_run(args.url, args.language, fast_code, 30), range(args.requests)))
+
+    stop.set()
+    summarize("/health", health)
+    summarize(f"/run {args.language}", runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Benchmark: a realistic mix of /run traffic
+
+Replays hello-world, CPU-bound, timeout and big-output programs in Python,
+Java, SQL and PySpark against the execution service at a fixed
+concurrency, then reports throughput, latency percentiles per language and
+scenario, and per-language spawn overhead (sequential hello-world runs on
+an otherwise idle service). Results are written as JSON so two releases
+can be compared:
+
+    python benchmarks/run_mix.py --url http://localhost:8001 --concurrency 8 \\
+        --requests 400 --output results-2.1.json
+    python benchmarks/run_mix.py ... --baseline results-2.0.json
+
+Runs are sent with "use_cache": false so every request really executes.
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+JAVA_TEMPLATE = "public class Main {{\n    public static void main(String[] args) {{\n{body}\n    }}\n}}\n"
+
+PROGRAMS = {
+    "python": {
+        "hello": "print('hello')\n",
+        "cpu": "total = 0\nfor i in range(3_000_000):\n    total += i * i\nprint(total)\n",
+        "timeout": "while True:\n    pass\n",
+        "big_output": "for i in range(50_000):\n    print(i, 'x' * 10)\n"
+    },
+    "java": {
+        "hello": JAVA_TEMPLATE.format(body='        System.out.println("hello");'),
+        "cpu": JAVA_TEMPLATE.format(
+            body="        long total = 0;\n"
+                 "        for (long i = 0; i < 300_000_000L; i++) { total += i * i; }\n"
+                 "        System.out.println(total);"
+        ),
+        "timeout": JAVA_TEMPLATE.format(body="        while (true) { }"),
+        "big_output": JAVA_TEMPLATE.format(
+            body="        StringBuilder out = new StringBuilder();\n"
+                 "        for (int i = 0; i < 50_000; i++) { out.append(i).append(\" xxxxxxxxxx\\n\"); }\n"
+                 "        System.out.print(out);"
+        )
+    },
+    "sql": {
+        "hello": "SELECT 'hello';",
+        "cpu": "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 2000000) "
+               "SELECT SUM(x * x) FROM c;",
+        "timeout": "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c;",
+        "big_output": "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 50000) "
+                      "SELECT x, 'xxxxxxxxxx' FROM c;"
+    },
+    "pyspark": {
+        "hello": "from pyspark.sql import SparkSession\n"
+                 "spark = SparkSession.builder.getOrCreate()\n"
+                 "print(spark.range(1).count())\n",
+        "cpu": "from pyspark.sql import SparkSession\n"
+               "spark = SparkSession.builder.getOrCreate()\n"
+               "print(spark.range(20_000_000).selectExpr('sum(id * id)').collect()[0][0])\n",
+        "timeout": "while True:\n    pass\n",
+        "big_output": "from pyspark.sql import SparkSession\n"
+                      "spark = SparkSession.builder.getOrCreate()\n"
+                      "spark.range(5_000).selectExpr('id', \"'xxxxxxxxxx' AS pad\").show(5_000, truncate=False)\n"
+    }
+}
+
+# Relative frequency of each scenario: mostly quick runs, some heavy ones
+DEFAULT_MIX = "hello=12,cpu=4,big_output=2,timeout=1"
+
+DEFAULT_LANGUAGES = "python=8,java=4,sql=3,pyspark=1"
+
+
+def parse_weights(value: str) -> dict:
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def post_run(url: str, language: str, code: str, timeout: float) -> dict:
+    """POST one /run request; latency in seconds plus what the service reported"""
+    body = json.dumps({
+        "language": language,
+        "files": [{"name": "main", "content": code}],
+        "stdin": "",
+        "use_cache": False
+    }).encode()
+    request = urllib.request.Request(f"{url}/run", data=body, headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            result = json.loads(response.read())
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        return {"latency": time.perf_counter() - started, "status": "request_failed", "error": str(e)}
+    return {
+        "latency": time.perf_counter() - started,
+        "status": result.get("status"),
+        "wall_time": (result.get("usage") or {}).get("wall_time"),
+        "output_bytes": len(result.get("run", {}).get("stdout") or "")
+    }
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list) -> dict:
+    latencies = [sample["latency"] for sample in samples]
+    statuses = {}
+    for sample in samples:
+        statuses[sample["status"]] = statuses.get(sample["status"], 0) + 1
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "statuses": statuses
+    }
+
+
+def measure_spawn_overhead(url: str, languages: list, rounds: int) -> dict:
+    """Sequential hello-world runs: the fixed cost of starting a program in each language"""
+    overhead = {}
+    for language in languages:
+        samples = [post_run(url, language, PROGRAMS[language]["hello"], 120) for _ in range(rounds)]
+        ok = [sample for sample in samples if sample["status"] == "success"]
+        if not ok:
+            overhead[language] = {"error": samples[-1].get("error") or samples[-1]["status"]}
+            continue
+        latencies = [sample["latency"] for sample in ok]
+        overhead[language] = {
+            "min_ms": round(min(latencies) * 1000, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1)
+        }
+        print(f"spawn {language:<8} p50={overhead[language]['p50_ms']:>8} ms  "
+              f"min={overhead[language]['min_ms']:>8} ms")
+    return overhead
+
+
+def build_schedule(languages: dict, scenarios: dict, requests: int, seed: int) -> list:
+    """The (language, scenario) of every request, drawn by weight and shuffled reproducibly"""
+    pairs = [(language, scenario) for language in languages for scenario in scenarios]
+    weights = [languages[language] * scenarios[scenario] for language, scenario in pairs]
+    return random.Random(seed).choices(pairs, weights=weights, k=requests)
+
+
+def print_comparison(results: dict, baseline: dict):
+    """Change of the headline numbers against an earlier results file"""
+    print(f"\nAgainst baseline ({baseline['meta'].get('timestamp')}):")
+    old, new = baseline["throughput_rps"], results["throughput_rps"]
+    print(f"  throughput      {old:>8} -> {new:>8} req/s")
+    for language, summary in results["by_language"].items():
+        before = baseline.get("by_language", {}).get(language)
+        if before:
+            print(f"  {language:<8} p50 {before['p50_ms']:>8} -> {summary['p50_ms']:>8} ms   "
+                  f"p95 {before['p95_ms']:>8} -> {summary['p95_ms']:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="requests in the measured mix")
+    parser.add_argument("--languages", default=DEFAULT_LANGUAGES, help="language weights, e.g. python=8,sql=3")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights, e.g. hello=12,cpu=4")
+    parser.add_argument("--spawn-rounds", type=int, default=10, help="sequential hello-world runs per language")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the request order")
+    parser.add_argument("--output", default="benchmark-results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    languages = {name: weight for name, weight in parse_weights(args.languages).items() if name in PROGRAMS}
+    scenarios = {name: weight for name, weight in parse_weights(args.mix).items() if name in PROGRAMS["python"]}
+
+    print(f"Spawn overhead against {args.url}")
+    spawn = measure_spawn_overhead(args.url, list(languages), args.spawn_rounds)
+
+    schedule = build_schedule(languages, scenarios, args.requests, args.seed)
+    samples = []
+    lock = threading.Lock()
+
+    def run(item):
+        language, scenario = item
+        sample = post_run(args.url, language, PROGRAMS[language][scenario], 120)
+        sample.update(language=language, scenario=scenario)
+        with lock:
+            samples.append(sample)
+
+    print(f"\nMix of {args.requests} requests at concurrency {args.concurrency}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, schedule))
+    elapsed = time.perf_counter() - started
+
+    by_language = {}
+    by_scenario = {}
+    for language in languages:
+        language_samples = [sample for sample in samples if sample["language"] == language]
+        if not language_samples:
+            continue
+        by_language[language] = summarize(language_samples)
+        by_scenario[language] = {}
+        for scenario in scenarios:
+            scenario_samples = [sample for sample in language_samples if sample["scenario"] == scenario]
+            if scenario_samples:
+                by_scenario[language][scenario] = summarize(scenario_samples)
+                summary = by_scenario[language][scenario]
+                print(f"{language:<8} {scenario:<11} n={summary['count']:<5} p50={summary['p50_ms']:>8} ms  "
+                      f"p95={summary['p95_ms']:>8} ms  p99={summary['p99_ms']:>8} ms  {summary['statuses']}")
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "languages": languages,
+            "mix": scenarios,
+            "seed": args.seed,
+            "client": platform.platform()
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "overall": summarize(samples),
+        "by_language": by_language,
+        "by_scenario": by_scenario,
+        "spawn_overhead": spawn
+    }
+    print(f"\nThroughput: {results['throughput_rps']} req/s over {results['elapsed_seconds']} s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"✓ Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import Editor from '@monaco-editor/react'
 import axios from 'axios'
 
@@ -14,6 +14,49 @@ const EXECUTION_SERVICE_URL = '/api'
 const PROBLEM_SERVICE_URL = '/api'
 const SUBMISSION_SERVICE_URL = '/api'
 
+// The single edit turning previous into current: everything between their
+// common prefix and common suffix. Offsets count code points, as the server
+// (Python) does, so characters outside the BMP are never split or miscounted.
+function diffEdit(previous, current) {
+  const before = Array.from(previous)
+  const after = Array.from(current)
+  let start = 0
+  while (start < before.length && start < after.length && before[start] === after[start]) {
+    start++
+  }
+  let end = 0
+  while (
+    end < before.length - start &&
+    end < after.length - start &&
+    before[before.length - 1 - end] === after[after.length - 1 - end]
+  ) {
+    end++
+  }
+  return {
+    offset: start,
+    length: before.length - start - end,
+    text: after.slice(start, after.length - end).join(''),
+  }
+}
+
+const CRC_TABLE = Array.from({ length: 256 }, (_, n) => {
+  let c = n
+  for (let k = 0; k < 8; k++) {
+    c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1
+  }
+  return c >>> 0
+})
+
+// CRC-32 of the UTF-8 text in hex, compared by the server with the text the
+// edits produce there (draft_deltas.text_checksum)
+function textChecksum(text) {
+  let crc = 0xffffffff
+  for (const byte of new TextEncoder().encode(text)) {
+    crc = CRC_TABLE[(crc ^ byte) & 0xff] ^ (crc >>> 8)
+  }
+  return ((crc ^ 0xffffffff) >>> 0).toString(16).padStart(8, '0')
+}
+
 // Parse input() calls from code
 function parseInputPrompts(code) {
   const prompts = []
@@ -44,6 +87,8 @@ export default function EditorPanel({ externalProblemId, setExternalProblemId, q
   const [userId, setUserId] = useState('user_' + Math.random().toString(36).substr(2, 9))
   const [lastSaved, setLastSaved] = useState(null)
   const [draftLoaded, setDraftLoaded] = useState(false)
+  // Last code the server acknowledged, and its version, so autosaves can send only the edit
+  const savedDraft = useRef({ code: null, version: null })
 
   // Auto-populate stdin from problem's sample_input when problem changes
   useEffect(() => {
@@ -64,6 +109,7 @@ export default function EditorPanel({ externalProblemId, setExternalProblemId, q
         const res = await axios.get(`${SUBMISSION_SERVICE_URL}/draft/${userId}/${problemId}`)
         if (res.data.status !== 'no_draft') {
           setCode(res.data.code || '')
+          savedDraft.current = { code: res.data.code || '', version: res.data.version ?? null }
           setLanguage(res.data.language || 'python')
           setOutput(`📝 Draft recovered from ${new Date(res.data.last_saved).toLocaleTimeString()}`)
           setDraftLoaded(true)
@@ -79,18 +125,34 @@ export default function EditorPanel({ externalProblemId, setExternalProblemId, q
   // Auto-save draft every 5 seconds
   useEffect(() => {
     const autoSaveInterval = setInterval(async () => {
-      if (code.trim() && problemId) {
+      if (code.trim() && problemId && code !== savedDraft.current.code) {
         try {
-          await axios.post(`${SUBMISSION_SERVICE_URL}/draft`, {
-            user_id: userId,
+          const draft = {
+            candidate_id: userId,
             problem_id: problemId,
             language: language,
-            code: code,
             cursor_position: 0,
             status: 'draft'
-          })
-          setLastSaved(new Date())
-          console.log('✓ Draft auto-saved')
+          }
+          const saved = savedDraft.current
+          let res
+          if (saved.code !== null && saved.version !== null) {
+            res = await axios.post(`${SUBMISSION_SERVICE_URL}/draft`, {
+              ...draft,
+              base_version: saved.version,
+              edits: [diffEdit(saved.code, code)],
+              checksum: textChecksum(code)
+            })
+          }
+          if (!res || res.data.status === 'conflict') {
+            // No known base, or the server's copy moved on: send the whole code
+            res = await axios.post(`${SUBMISSION_SERVICE_URL}/draft`, { ...draft, code: code })
+          }
+          if (res.data.status === 'saved') {
+            savedDraft.current = { code: code, version: res.data.version }
+            setLastSaved(new Date())
+            console.log('✓ Draft auto-saved')
+          }
         } catch (err) {
           console.log('Draft auto-save failed:', err.message)
         }
@@ -0,0 +1,436 @@
+/*
+ * Persistent Java compile-and-run daemon for the execution service.
+ *
+ * Started once by java_runner.py, it keeps a warm JVM and compiler so a
+ * submission costs a compile task and a classloader instead of two JVM
+ * start-ups. Each submission is loaded in its own URLClassLoader (so static
+ * state never leaks between runs) and its System.in/out/err are routed to
+ * per-job buffers, each capped at the job's output limit.
+ *
+ * Protocol (one request per connection, big-endian, strings are
+ * int length + UTF-8 bytes):
+ *   compile: "compile", sourcePath, outDir        -> int exitCode, string diagnostics
+ *   run:     "run", classDir, className, stdin,
+ *            int timeoutMs, int maxOutputBytes,
+ *            int maxThreads                       -> int exitCode, int timedOut,
+ *                                                    int limit, int leaked,
+ *                                                    string stdout, string stderr
+ *
+ * A run stops being waited for at the timeout, as soon as it writes past
+ * maxOutputBytes (0 = no cap; limit = 1), runs more than maxThreads threads
+ * (0 = no cap; limit = 3) or dies of an OutOfMemoryError (limit = 2, or 3
+ * when it could not start a thread). Heap and threads are shared by every
+ * job, so limits 2 and 3 only say the run should be repeated in a JVM of
+ * its own. leaked = 1 means its threads were still running and the daemon
+ * should be replaced. leaked = 2 means System.in, out or err no longer
+ * route per job (a submission replaced them), so the run's output cannot be
+ * trusted: the routing is put back, and the daemon should be replaced and
+ * the run repeated in its own JVM.
+ */
+
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.lang.reflect.Modifier;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+import java.util.Locale;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+
+public class JavaRunner {
+
+    /** Streams of the job the current thread (or its parent thread) belongs to */
+    static final InheritableThreadLocal<JobStreams> CURRENT = new InheritableThreadLocal<>();
+
+    static final class JobStreams {
+        final InputStream in;
+        final CappedBuffer out;
+        final CappedBuffer err;
+        volatile boolean exceeded;
+        volatile int limit = LIMIT_NONE;
+
+        JobStreams(byte[] stdin, int maxOutputBytes) {
+            this.in = new ByteArrayInputStream(stdin);
+            this.out = new CappedBuffer(this, maxOutputBytes);
+            this.err = new CappedBuffer(this, maxOutputBytes);
+        }
+
+        boolean stopped() {
+            return exceeded || limit != LIMIT_NONE;
+        }
+    }
+
+    /**
+     * Output buffer that silently drops bytes past its cap and flags the job.
+     * It never throws: System.out is shared by every job, and an exception
+     * half way through a PrintStream write would leave encoder state behind
+     * for the next writer.
+     */
+    static final class CappedBuffer extends ByteArrayOutputStream {
+        private final JobStreams job;
+        private final int limit;
+
+        CappedBuffer(JobStreams job, int limit) {
+            this.job = job;
+            this.limit = limit;
+        }
+
+        @Override
+        public synchronized void write(int b) {
+            write(new byte[]{(byte) b}, 0, 1);
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            if (limit > 0 && count + len > limit) {
+                len = Math.max(0, limit - count);
+                job.exceeded = true;
+            }
+            super.write(b, off, len);
+        }
+    }
+
+    /** System.out / System.err replacement that writes into the calling job's buffer */
+    static final class RoutedOutputStream extends OutputStream {
+        private final PrintStream fallback;
+        private final boolean stderr;
+
+        RoutedOutputStream(PrintStream fallback, boolean stderr) {
+            this.fallback = fallback;
+            this.stderr = stderr;
+        }
+
+        private OutputStream target() {
+            JobStreams job = CURRENT.get();
+            if (job == null) {
+                return fallback;
+            }
+            return stderr ? job.err : job.out;
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            OutputStream target = target();
+            synchronized (target) {
+                target.write(b);
+            }
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            OutputStream target = target();
+            synchronized (target) {
+                target.write(b, off, len);
+            }
+        }
+
+        @Override
+        public void flush() throws IOException {
+            target().flush();
+        }
+    }
+
+    /** System.in replacement that reads the calling job's stdin */
+    static final class RoutedInputStream extends InputStream {
+        private final InputStream fallback;
+
+        RoutedInputStream(InputStream fallback) {
+            this.fallback = fallback;
+        }
+
+        private InputStream source() {
+            JobStreams job = CURRENT.get();
+            return job == null ? fallback : job.in;
+        }
+
+        @Override
+        public int read() throws IOException {
+            return source().read();
+        }
+
+        @Override
+        public int read(byte[] b, int off, int len) throws IOException {
+            return source().read(b, off, len);
+        }
+
+        @Override
+        public int available() throws IOException {
+            return source().available();
+        }
+    }
+
+    static final JavaCompiler COMPILER = ToolProvider.getSystemJavaCompiler();
+
+    /** The limit field of a run response */
+    static final int LIMIT_NONE = 0;
+    static final int LIMIT_OUTPUT = 1;
+    static final int LIMIT_MEMORY = 2;
+    static final int LIMIT_THREADS = 3;
+
+    /** The routed System streams every job relies on, set once at start */
+    static PrintStream routedOut;
+    static PrintStream routedErr;
+    static InputStream routedIn;
+
+    /** Set once any job is found to have replaced the routed streams */
+    static volatile boolean streamsReplaced;
+
+    /** Same stack a standalone `java` main thread gets, so deep recursion behaves alike */
+    static final long MAIN_STACK_BYTES = 8L * 1024 * 1024;
+
+    public static void main(String[] args) throws Exception {
+        int port = args.length > 0 ? Integer.parseInt(args[0]) : 0;
+        int threads = args.length > 1 ? Integer.parseInt(args[1]) : Runtime.getRuntime().availableProcessors() * 2;
+
+        PrintStream realOut = System.out;
+        routedOut = new PrintStream(new RoutedOutputStream(realOut, false), true, "UTF-8");
+        routedErr = new PrintStream(new RoutedOutputStream(System.err, true), true, "UTF-8");
+        routedIn = new RoutedInputStream(System.in);
+        restoreStreams();
+
+        ServerSocket server = new ServerSocket(port, 128, InetAddress.getLoopbackAddress());
+        ExecutorService handlers = Executors.newFixedThreadPool(threads, runnable -> {
+            Thread thread = new Thread(runnable, "java-runner-handler");
+            thread.setDaemon(true);
+            return thread;
+        });
+
+        // The Python side waits for this line before sending work
+        realOut.println("READY " + server.getLocalPort());
+        realOut.flush();
+
+        while (true) {
+            Socket socket = server.accept();
+            handlers.submit(() -> handle(socket));
+        }
+    }
+
+    static void handle(Socket socket) {
+        try (Socket s = socket;
+             DataInputStream in = new DataInputStream(s.getInputStream());
+             DataOutputStream out = new DataOutputStream(s.getOutputStream())) {
+            String op = readString(in);
+            if ("compile".equals(op)) {
+                compile(readString(in), readString(in), out);
+            } else if ("run".equals(op)) {
+                run(readString(in), readString(in), readString(in), in.readInt(), in.readInt(), in.readInt(), out);
+            } else if ("ping".equals(op)) {
+                writeString(out, "pong");
+            }
+            out.flush();
+        } catch (IOException e) {
+            // Client went away; nothing to report to
+        }
+    }
+
+    static void compile(String sourcePath, String outDir, DataOutputStream out) throws IOException {
+        StringWriter diagnostics = new StringWriter();
+        boolean ok;
+        try (StandardJavaFileManager files = COMPILER.getStandardFileManager(null, Locale.ENGLISH, StandardCharsets.UTF_8)) {
+            Iterable<? extends JavaFileObject> units = files.getJavaFileObjects(new File(sourcePath));
+            List<String> options = Arrays.asList("-d", outDir, "-encoding", "UTF-8");
+            ok = COMPILER.getTask(new PrintWriter(diagnostics), files, null, options, null, units).call();
+        } catch (RuntimeException e) {
+            ok = false;
+            diagnostics.write(e.toString());
+        }
+        out.writeInt(ok ? 0 : 1);
+        writeString(out, diagnostics.toString());
+    }
+
+    static void run(String classDir, String className, String stdin, int timeoutMs, int maxOutputBytes,
+                    int maxThreads, DataOutputStream out) throws IOException {
+        JobStreams streams = new JobStreams(stdin.getBytes(StandardCharsets.UTF_8), maxOutputBytes);
+        int[] exitCode = {0};
+
+        URLClassLoader loader = new URLClassLoader(
+            new URL[]{new File(classDir).toURI().toURL()},
+            ClassLoader.getPlatformClassLoader()
+        );
+        ThreadGroup group = new ThreadGroup("job-" + className) {
+            @Override
+            public void uncaughtException(Thread thread, Throwable error) {
+                noteLimit(streams, error);
+                super.uncaughtException(thread, error);
+            }
+        };
+        Thread main = new Thread(group, () -> {
+            CURRENT.set(streams);
+            exitCode[0] = invokeMain(loader, className, streams);
+        }, "main", MAIN_STACK_BYTES);
+        main.setContextClassLoader(loader);
+
+        long deadline = System.currentTimeMillis() + timeoutMs;
+        main.start();
+        boolean timedOut = !joinUntil(main, deadline, streams, group, maxThreads);
+
+        // Like the JVM, wait for non-daemon threads the submission started
+        while (!timedOut && !streams.stopped() && hasLiveNonDaemonThreads(group)) {
+            checkThreads(group, maxThreads, streams);
+            if (System.currentTimeMillis() >= deadline) {
+                timedOut = true;
+            } else {
+                sleepQuietly(5);
+            }
+        }
+        int limit = streams.exceeded ? LIMIT_OUTPUT : streams.limit;
+        boolean leaked = main.isAlive() || hasLiveNonDaemonThreads(group);
+        if (System.out != routedOut || System.err != routedErr || System.in != routedIn) {
+            streamsReplaced = true;
+            restoreStreams();
+        }
+
+        if (!leaked) {
+            loader.close();
+        }
+
+        out.writeInt(timedOut || leaked ? -1 : exitCode[0]);
+        out.writeInt(timedOut && limit == LIMIT_NONE ? 1 : 0);
+        out.writeInt(limit);
+        out.writeInt(streamsReplaced ? 2 : leaked ? 1 : 0);
+        writeString(out, snapshot(streams.out));
+        writeString(out, snapshot(streams.err));
+    }
+
+    static void restoreStreams() {
+        System.setOut(routedOut);
+        System.setErr(routedErr);
+        System.setIn(routedIn);
+    }
+
+    static int invokeMain(ClassLoader loader, String className, JobStreams streams) {
+        try {
+            Class<?> cls = Class.forName(className, true, loader);
+            Method main = cls.getMethod("main", String[].class);
+            if (!Modifier.isStatic(main.getModifiers())) {
+                throw new NoSuchMethodException("main is not static");
+            }
+            main.setAccessible(true);
+            main.invoke(null, (Object) new String[0]);
+            return 0;
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            noteLimit(streams, cause);
+            trimReflectionFrames(cause);
+            PrintStream err = new PrintStream(streams.err, true);
+            err.print("Exception in thread \"main\" ");
+            cause.printStackTrace(err);
+            return 1;
+        } catch (ClassNotFoundException | NoSuchMethodException e) {
+            PrintStream err = new PrintStream(streams.err, true);
+            err.println("Error: Main method not found in class " + className
+                + ", please define the main method as:");
+            err.println("   public static void main(String[] args)");
+            return 1;
+        } catch (Throwable e) {
+            noteLimit(streams, e);
+            PrintStream err = new PrintStream(streams.err, true);
+            e.printStackTrace(err);
+            return 1;
+        }
+    }
+
+    /** Flag a job whose error shows it ran out of heap or native threads */
+    static void noteLimit(JobStreams streams, Throwable error) {
+        if (error instanceof OutOfMemoryError) {
+            streams.limit = String.valueOf(error.getMessage()).contains("native thread") ? LIMIT_THREADS : LIMIT_MEMORY;
+        }
+    }
+
+    /** Flag a job running more threads than maxThreads (0 = no cap) */
+    static void checkThreads(ThreadGroup group, int maxThreads, JobStreams streams) {
+        if (maxThreads > 0 && group.activeCount() > maxThreads) {
+            streams.limit = LIMIT_THREADS;
+        }
+    }
+
+    /** Cut the stack trace at the reflective call into the submission */
+    static void trimReflectionFrames(Throwable error) {
+        StackTraceElement[] frames = error.getStackTrace();
+        List<StackTraceElement> kept = new ArrayList<>();
+        for (StackTraceElement frame : frames) {
+            String cls = frame.getClassName();
+            if (cls.startsWith("jdk.internal.reflect.") || cls.startsWith("java.lang.reflect.")
+                    || cls.equals(JavaRunner.class.getName())) {
+                break;
+            }
+            kept.add(frame);
+        }
+        error.setStackTrace(kept.toArray(new StackTraceElement[0]));
+    }
+
+    /** Wait for a thread until the deadline (false) or until the job hits a limit */
+    static boolean joinUntil(Thread thread, long deadline, JobStreams streams, ThreadGroup group, int maxThreads) {
+        while (thread.isAlive() && !streams.stopped()) {
+            checkThreads(group, maxThreads, streams);
+            long remaining = deadline - System.currentTimeMillis();
+            if (remaining <= 0) {
+                return false;
+            }
+            try {
+                thread.join(Math.min(remaining, 10));
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+                return false;
+            }
+        }
+        return true;
+    }
+
+    static boolean hasLiveNonDaemonThreads(ThreadGroup group) {
+        Thread[] threads = new Thread[group.activeCount() + 4];
+        int count = group.enumerate(threads, true);
+        for (int i = 0; i < count; i++) {
+            if (threads[i].isAlive() && !threads[i].isDaemon()) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    static void sleepQuietly(long millis) {
+        try {
+            Thread.sleep(millis);
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+        }
+    }
+
+    static String snapshot(CappedBuffer buffer) {
+        return new String(buffer.toByteArray(), StandardCharsets.UTF_8);
+    }
+
+    static String readString(DataInputStream in) throws IOException {
+        byte[] bytes = new byte[in.readInt()];
+        in.readFully(bytes);
+        return new String(bytes, StandardCharsets.UTF_8);
+    }
+
+    static void writeString(DataOutputStream out, String value) throws IOException {
+        byte[] bytes = value.getBytes(StandardCharsets.UTF_8);
+        out.writeInt(bytes.length);
+        out.write(bytes);
+    }
+}
@@ -0,0 +1,329 @@
+"""
+Output Checkers
+Decide whether a run's stdout answers a test case. Output is fed to a
+checker chunk by chunk while the program runs, so the comparison never
+needs the whole output in one string, and a checker reports a mismatch as
+soon as the output can no longer match (the caller may then stop the run).
+
+Checkers:
+- exact: byte-for-byte equal
+- lines: line by line, ignoring trailing whitespace and leading/trailing
+  blank lines (the default, and the rule /run-batch always used)
+- whitespace: equal as whitespace-separated tokens
+- float: tokens, numbers equal within abs_tolerance or rel_tolerance
+- unordered: the same lines in any order
+- custom: a Python script called as `script input output answer` after the
+  run; exit code 0 accepts, 1 rejects, anything else is a checker error
+
+Verdicts: passed, failed, checker_error
+"""
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Optional
+
+from sandbox import ResourceLimits, run_process
+
+CHECKER_TYPES = ("exact", "lines", "whitespace", "float", "unordered", "custom")
+
+# Longest value quoted in a mismatch message
+QUOTE_CHARS = 60
+
+# Time a custom checker script gets to decide
+CUSTOM_CHECKER_TIMEOUT = 10
+
+
+def quote(value: str) -> str:
+    return repr(value if len(value) <= QUOTE_CHARS else value[:QUOTE_CHARS] + "...")
+
+
+class Checker:
+    """Incremental comparison of a run's stdout against the expected output"""
+
+    name = ""
+
+    def __init__(self, stop_on_mismatch: bool = True):
+        self.stop_on_mismatch = stop_on_mismatch
+        # Characters of stdout seen so far
+        self.received = 0
+        self.mismatch = None
+
+    def feed(self, data: str) -> bool:
+        """Take the next chunk of stdout; False once the output can no longer match"""
+        self.received += len(data)
+        if self.mismatch is None:
+            self._feed(data)
+        return self.mismatch is None
+
+    def finish(self) -> dict:
+        """The verdict, once all of stdout has been fed"""
+        if self.mismatch is None:
+            self._finish()
+        if self.mismatch is not None:
+            return {"verdict": "failed", "checker": self.name, "message": self.mismatch}
+        return {"verdict": "passed", "checker": self.name, "message": ""}
+
+    def close(self):
+        """Release anything held for a check that will not be finished"""
+
+    def _feed(self, data: str):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class ExactChecker(Checker):
+    name = "exact"
+
+    def __init__(self, expected: str, **options):
+        super().__init__(**options)
+        self.expected = expected
+        self.position = 0
+
+    def _feed(self, data: str):
+        if not self.expected.startswith(data, self.position):
+            self.mismatch = f"output differs from the expected output at character {self._first_difference(data)}"
+        self.position += len(data)
+
+    def _finish(self):
+        if self.position < len(self.expected):
+            self.mismatch = f"output ends at character {self.position} of {len(self.expected)}"
+
+    def _first_difference(self, data: str) -> int:
+        for offset, char in enumerate(data):
+            index = self.position + offset
+            if index >= len(self.expected) or self.expected[index] != char:
+                return index
+        return self.position + len(data)
+
+
+class LineChecker(Checker):
+    """Line by line, ignoring trailing whitespace and leading/trailing blank lines"""
+
+    name = "lines"
+
+    def __init__(self, expected: str, **options):
+        super().__init__(**options)
+        self.expected = [line.rstrip() for line in expected.strip().splitlines()]
+        self.line_number = 0
+        self._partial = ""
+        self._started = False
+        self._blank_lines = 0
+
+    def _feed(self, data: str):
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._take(line.rstrip())
+            if self.mismatch is not None:
+                return
+
+    def _finish(self):
+        if self._partial:
+            self._take(self._partial.rstrip())
+        if self.mismatch is None and self.line_number < len(self.expected):
+            self.mismatch = f"output has {self.line_number} lines, expected {len(self.expected)}"
+
+    def _take(self, line: str):
+        # Blank lines only count once a non-blank line follows them
+        if not line:
+            if self._started:
+                self._blank_lines += 1
+            return
+        if not self._started:
+            line = line.lstrip()
+            self._started = True
+        for _ in range(self._blank_lines):
+            self._compare("")
+            if self.mismatch is not None:
+                return
+        self._blank_lines = 0
+        self._compare(line)
+
+    def _compare(self, line: str):
+        if self.line_number >= len(self.expected):
+            self.mismatch = f"line {self.line_number + 1}: unexpected extra output {quote(line)}"
+        elif line != self.expected[self.line_number]:
+            self.mismatch = (f"line {self.line_number + 1}: expected {quote(self.expected[self.line_number])}, "
+                             f"got {quote(line)}")
+        self.line_number += 1
+
+
+class TokenChecker(Checker):
+    """Whitespace-separated tokens, however they are laid out"""
+
+    name = "whitespace"
+
+    def __init__(self, expected: str, **options):
+        super().__init__(**options)
+        self.expected = expected.split()
+        self.token_number = 0
+        self._partial = ""
+
+    def _feed(self, data: str):
+        tokens = (self._partial + data).split()
+        # A chunk that does not end in whitespace may end mid-token
+        self._partial = tokens.pop() if tokens and not data[-1:].isspace() else ""
+        for token in tokens:
+            self._take(token)
+            if self.mismatch is not None:
+                return
+
+    def _finish(self):
+        if self._partial:
+            self._take(self._partial)
+        if self.mismatch is None and self.token_number < len(self.expected):
+            self.mismatch = f"output has {self.token_number} tokens, expected {len(self.expected)}"
+
+    def _take(self, token: str):
+        if self.token_number >= len(self.expected):
+            self.mismatch = f"token {self.token_number + 1}: unexpected extra output {quote(token)}"
+        elif not self._same(token, self.expected[self.token_number]):
+            self.mismatch = (f"token {self.token_number + 1}: expected {quote(self.expected[self.token_number])}, "
+                             f"got {quote(token)}")
+        self.token_number += 1
+
+    def _same(self, actual: str, expected: str) -> bool:
+        return actual == expected
+
+
+class FloatChecker(TokenChecker):
+    """Tokens, with numbers compared within an absolute or relative tolerance"""
+
+    name = "float"
+
+    def __init__(self, expected: str, abs_tolerance: float = 1e-6, rel_tolerance: float = 1e-6, **options):
+        super().__init__(expected, **options)
+        self.abs_tolerance = abs_tolerance
+        self.rel_tolerance = rel_tolerance
+
+    def _same(self, actual: str, expected: str) -> bool:
+        if actual == expected:
+            return True
+        try:
+            actual_value, expected_value = float(actual), float(expected)
+        except ValueError:
+            return False
+        return math.isclose(actual_value, expected_value, rel_tol=self.rel_tolerance, abs_tol=self.abs_tolerance)
+
+
+class UnorderedChecker(Checker):
+    """The expected lines in any order (blank lines and trailing whitespace ignored)"""
+
+    name = "unordered"
+
+    def __init__(self, expected: str, **options):
+        super().__init__(**options)
+        self.remaining = Counter(line.strip() for line in expected.splitlines() if line.strip())
+        self._partial = ""
+
+    def _feed(self, data: str):
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._take(line.strip())
+            if self.mismatch is not None:
+                return
+
+    def _finish(self):
+        if self._partial.strip():
+            self._take(self._partial.strip())
+        missing = sum(self.remaining.values())
+        if self.mismatch is None and missing:
+            line = next(line for line, count in self.remaining.items() if count)
+            self.mismatch = f"{missing} expected lines missing, e.g. {quote(line)}"
+
+    def _take(self, line: str):
+        if not line:
+            return
+        if self.remaining[line] <= 0:
+            self.mismatch = f"unexpected line {quote(line)}"
+        else:
+            self.remaining[line] -= 1
+
+
+class CustomChecker(Checker):
+    """
+    A checker script run once the program has finished. Output is spooled to
+    a file as it arrives, so custom checkers never stop a run early.
+    """
+
+    name = "custom"
+
+    def __init__(self, expected: str, script: str, stdin: str = "",
+                 limits: Optional[ResourceLimits] = None, **options):
+        super().__init__(**options)
+        self.stop_on_mismatch = False
+        self.expected = expected
+        self.script = script
+        self.stdin = stdin
+        self.limits = limits
+        # Files are only written once the run produces output or finishes
+        self.workdir = None
+        self._output = None
+
+    def _feed(self, data: str):
+        self._open().write(data)
+
+    def finish(self) -> dict:
+        try:
+            self._open().close()
+            paths = [os.path.join(self.workdir, name) for name in ("checker.py", "input", "output", "answer")]
+            run = run_process([sys.executable, *paths], timeout=CUSTOM_CHECKER_TIMEOUT, cwd=self.workdir,
+                              limits=self.limits)
+        finally:
+            self.close()
+        message = (run["stdout"] or run["stderr"]).strip()
+        if run["exit_code"] == 0:
+            return {"verdict": "passed", "checker": self.name, "message": message}
+        if run["exit_code"] == 1:
+            return {"verdict": "failed", "checker": self.name, "message": message}
+        if run["timed_out"]:
+            message = f"checker timed out after {CUSTOM_CHECKER_TIMEOUT} seconds"
+        return {"verdict": "checker_error", "checker": self.name, "message": message}
+
+    def close(self):
+        if self.workdir is not None:
+            self._output.close()
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    def _open(self):
+        """The spooled output file, writing the checker's other files first time round"""
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="checker_")
+            # The checker may run as an unprivileged uid (SANDBOX_UID_BASE) that must read these files
+            os.chmod(self.workdir, 0o755)
+            for name, content in (("checker.py", self.script), ("input", self.stdin), ("answer", self.expected)):
+                with open(os.path.join(self.workdir, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+            self._output = open(os.path.join(self.workdir, "output"), "w", encoding="utf-8")
+        return self._output
+
+
+def create_checker(config: dict, expected: str, stdin: str = "",
+                   limits: Optional[ResourceLimits] = None) -> Checker:
+    """A fresh checker for one run; config holds type, tolerances, script and stop_on_mismatch"""
+    kind = config.get("type") or "lines"
+    options = {"stop_on_mismatch": config.get("stop_on_mismatch", True)}
+    if kind == "exact":
+        return ExactChecker(expected, **options)
+    if kind == "lines":
+        return LineChecker(expected, **options)
+    if kind == "whitespace":
+        return TokenChecker(expected, **options)
+    if kind == "float":
+        return FloatChecker(expected, abs_tolerance=config.get("abs_tolerance", 1e-6),
+                            rel_tolerance=config.get("rel_tolerance", 1e-6), **options)
+    if kind == "unordered":
+        return UnorderedChecker(expected, **options)
+    if kind == "custom":
+        if not config.get("script"):
+            raise ValueError("custom checker needs a script")
+        return CustomChecker(expected, config["script"], stdin, limits, **options)
+    raise ValueError(f"unknown checker type {kind!r}, expected one of {', '.join(CHECKER_TYPES)}")
@@ -0,0 +1,78 @@
+"""
+Execution Worker
+Runs /run jobs from the job queue when the API is in queue mode
+(EXECUTION_MODE=queue). Start as many as needed, one per core or node,
+all pointed at the same JOB_QUEUE_PATH:
+
+    python execution_worker.py
+
+Each worker warms the same pools, JVM daemon and caches as the API would
+and executes up to EXECUTION_WORKER_THREADS jobs at a time. SIGTERM/SIGINT
+stop it after the jobs in hand are finished.
+"""
+
+import asyncio
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+import main as service
+from job_queue import create_queue_from_env
+
+# How long an idle worker thread sleeps before looking at the queue again
+POLL_INTERVAL_SECONDS = float(os.getenv("EXECUTION_WORKER_POLL_INTERVAL", "0.05"))
+
+# Finished jobs past their retention are purged this often
+PURGE_INTERVAL_SECONDS = 60
+
+
+def work(queue, worker_id: str, stopping: threading.Event):
+    while not stopping.is_set():
+        job = queue.claim(worker_id)
+        if job is None:
+            stopping.wait(POLL_INTERVAL_SECONDS)
+            continue
+        try:
+            result = service.execute_run_request(service.RunRequest(**job["payload"]),
+                                                 queue_wait=max(0.0, time.time() - job["created_at"]))
+        except Exception as e:
+            result = {"error": f"worker failed: {e}"}
+        if not queue.complete(job["id"], worker_id, result):
+            print(f"✗ Job {job['id']} was reassigned before {worker_id} finished it")
+
+
+def main():
+    queue = create_queue_from_env()
+    threads = int(os.getenv("EXECUTION_WORKER_THREADS", str(os.cpu_count() or 2)))
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    asyncio.run(service.startup())
+    # Each thread claims under its own id, so a job whose lease ran out and was
+    # handed to another thread of this process can only be completed by that thread
+    workers = [
+        threading.Thread(target=work, args=(queue, f"{worker_id}-t{i}", stopping), name=f"job-worker-{i}")
+        for i in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    print(f"✓ Execution worker {worker_id} polling {queue.path} with {threads} threads")
+
+    while not stopping.wait(PURGE_INTERVAL_SECONDS):
+        purged = queue.purge()
+        if purged:
+            print(f"✓ Purged {purged} finished jobs")
+
+    for thread in workers:
+        thread.join()
+    asyncio.run(service.shutdown())
+
+
+if __name__ == "__main__":
+    main()
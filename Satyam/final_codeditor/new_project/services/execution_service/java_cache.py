@@ -0,0 +1,256 @@
+"""
+Java Compilation Cache
+Content-addressed store of compiled class directories so repeat runs of the
+same source skip javac entirely.
+
+Entries live in <JAVA_CACHE_DIR>/<sha256(jdk version + source)>/ and are
+evicted least-recently-used first once the total size exceeds the budget.
+
+The directory may be shared by several processes (uvicorn and queue
+workers), each with its own index of the entries it has used. An entry
+another process stored is a hit here too, and storing a key that already
+exists keeps the existing copy. An entry in use by a job is pinned with a
+shared flock on its directory. Eviction takes the exclusive lock without
+waiting, so no process deletes classes another process is running from.
+
+Configuration (environment):
+- JAVA_CACHE_DIR: cache root (default: <tmp>/codeplay-java-cache)
+- JAVA_CACHE_MAX_MB: disk budget in megabytes, 0 disables the cache
+"""
+
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+ENTRY_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+# Staging and eviction directories younger than this may belong to another live process
+STALE_SECONDS = 600
+
+
+def detect_jdk_version() -> str:
+    """Version string of the JDK on PATH, part of every cache key"""
+    try:
+        result = subprocess.run(["javac", "-version"], capture_output=True, timeout=30)
+        return (result.stdout or result.stderr).decode(errors="replace").strip() or "unknown"
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class CompileCache:
+    """LRU-by-disk-size cache of compiled class directories"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.jdk_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> size in bytes, oldest first
+        self._pins = {}
+        self._pin_fds = {}  # key -> directory fd holding the shared flock while pinned
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Index entries left by a previous run and drop half-written ones"""
+        os.makedirs(self.root, exist_ok=True)
+        self.jdk_version = detect_jdk_version()
+        found = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                continue
+            if ENTRY_NAME.match(name) and os.path.isdir(path):
+                found.append((modified, name, directory_size(path)))
+            elif now - modified > STALE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            for _, name, size in sorted(found):
+                self._entries[name] = size
+                self._bytes += size
+            self._evict_locked()
+        print(f"✓ Java compile cache ready ({len(found)} entries, {self.jdk_version})")
+
+    def key(self, source: str) -> str:
+        digest = hashlib.sha256()
+        digest.update((self.jdk_version or "unknown").encode())
+        digest.update(b"\0")
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def acquire(self, key: str) -> Optional[str]:
+        """Return a pinned class directory for key, or None on a miss"""
+        path = os.path.join(self.root, key)
+        with self._lock:
+            if key not in self._entries and os.path.isdir(path):
+                # Stored by another process sharing the directory
+                self._index_locked(key, directory_size(path))
+            if key not in self._entries or not self._pin_locked(key):
+                self._forget_locked(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def store(self, key: str, class_dir: str) -> Optional[str]:
+        """
+        Move a freshly compiled class directory into the cache and pin it.
+        Returns None, with class_dir left in place and nothing pinned, when
+        no entry could be kept for key.
+        """
+        target = os.path.join(self.root, key)
+        size = directory_size(class_dir)
+
+        # Stage inside the cache root so the final rename is atomic
+        staging = tempfile.mkdtemp(prefix=".store-", dir=self.root)
+        staged = os.path.join(staging, "classes")
+        shutil.move(class_dir, staged)
+
+        stored = None
+        with self._lock:
+            # One retry: an existing entry can be evicted between the rename and the pin
+            for _ in range(2):
+                if not os.path.isdir(target):
+                    try:
+                        os.rename(staged, target)
+                    except OSError:
+                        if not os.path.isdir(target):
+                            break
+                # If another request or process compiled the same source first, use its copy
+                if key not in self._entries:
+                    self._index_locked(key, size)
+                if self._pin_locked(key):
+                    self._entries.move_to_end(key)
+                    stored = target
+                    break
+                self._forget_locked(key)
+            self._evict_locked()
+
+        if stored is None and os.path.isdir(staged):
+            shutil.move(staged, class_dir)
+        shutil.rmtree(staging, ignore_errors=True)
+        return stored
+
+    def release(self, key: str):
+        with self._lock:
+            remaining = self._pins.get(key, 0) - 1
+            if remaining > 0:
+                self._pins[key] = remaining
+            else:
+                self._pins.pop(key, None)
+                fd = self._pin_fds.pop(key, None)
+                if fd is not None:
+                    os.close(fd)
+            self._evict_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def _index_locked(self, key: str, size: int):
+        self._entries[key] = size
+        self._bytes += size
+
+    def _forget_locked(self, key: str):
+        if key in self._entries and key not in self._pins:
+            self._bytes -= self._entries.pop(key)
+
+    def _pin_locked(self, key: str) -> bool:
+        """Pin key, taking the shared flock on its first pin; False if the entry is gone"""
+        if key in self._pins:
+            self._pins[key] += 1
+            return True
+        path = os.path.join(self.root, key)
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return False
+        # Waits only while another process is evicting the entry
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            present = os.path.samestat(os.fstat(fd), os.stat(path))
+        except OSError:
+            present = False
+        if not present:
+            os.close(fd)
+            return False
+        self._pins[key] = 1
+        self._pin_fds[key] = fd
+        return True
+
+    def _evict_locked(self):
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                return
+            if key in self._pins:
+                continue
+            self._bytes -= self._entries.pop(key)
+            path = os.path.join(self.root, key)
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError:
+                # Already evicted by another process
+                continue
+            try:
+                # Pinned by another process: leave it, it is only out of this index
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            # Renamed away under the lock, so nobody can pin it once it is released
+            doomed = tempfile.mkdtemp(prefix=".evict-", dir=self.root)
+            try:
+                os.rename(path, os.path.join(doomed, "classes"))
+                self.evictions += 1
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+            shutil.rmtree(doomed, ignore_errors=True)
+
+
+def create_cache_from_env() -> Optional[CompileCache]:
+    """Build the cache from environment settings, or None when disabled"""
+    max_mb = int(os.getenv("JAVA_CACHE_MAX_MB", "256"))
+    if max_mb <= 0:
+        return None
+    root = os.getenv("JAVA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "codeplay-java-cache"))
+    return CompileCache(root, max_mb * 1024 * 1024)
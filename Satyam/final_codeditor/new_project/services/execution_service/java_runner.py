@@ -0,0 +1,282 @@
+"""
+Persistent JVM Client
+Talks to the JavaRunner daemon over a loopback socket so Java submissions
+skip the javac and java process start-ups.
+
+Configuration (environment):
+- JAVA_DAEMON_ENABLED: "0" disables the daemon (subprocess javac/java only)
+- JAVA_DAEMON_THREADS: handler threads inside the daemon
+- JAVA_DAEMON_OPTS: extra JVM options, e.g. "-Xmx512m"
+
+No single job's memory or threads can be capped inside the shared JVM. With
+a memory or process limit set (SANDBOX_* settings), the daemon therefore
+runs inside a cgroup of its own: heap capped at the per-run memory limit,
+memory.max and pids.max sized for the whole JVM. A job that runs out of heap
+or threads there, or starts more threads than one run may, is repeated in a
+JVM of its own, where the limits are exact. Without a usable cgroup
+(SANDBOX_CGROUP_ROOT) the daemon only compiles.
+"""
+
+import os
+import re
+import socket
+import struct
+import subprocess
+import threading
+from typing import Optional
+
+from sandbox import Cgroup, ResourceLimits
+
+RUNNER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Extra time allowed for the daemon to answer after the job timeout
+RESPONSE_GRACE_SECONDS = 5
+
+# Submissions that could take the whole daemon down, or change JVM-wide state
+# other jobs rely on (the per-job System.in/out/err routing, system
+# properties, the security manager), run in their own JVM. A static import
+# of System or Runtime hides such calls, so it counts too. So do programs that
+# start processes, which would escape the run's limits and uid in the daemon.
+UNSAFE_IN_DAEMON = re.compile(
+    r'System\s*\.\s*(?:exit|setOut|setErr|setIn|setSecurityManager|setPropert(?:y|ies)|clearProperty)\b'
+    r'|Runtime\s*\.\s*getRuntime\s*\(\s*\)\s*\.\s*(?:exit|halt|exec)'
+    r'|\bProcessBuilder\b'
+    r'|import\s+static\s+java\s*\.\s*lang\s*\.\s*(?:System|Runtime)\b'
+)
+
+# "limit" values from the daemon; memory and threads mean "repeat in a JVM of its own"
+LIMIT_OUTPUT = 1
+LIMIT_MEMORY = 2
+LIMIT_THREADS = 3
+
+# "leaked" values from the daemon: threads of the run still going, or System streams replaced
+LEAKED_THREADS = 1
+LEAKED_STREAMS = 2
+
+
+class JavaDaemonError(Exception):
+    """Raised when the daemon is unavailable or misbehaves; the caller should fall back"""
+
+
+def _send_string(buffer: bytearray, value: str):
+    data = value.encode("utf-8")
+    buffer += struct.pack(">i", len(data)) + data
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise JavaDaemonError("daemon closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_int(sock: socket.socket) -> int:
+    return struct.unpack(">i", _recv_exact(sock, 4))[0]
+
+
+def _recv_string(sock: socket.socket) -> str:
+    return _recv_exact(sock, _recv_int(sock)).decode("utf-8", errors="replace")
+
+
+class JavaDaemon:
+    """Owns the JavaRunner process and restarts it when it gets wedged"""
+
+    def __init__(self, threads: int, jvm_options: list, limits: Optional[ResourceLimits] = None):
+        self.threads = threads
+        self.jvm_options = jvm_options
+        self.limits = limits
+        self.process = None
+        # The cgroup holding self.process, when limits call for one
+        self.cgroup = None
+        self.port = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self):
+        """Launch the daemon in the background; runs fall back until it is ready"""
+        with self._lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+            self._ready.clear()
+            self.port = None
+            self.cgroup = self._create_cgroup()
+            try:
+                self.process = subprocess.Popen(
+                    self._command(),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    cwd=RUNNER_DIR,
+                    preexec_fn=self.cgroup.enter if self.cgroup is not None else None
+                )
+            except OSError as e:
+                self.process = None
+                self._remove_cgroup(self.cgroup)
+                self.cgroup = None
+                print(f"✗ Java daemon could not be started: {e}")
+                return
+            threading.Thread(target=self._wait_ready, args=(self.process,), daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            process, self.process = self.process, None
+            cgroup, self.cgroup = self.cgroup, None
+            self._ready.clear()
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        self._remove_cgroup(cgroup)
+
+    def restart(self, failed: Optional[subprocess.Popen] = None):
+        """Throw away a wedged daemon; a no-op if someone already replaced it"""
+        with self._lock:
+            if failed is not None and failed is not self.process:
+                return
+            process, self.process = self.process, None
+            cgroup, self.cgroup = self.cgroup, None
+            self._ready.clear()
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        self._remove_cgroup(cgroup)
+        self.start()
+
+    def restart_in_background(self, failed: subprocess.Popen):
+        """Replace failed, the daemon a request went to, unless it has been replaced already"""
+        threading.Thread(target=self.restart, args=(failed,), daemon=True).start()
+
+    def ready(self) -> bool:
+        return self._ready.is_set() and self.process is not None and self.process.poll() is None
+
+    def can_run(self, code_content: str) -> bool:
+        return self.ready() and not UNSAFE_IN_DAEMON.search(code_content)
+
+    def runs_programs(self) -> bool:
+        """Whether programs may run in the daemon, not just compile there"""
+        return not self._limited() or self.cgroup is not None
+
+    def mode(self) -> str:
+        """What the daemon is used for, for /health"""
+        if self.runs_programs():
+            return "compile and run" + (" (in its own cgroup)" if self.cgroup is not None else "")
+        return "compile only (memory or process limits set, and no cgroup for the daemon)"
+
+    def compile(self, source_path: str, out_dir: str, timeout: float) -> dict:
+        """Compile one source file into out_dir with the in-process compiler"""
+        payload = bytearray()
+        for value in ("compile", source_path, out_dir):
+            _send_string(payload, value)
+        sock, process = self._connect(timeout)
+        with sock:
+            try:
+                sock.sendall(payload)
+                exit_code = _recv_int(sock)
+                diagnostics = _recv_string(sock)
+            except OSError as e:
+                self.restart_in_background(process)
+                raise JavaDaemonError(f"compile request failed: {e}")
+        return {"exit_code": exit_code, "stderr": diagnostics}
+
+    def run(self, class_dir: str, class_name: str, stdin_data: str, timeout: float,
+            max_output_bytes: Optional[int] = None, max_threads: Optional[int] = None) -> dict:
+        """Run a compiled class in a fresh classloader inside the daemon"""
+        payload = bytearray()
+        for value in ("run", class_dir, class_name, stdin_data or ""):
+            _send_string(payload, value)
+        payload += struct.pack(">iii", int(timeout * 1000), max_output_bytes or 0, max_threads or 0)
+        sock, process = self._connect(timeout)
+        with sock:
+            try:
+                sock.sendall(payload)
+                exit_code = _recv_int(sock)
+                timed_out = _recv_int(sock) == 1
+                limit = _recv_int(sock)
+                leaked = _recv_int(sock)
+                stdout = _recv_string(sock)
+                stderr = _recv_string(sock)
+            except OSError as e:
+                self.restart_in_background(process)
+                raise JavaDaemonError(f"run request failed: {e}")
+
+        if leaked:
+            # The JVM cannot kill the runaway threads, nor undo what other jobs saw, so the daemon goes
+            self.restart_in_background(process)
+        if leaked == LEAKED_STREAMS:
+            raise JavaDaemonError("a submission replaced System.in/out/err, so the output is not this run's")
+        if limit in (LIMIT_MEMORY, LIMIT_THREADS):
+            raise JavaDaemonError(f"run hit the daemon's shared {'heap' if limit == LIMIT_MEMORY else 'thread'} "
+                                  f"limit, repeating it in its own JVM")
+        return {
+            "stdout": stdout,
+            "stderr": stderr,
+            "exit_code": exit_code,
+            "timed_out": timed_out,
+            "limit_exceeded": "output" if limit == LIMIT_OUTPUT else None
+        }
+
+    def _command(self) -> list:
+        compiled = os.path.exists(os.path.join(RUNNER_DIR, "JavaRunner.class"))
+        target = ["-cp", RUNNER_DIR, "JavaRunner"] if compiled else [os.path.join(RUNNER_DIR, "JavaRunner.java")]
+        # One run may use the heap a JVM of its own would get, and never more
+        heap = []
+        if self._limited() and self.limits.memory_mb and not any(o.startswith("-Xmx") for o in self.jvm_options):
+            heap = [f"-Xmx{self.limits.memory_mb}m"]
+        return ["java", *heap, *self.jvm_options, *target, "0", str(self.threads)]
+
+    def _limited(self) -> bool:
+        return self.limits is not None and bool(self.limits.memory_mb or self.limits.max_processes)
+
+    def _create_cgroup(self) -> Optional[Cgroup]:
+        """A cgroup for a new daemon process: one run's JVM allowance plus the handler threads"""
+        if not self._limited():
+            return None
+        processes = self.limits.max_processes + self.threads if self.limits.max_processes else None
+        return Cgroup.create(self.limits.replace(jvm=True, max_processes=processes))
+
+    @staticmethod
+    def _remove_cgroup(cgroup: Optional[Cgroup]):
+        if cgroup is not None:
+            cgroup.remove()
+
+    def _wait_ready(self, process: subprocess.Popen):
+        line = process.stdout.readline().decode(errors="replace").strip()
+        if not line.startswith("READY "):
+            print(f"✗ Java daemon failed to start: {line or 'no output'}")
+            return
+        with self._lock:
+            if process is self.process:
+                self.port = int(line.split()[1])
+                self._ready.set()
+        print(f"✓ Java daemon ready on port {line.split()[1]}")
+
+        # Keep draining so stray output from the daemon can never block it
+        for _ in process.stdout:
+            pass
+
+    def _connect(self, timeout: float) -> tuple:
+        """A connection to the current daemon, and the daemon process it goes to"""
+        with self._lock:
+            process, port = self.process, self.port
+        if not self._ready.is_set() or process is None or process.poll() is not None or port is None:
+            raise JavaDaemonError("daemon is not running")
+        try:
+            sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+            sock.settimeout(timeout + RESPONSE_GRACE_SECONDS)
+            return sock, process
+        except OSError as e:
+            self.restart_in_background(process)
+            raise JavaDaemonError(f"cannot reach daemon: {e}")
+
+
+def create_daemon_from_env() -> Optional[JavaDaemon]:
+    """Build the daemon client from environment settings, or None when disabled"""
+    if os.getenv("JAVA_DAEMON_ENABLED", "1") == "0":
+        return None
+    return JavaDaemon(
+        threads=int(os.getenv("JAVA_DAEMON_THREADS", str((os.cpu_count() or 2) * 2))),
+        jvm_options=os.getenv("JAVA_DAEMON_OPTS", "").split(),
+        limits=ResourceLimits.from_env()
+    )
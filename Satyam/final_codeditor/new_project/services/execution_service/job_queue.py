@@ -0,0 +1,251 @@
+"""
+Execution Job Queue
+Durable FIFO of /run jobs shared by the API (which enqueues) and any number
+of execution_worker.py processes (which claim and complete them).
+
+Backed by a SQLite file in WAL mode, so it needs no broker and works for
+every process that can open the file: one node, or several sharing a
+volume that supports SQLite locking. A claimed job carries a lease; if its
+worker dies, the job goes back to the queue when the lease runs out, up to
+max_attempts times.
+
+States: queued -> running -> done (the result is stored with the job)
+
+Jobs are claimed in order of due time: enqueue time plus a delay for their
+priority class, so a Submit overtakes recent Runs and re-grades, while a
+re-grade that has waited longer than its delay still gets its turn. A
+candidate (user_id) never has more than user_limit jobs running at once.
+
+Configuration (environment):
+- JOB_QUEUE_PATH: queue database file
+- JOB_LEASE_SECONDS: how long a worker may hold a job before it is retried
+- JOB_MAX_ATTEMPTS: claims per job before it is given up on
+- JOB_RETENTION_SECONDS: how long finished jobs are kept for polling
+- JOB_PRIORITY_DELAYS: per-class delays in seconds, e.g. "submit=0,run=2,regrade=30"
+- SCHEDULER_USER_CONCURRENCY: jobs one candidate may have running at once
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Optional
+
+from scheduler import PRIORITY_CLASSES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    priority TEXT NOT NULL DEFAULT 'run',
+    user_id TEXT,
+    due_at REAL
+);
+"""
+
+# Columns added after the first release, for queue files created before them
+MIGRATIONS = {
+    "priority": "ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'run'",
+    "user_id": "ALTER TABLE jobs ADD COLUMN user_id TEXT",
+    "due_at": "ALTER TABLE jobs ADD COLUMN due_at REAL"
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs (state, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_due ON jobs (state, due_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_state ON jobs (user_id, state);
+"""
+
+DEFAULT_PRIORITY_DELAYS = {"submit": 0.0, "run": 2.0, "regrade": 30.0}
+
+# Jobs started within this window feed the per-class wait figures in stats()
+WAIT_WINDOW_SECONDS = 300
+
+
+def parse_priority_delays(value: str) -> dict:
+    delays = dict(DEFAULT_PRIORITY_DELAYS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, delay = item.partition("=")
+        if name.strip() in delays:
+            delays[name.strip()] = max(float(delay), 0.0)
+    return delays
+
+
+class JobQueue:
+    """SQLite-backed job queue; safe to use from many threads and processes"""
+
+    def __init__(self, path: str, lease_seconds: float = 120, max_attempts: int = 3,
+                 retention_seconds: float = 3600, user_limit: int = 0, priority_delays: Optional[dict] = None):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.user_limit = user_limit
+        self.priority_delays = priority_delays or dict(DEFAULT_PRIORITY_DELAYS)
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def enqueue(self, payload: dict, priority: str = "run", user_id: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, state, payload, created_at, priority, user_id, due_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), now, priority, user_id or None,
+                 now + self.priority_delays.get(priority, 0.0))
+            )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """Take the most due runnable job (queued, or running with an expired lease), or None"""
+        now = time.time()
+        # Candidates already at their cap wait until one of their jobs finishes
+        user_filter = (
+            "AND (j.user_id IS NULL OR (SELECT COUNT(*) FROM jobs r WHERE r.user_id = j.user_id "
+            "AND r.state = 'running' AND r.lease_expires >= :now) < :user_limit) "
+            if self.user_limit > 0 else ""
+        )
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT j.id, j.payload, j.attempts, j.created_at FROM jobs j "
+                    "WHERE (j.state = 'queued' OR (j.state = 'running' AND j.lease_expires < :now)) "
+                    + user_filter +
+                    "ORDER BY COALESCE(j.due_at, j.created_at) LIMIT 1",
+                    {"now": now, "user_limit": self.user_limit}
+                ).fetchone()
+                if row is None:
+                    return None
+                job_id, payload, attempts, created_at = row
+                if attempts >= self.max_attempts:
+                    # Its workers keep dying on it; stop handing it out
+                    conn.execute(
+                        "UPDATE jobs SET state = 'done', result = ?, finished_at = ? WHERE id = ?",
+                        (json.dumps({"status": "error", "error": f"job abandoned after {attempts} attempts"}),
+                         now, job_id)
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET state = 'running', worker_id = ?, attempts = attempts + 1, "
+                    "started_at = ?, lease_expires = ? WHERE id = ?",
+                    (worker_id, now, now + self.lease_seconds, job_id)
+                )
+                return {"id": job_id, "payload": json.loads(payload), "attempts": attempts + 1,
+                        "created_at": created_at}
+
+    def complete(self, job_id: str, worker_id: str, result: dict) -> bool:
+        """Store a job's result; False if the job was meanwhile handed to another worker"""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, finished_at = ? "
+                "WHERE id = ? AND state = 'running' AND worker_id = ?",
+                (json.dumps(result), time.time(), job_id, worker_id)
+            ).rowcount
+        return updated == 1
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT state, result, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        state, result, created_at, started_at, finished_at = row
+        return {
+            "job_id": job_id,
+            "state": state,
+            "result": json.loads(result) if result is not None else None,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at
+        }
+
+    def purge(self) -> int:
+        """Drop finished jobs older than the retention period"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE state = 'done' AND finished_at < ?",
+                (time.time() - self.retention_seconds,)
+            ).rowcount
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        stats = {state: counts.get(state, 0) for state in ("queued", "running", "done")}
+
+        queued = dict(conn.execute(
+            "SELECT priority, COUNT(*) FROM jobs WHERE state = 'queued' GROUP BY priority"
+        ).fetchall())
+        waits = {
+            priority: (average, longest)
+            for priority, average, longest in conn.execute(
+                "SELECT priority, AVG(started_at - created_at), MAX(started_at - created_at) FROM jobs "
+                "WHERE started_at >= ? GROUP BY priority",
+                (time.time() - WAIT_WINDOW_SECONDS,)
+            ).fetchall()
+        }
+        stats["classes"] = {
+            klass: {
+                "queued": queued.get(klass, 0),
+                "wait_avg": round(waits.get(klass, (0.0, 0.0))[0], 4),
+                "wait_max": round(waits.get(klass, (0.0, 0.0))[1], 4)
+            }
+            for klass in PRIORITY_CLASSES
+        }
+        return stats
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; writes use explicit BEGIN IMMEDIATE transactions
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                    for column, statement in MIGRATIONS.items():
+                        if column not in columns:
+                            conn.execute(statement)
+                    conn.executescript(INDEXES)
+                    self._initialized = True
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, so concurrent claimers never pick the same job"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def create_queue_from_env() -> JobQueue:
+    return JobQueue(
+        path=os.getenv("JOB_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "codeplay-jobs.sqlite3")),
+        lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "120")),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+        retention_seconds=float(os.getenv("JOB_RETENTION_SECONDS", "3600")),
+        user_limit=int(os.getenv("SCHEDULER_USER_CONCURRENCY", "4")),
+        priority_delays=parse_priority_delays(os.getenv("JOB_PRIORITY_DELAYS", ""))
+    )
@@ -0,0 +1,306 @@
+"""
+Pre-forked Python Worker Pool
+Keeps warm python_worker.py processes around so a Python run costs a fork
+instead of a full interpreter start plus imports. The same pool also keeps
+warm spark_worker.py drivers for PySpark.
+
+Configuration (environment):
+- PYTHON_POOL_SIZE: number of warm workers, 0 disables the pool
+- PYTHON_POOL_MAX_JOBS: jobs a worker serves before it is replaced
+- PYTHON_POOL_IDLE_TIMEOUT: seconds an idle worker lives before it is reaped
+- PYSPARK_POOL_SIZE / _MAX_JOBS / _IDLE_TIMEOUT / _STARTUP_GRACE: the same for Spark drivers
+- PYSPARK_POOL_PRELOAD: modules each Spark driver imports at start
+"""
+
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+
+import timings
+from sandbox import CancelToken, ResourceLimits
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+SPARK_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spark_worker.py")
+
+# Extra time allowed for the worker to report back after the job timeout
+RESPONSE_GRACE_SECONDS = 5
+
+READ_CHUNK = 65536
+
+
+class WorkerError(Exception):
+    """Raised when a worker dies or stops answering; the caller should fall back"""
+
+
+class PythonWorker:
+    """One warm worker process and its JSON-lines channel"""
+
+    def __init__(self, script: str = WORKER_SCRIPT, startup_grace: float = 0):
+        # Cancels name the job they are meant for on this pipe (see python_worker)
+        control_r, self._control = os.pipe()
+        os.set_blocking(self._control, False)
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, script],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(control_r,),
+                env={**os.environ, "WORKER_CONTROL_FD": str(control_r)}
+            )
+        except OSError:
+            os.close(self._control)
+            raise
+        finally:
+            os.close(control_r)
+        self.startup_grace = startup_grace
+        # Results are read straight off the pipe, so select() never misses buffered lines
+        self._fd = self.process.stdout.fileno()
+        self._pending = b""
+        self.jobs_sent = 0
+        self.jobs_done = 0
+        self.last_used = time.monotonic()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, code: str, stdin_data: str, timeout: float, limits: Optional[dict] = None,
+            on_output=None, cancel: Optional[CancelToken] = None) -> dict:
+        """Send one job and wait for its result, passing streamed output to on_output"""
+        self.jobs_sent += 1
+        job_id = self.jobs_sent
+        job = json.dumps({
+            "job_id": job_id,
+            "code": code,
+            "stdin": stdin_data,
+            "timeout": timeout,
+            "limits": limits,
+            "stream": on_output is not None
+        })
+        # The first job also waits for the worker to finish warming up
+        deadline = (time.monotonic() + timeout + RESPONSE_GRACE_SECONDS
+                    + (self.startup_grace if self.jobs_done == 0 else 0))
+
+        def interrupt():
+            if self._control is None:
+                return
+            try:
+                os.write(self._control, f"{job_id}\n".encode())
+                self.process.send_signal(signal.SIGUSR1)
+            except OSError:
+                pass
+
+        if cancel is not None:
+            cancel.register(interrupt)
+        try:
+            self.process.stdin.write(job.encode() + b"\n")
+            self.process.stdin.flush()
+            while True:
+                message = json.loads(self._read_line(deadline))
+                if message.get("event") != "output":
+                    break
+                if on_output is not None:
+                    on_output(message["stream"], message["data"])
+        except OSError as e:
+            raise WorkerError(f"worker channel broken: {e}")
+        finally:
+            if cancel is not None:
+                cancel.unregister(interrupt)
+
+        self.jobs_done += 1
+        self.last_used = time.monotonic()
+        return message
+
+    def _read_line(self, deadline: float) -> bytes:
+        while b"\n" not in self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WorkerError("worker did not answer in time")
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                continue
+            data = os.read(self._fd, READ_CHUNK)
+            if not data:
+                raise WorkerError("worker exited unexpectedly")
+            self._pending += data
+        line, _, self._pending = self._pending.partition(b"\n")
+        return line
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._close_control()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self._close_control()
+
+    def _close_control(self):
+        if self._control is not None:
+            os.close(self._control)
+            self._control = None
+
+
+class PythonWorkerPool:
+    """Hands out warm workers, replaces worn-out ones and reaps idle ones"""
+
+    def __init__(self, size: int, max_jobs: int = 100, idle_timeout: float = 300,
+                 script: str = WORKER_SCRIPT, startup_grace: float = 0, name: str = "Python"):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.idle_timeout = idle_timeout
+        self.script = script
+        self.startup_grace = startup_grace
+        self.name = name
+        self._idle = []
+        self._busy = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._reaper = None
+
+    def start(self):
+        """Pre-fork the whole pool and start the idle reaper"""
+        with self._cond:
+            while len(self._idle) < self.size:
+                self._idle.append(self._new_worker())
+        self._reaper = threading.Thread(target=self._reap_idle, daemon=True)
+        self._reaper.start()
+        print(f"✓ {self.name} worker pool started ({self.size} workers)")
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for worker in idle:
+            worker.stop()
+
+    def run(self, code: str, stdin_data: str = "", timeout: float = 10,
+            limits: Optional[ResourceLimits] = None, on_output=None,
+            cancel: Optional[CancelToken] = None) -> dict:
+        """Execute code on a warm worker; raises WorkerError on pool failure"""
+        # Checking out a worker (starting one if none is warm) counts as spawning
+        with timings.stage("spawn"):
+            worker = self._acquire()
+        try:
+            with timings.stage("run"):
+                result = worker.run(code, stdin_data, timeout, limits.as_dict() if limits is not None else None,
+                                    on_output, cancel)
+        except Exception:
+            self._release(worker, discard=True)
+            raise
+        # Workers flag themselves when they are no longer safe to reuse
+        with timings.stage("teardown"):
+            self._release(worker, discard=bool(result.pop("retire", False)))
+        return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"size": self.size, "idle": len(self._idle), "busy": self._busy}
+
+    def _acquire(self) -> PythonWorker:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise WorkerError("worker pool is shut down")
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.alive():
+                        self._busy += 1
+                        return worker
+                    worker.stop()
+                if self._busy < self.size:
+                    self._busy += 1
+                    break
+                self._cond.wait()
+
+        # Spawn outside the lock; this only happens after reaping or a crash
+        try:
+            return self._new_worker()
+        except OSError as e:
+            with self._cond:
+                self._busy -= 1
+                self._cond.notify()
+            raise WorkerError(f"could not start worker: {e}")
+
+    def _release(self, worker: PythonWorker, discard: bool = False):
+        retire = discard or self._closed or worker.jobs_done >= self.max_jobs or not worker.alive()
+        replacement = None
+        if retire:
+            if discard:
+                worker.kill()
+            else:
+                worker.stop()
+            if not self._closed:
+                replacement = self._spawn_quietly()
+        with self._cond:
+            self._busy -= 1
+            if not retire:
+                self._idle.append(worker)
+            elif replacement is not None:
+                self._idle.append(replacement)
+            self._cond.notify()
+
+    def _new_worker(self) -> PythonWorker:
+        return PythonWorker(self.script, self.startup_grace)
+
+    def _spawn_quietly(self) -> Optional[PythonWorker]:
+        try:
+            return self._new_worker()
+        except OSError as e:
+            print(f"✗ Could not replace {self.name} worker: {e}")
+            return None
+
+    def _reap_idle(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 4))
+            now = time.monotonic()
+            with self._cond:
+                if self._closed:
+                    return
+                expired = [w for w in self._idle if now - w.last_used > self.idle_timeout]
+                self._idle = [w for w in self._idle if w not in expired]
+            for worker in expired:
+                worker.stop()
+
+
+def create_pool_from_env() -> Optional[PythonWorkerPool]:
+    """Build the pool from environment settings, or None when disabled"""
+    size = int(os.getenv("PYTHON_POOL_SIZE", str(os.cpu_count() or 2)))
+    if size <= 0 or not hasattr(os, "fork"):
+        return None
+    return PythonWorkerPool(
+        size=size,
+        max_jobs=int(os.getenv("PYTHON_POOL_MAX_JOBS", "100")),
+        idle_timeout=float(os.getenv("PYTHON_POOL_IDLE_TIMEOUT", "300"))
+    )
+
+
+def create_spark_pool_from_env() -> Optional[PythonWorkerPool]:
+    """Pool of warm local[*] Spark drivers, or None when PYSPARK_POOL_SIZE=0"""
+    size = int(os.getenv("PYSPARK_POOL_SIZE", "1"))
+    if size <= 0:
+        return None
+    return PythonWorkerPool(
+        size=size,
+        max_jobs=int(os.getenv("PYSPARK_POOL_MAX_JOBS", "50")),
+        idle_timeout=float(os.getenv("PYSPARK_POOL_IDLE_TIMEOUT", "1800")),
+        script=SPARK_WORKER_SCRIPT,
+        # Starting the driver JVM and SparkSession takes a while
+        startup_grace=float(os.getenv("PYSPARK_POOL_STARTUP_GRACE", "90")),
+        name="PySpark"
+    )
@@ -0,0 +1,355 @@
+"""
+Warm Python Sandbox Worker
+Started by python_pool.PythonWorkerPool, never by hand.
+
+The worker imports the usual candidate modules once, then waits for jobs on
+stdin (one JSON object per line). Every job is executed in a child forked
+from this warm process, so the child starts with the imports already done
+and any state the candidate code creates dies with the child.
+
+Job:    {"code": str, "stdin": str, "timeout": float, "limits": dict, "stream": bool}
+Result: {"stdout": str, "stderr": str, "exit_code": int, "timed_out": bool,
+         "limit_exceeded": str | None, "cancelled": bool, "wall_time": float,
+         "cpu_time": float, "max_rss_kb": int}
+
+With "stream", output is also sent as it is produced, as
+{"event": "output", "stream": "stdout" | "stderr", "data": str} lines before
+the result.
+
+When the program dies of an uncaught MemoryError, or of a fork or thread
+start refused by the process limit, the child reports that limit on a pipe
+of its own before exiting, so the result names it in "limit_exceeded".
+
+To cancel, the pool writes the job's id (the "job_id" it was sent with) to
+the control pipe named by WORKER_CONTROL_FD and sends SIGUSR1. Only that
+job is cancelled: a late cancel of a finished job is dropped, and an early
+one applies as soon as its job is read.
+"""
+
+import errno
+import importlib
+import json
+import os
+import random
+import selectors
+import signal
+import sys
+import threading
+import time
+import traceback
+import types
+from typing import Optional
+
+from sandbox import (
+    Cgroup, OutputBuffer, ResourceLimits, RunUser, kill_group, limit_exceeded, usage_stats, wait_child
+)
+
+DEFAULT_PRELOAD = (
+    "math,re,json,string,collections,itertools,functools,heapq,bisect,"
+    "random,datetime,decimal,fractions,statistics,typing,dataclasses,io"
+)
+
+READ_CHUNK = 65536
+
+# Job in progress, so SIGUSR1 can cancel it
+current_job = {"id": None, "pid": None, "cancelled": False}
+
+# Ids of jobs the pool asked to cancel that are not finished yet
+cancel_requests = set()
+
+CONTROL_FD = int(os.getenv("WORKER_CONTROL_FD", "-1"))
+
+
+def read_cancel_requests():
+    """Collect the job ids written to the control pipe since the last call"""
+    while True:
+        try:
+            data = os.read(CONTROL_FD, 4096)
+        except (BlockingIOError, OSError):
+            return
+        if not data:
+            return
+        cancel_requests.update(int(job_id) for job_id in data.split())
+
+
+def cancel_current_job(signum, frame):
+    if CONTROL_FD < 0:
+        # Started by hand, without a control pipe: SIGUSR1 cancels whatever runs
+        current_job["cancelled"] = True
+    else:
+        read_cancel_requests()
+        if current_job["id"] not in cancel_requests:
+            return
+        current_job["cancelled"] = True
+    if current_job["pid"] is not None:
+        kill_group(current_job["pid"])
+
+
+def start_job(job_id):
+    """Make job_id the job in progress, cancelled already if the pool asked before it was read"""
+    current_job["cancelled"] = False
+    current_job["id"] = job_id
+    read_cancel_requests()
+    for stale in [i for i in cancel_requests if job_id is None or i < job_id]:
+        cancel_requests.discard(stale)
+    if job_id in cancel_requests:
+        current_job["cancelled"] = True
+
+
+def preload_modules(names: Optional[str] = None):
+    """Import the modules candidate code usually needs, once per worker"""
+    if names is None:
+        names = os.getenv("PYTHON_POOL_PRELOAD", DEFAULT_PRELOAD)
+    for name in filter(None, (n.strip() for n in names.split(","))):
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def exit_code_for(exc: SystemExit) -> int:
+    """Map SystemExit to a process exit code the way the interpreter does"""
+    code = exc.code
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xFF
+    print(code, file=sys.stderr)
+    return 1
+
+
+def limit_hit(error: BaseException) -> Optional[str]:
+    """The limit an uncaught exception shows the program ran into, if any"""
+    if isinstance(error, MemoryError):
+        return "memory"
+    # os.fork() and subprocess refused by RLIMIT_NPROC or pids.max
+    if isinstance(error, BlockingIOError) and error.errno == errno.EAGAIN:
+        return "processes"
+    if isinstance(error, RuntimeError) and str(error) == "can't start new thread":
+        return "processes"
+    return None
+
+
+def run_child(code: str, stdin_fd: int, stdout_fd: int, stderr_fd: int, report_fd: int, protocol_fds: tuple,
+              limits: ResourceLimits, cgroup: Optional[Cgroup], user: Optional[RunUser]):
+    """Body of the forked child: behave like `python -c code` and never return"""
+    os.setpgid(0, 0)
+    if cgroup is not None:
+        cgroup.enter()
+    limits.apply(own_user=user is not None)
+    if user is not None:
+        user.enter()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    os.dup2(stdin_fd, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    for fd in (stdin_fd, stdout_fd, stderr_fd) + protocol_fds:
+        os.close(fd)
+
+    sys.stdin = open(0, "r", encoding="utf-8", closefd=False)
+    sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", buffering=1, closefd=False)
+    sys.argv = ["-c"]
+    if not sys.path or sys.path[0] != "":
+        sys.path.insert(0, "")
+
+    # The parent's RNG state was copied by fork; every child must diverge
+    random.seed()
+
+    main_module = types.ModuleType("__main__")
+    sys.modules["__main__"] = main_module
+
+    exit_code = 0
+    try:
+        exec(compile(code, "<string>", "exec"), main_module.__dict__)
+    except SystemExit as e:
+        exit_code = exit_code_for(e)
+    except BaseException:
+        etype, value, tb = sys.exc_info()
+        # Report first: printing the traceback may itself run out of memory
+        limit = limit_hit(value)
+        if limit is not None:
+            try:
+                os.write(report_fd, limit.encode())
+            except OSError:
+                pass
+        # Drop this frame so the traceback starts at the candidate's code
+        traceback.print_exception(etype, value, tb.tb_next if tb else None)
+        exit_code = 1
+
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            exit_code = exit_code or 120
+    os._exit(exit_code)
+
+
+def feed_stdin(fd: int, data: bytes):
+    """Write stdin to the child and close it so input() sees EOF"""
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def run_job(job: dict, protocol_fds: tuple, emit=None) -> dict:
+    """Fork a child for one job and collect its output (passing it to emit as it arrives)"""
+    limits = ResourceLimits.from_dict(job.get("limits"))
+    cgroup = Cgroup.create(limits)
+    user = RunUser.acquire(limits)
+    in_r, in_w = os.pipe()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    report_r, report_w = os.pipe()
+
+    started = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        for fd in (in_w, out_r, err_r, report_r):
+            os.close(fd)
+        run_child(job.get("code", ""), in_r, out_w, err_w, report_w, protocol_fds, limits, cgroup, user)
+
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    current_job["pid"] = pid
+    if current_job["cancelled"]:
+        kill_group(pid)
+    for fd in (in_r, out_w, err_w, report_w):
+        os.close(fd)
+
+    writer = threading.Thread(
+        target=feed_stdin,
+        args=(in_w, (job.get("stdin") or "").encode()),
+        daemon=True
+    )
+    writer.start()
+
+    on_output = emit if job.get("stream") else None
+    buffers = {
+        out_r: OutputBuffer(limits.max_output_bytes, on_output=on_output, name="stdout"),
+        err_r: OutputBuffer(limits.max_output_bytes, on_output=on_output, name="stderr")
+    }
+    deadline = started + float(job.get("timeout", 10))
+    timed_out = False
+
+    # Readable once the program exits, so processes it left behind cannot hold the pipes open
+    try:
+        pidfd = os.pidfd_open(pid) if hasattr(os, "pidfd_open") else None
+    except OSError:
+        pidfd = None
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(out_r, selectors.EVENT_READ)
+        selector.register(err_r, selectors.EVENT_READ)
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _ in selector.select(remaining):
+                if key.fd == pidfd:
+                    kill_group(pid)
+                    selector.unregister(pidfd)
+                    continue
+                data = os.read(key.fd, READ_CHUNK)
+                if data:
+                    buffers[key.fd].append(data)
+                else:
+                    selector.unregister(key.fd)
+            if buffers[out_r].exceeded or buffers[err_r].exceeded:
+                kill_group(pid)
+                break
+
+    if pidfd is not None:
+        os.close(pidfd)
+    for buffer in buffers.values():
+        buffer.close()
+    output_exceeded = buffers[out_r].exceeded or buffers[err_r].exceeded
+    waited = None if timed_out else wait_child(pid, deadline)
+    timed_out = waited is None
+    kill_group(pid)
+    if timed_out:
+        _, status, rusage = os.wait4(pid, 0)
+    else:
+        status, rusage = waited
+    wall_time = time.monotonic() - started
+    current_job["pid"] = None
+
+    os.close(out_r)
+    os.close(err_r)
+    writer.join(timeout=1)
+
+    # Read what is there: a leftover grandchild may still hold the write end
+    os.set_blocking(report_r, False)
+    try:
+        reported = os.read(report_r, 64).decode(errors="replace").split()
+    except BlockingIOError:
+        reported = []
+    os.close(report_r)
+
+    exceeded = limit_exceeded(status, rusage, limits, output_exceeded, cgroup,
+                              reported[0] if reported else None)
+    if cgroup is not None:
+        cgroup.remove()
+    if user is not None:
+        user.release()
+
+    return {
+        "stdout": buffers[out_r].text(),
+        "stderr": buffers[err_r].text(),
+        "exit_code": -1 if timed_out else os.waitstatus_to_exitcode(status),
+        "timed_out": timed_out and exceeded is None,
+        "limit_exceeded": exceeded,
+        "cancelled": current_job["cancelled"],
+        **usage_stats(rusage, wall_time)
+    }
+
+
+def main():
+    # Keep the protocol channel on private descriptors so nothing printed by
+    # an import can corrupt it, and point fd 1 at stderr for the same reason.
+    protocol_in = os.dup(0)
+    protocol_out = os.dup(1)
+    os.dup2(2, 1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    preload_modules()
+    if CONTROL_FD >= 0:
+        os.set_blocking(CONTROL_FD, False)
+    signal.signal(signal.SIGUSR1, cancel_current_job)
+
+    jobs = os.fdopen(protocol_in, "rb")
+    results = os.fdopen(protocol_out, "wb")
+    protocol_fds = (protocol_in, protocol_out) + ((CONTROL_FD,) if CONTROL_FD >= 0 else ())
+
+    def emit(stream: str, data: str):
+        results.write(json.dumps({"event": "output", "stream": stream, "data": data}).encode() + b"\n")
+        results.flush()
+
+    for line in jobs:
+        try:
+            job = json.loads(line)
+            start_job(job.get("job_id"))
+            result = run_job(job, protocol_fds, emit)
+        except Exception as e:
+            result = {"stdout": "", "stderr": str(e), "exit_code": 1, "timed_out": False}
+        results.write(json.dumps(result).encode() + b"\n")
+        results.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Run Result Cache
+Remembers the outcome of (language, code, stdin, runtime) tuples so the Run
+button, Submit and the grader do not execute the same program three times.
+
+Entries expire after a time-to-live and are evicted least-recently-used
+first once their total size exceeds the budget. Only finished runs
+(success or error) are stored: runs whose program exited (they carry a
+measured wall_time) and Java sources the compiler rejected. Timeouts,
+cancellations and limit kills depend on load, and errors raised around the
+program (a failed fork, workspace or daemon) are transient, so all of
+these are always re-run.
+
+Configuration (environment):
+- RESULT_CACHE_MAX_MB: memory budget in megabytes, 0 disables the cache
+- RESULT_CACHE_TTL: seconds an entry stays valid
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# What a cached run keeps; enough to rebuild the /run response
+CACHED_FIELDS = (
+    "language", "stdout", "stderr", "exit_code", "status",
+    "limit_exceeded", "wall_time", "cpu_time", "max_rss_kb"
+)
+
+CACHEABLE_STATUSES = ("success", "error")
+
+# Rough per-entry bookkeeping cost on top of the output text
+ENTRY_OVERHEAD_BYTES = 512
+
+
+class ResultCache:
+    """LRU-by-size cache of run results with a time-to-live"""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, result), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def key(self, *parts: str) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """A copy of the cached result, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._drop_locked(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return dict(entry[2])
+
+    def put(self, key: str, result: dict):
+        if result.get("status") not in CACHEABLE_STATUSES:
+            return
+        if result.get("wall_time") is None and not result.get("compile_error"):
+            return
+        entry = {field: result.get(field) for field in CACHED_FIELDS}
+        size = len(entry["stdout"] or "") + len(entry["stderr"] or "") + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, entry)
+            self._bytes += size
+            self._evict_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl
+            }
+
+    def _drop_locked(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        for key in list(self._entries):
+            expired = self._entries[key][0] <= now
+            if not expired and self._bytes <= self.max_bytes:
+                return
+            self._drop_locked(key)
+            if not expired:
+                self.evictions += 1
+
+
+def create_result_cache_from_env() -> Optional[ResultCache]:
+    """Build the cache from environment settings, or None when disabled"""
+    max_mb = int(os.getenv("RESULT_CACHE_MAX_MB", "0"))
+    if max_mb <= 0:
+        return None
+    return ResultCache(max_mb * 1024 * 1024, float(os.getenv("RESULT_CACHE_TTL", "600")))
@@ -0,0 +1,528 @@
+"""
+Process Runner
+Runs candidate programs as child processes under resource limits and
+reports what they cost: wall time, CPU time and peak resident memory (from
+wait4 rusage).
+
+Limits are rlimits set in the child before it runs candidate code, plus an
+output cap enforced by whoever reads the pipes. When SANDBOX_CGROUP_ROOT
+points at a writable cgroup v2 directory, every run also gets its own
+cgroup with pids.max and memory.max.
+
+Linux ignores RLIMIT_NPROC for root, and it counts every process of the
+user, not of the run. So when the service runs as root and SANDBOX_UID_BASE
+is set, each run with a process limit gets a uid of its own from
+SANDBOX_UID_BASE .. SANDBOX_UID_BASE + SANDBOX_UID_COUNT - 1 and drops to it
+before running candidate code. Whatever the run leaves behind under that
+uid is killed when the run ends.
+
+Configuration (environment, 0 means unlimited):
+- SANDBOX_CPU_SECONDS: CPU time per run
+- SANDBOX_MEMORY_MB: address space (and cgroup memory) per run
+- SANDBOX_MAX_PROCESSES: processes/threads per run
+- SANDBOX_MAX_OUTPUT_BYTES: bytes kept per output stream before the run is killed
+- SANDBOX_CGROUP_ROOT: delegated cgroup v2 directory, unset to skip cgroups
+- SANDBOX_UID_BASE / SANDBOX_UID_COUNT: uids runs drop to, unset to keep the service's
+- SANDBOX_UID_LOCK_DIR: where processes sharing the uid range lock the uid each run holds
+- SANDBOX_JVM_OVERHEAD_MB: cgroup memory a JVM gets on top of its -Xmx heap
+- SANDBOX_JVM_THREADS: cgroup pids a JVM gets for its own threads
+
+JVMs reserve far more address space than they use and start dozens of
+threads, so limits marked jvm skip RLIMIT_AS, and RLIMIT_NPROC unless the
+run has a uid of its own (then it gets SANDBOX_JVM_THREADS extra). Their
+memory is held by -Xmx plus the cgroup, with the headroom above.
+"""
+
+import codecs
+import fcntl
+import os
+import random
+import resource
+import select
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from typing import Optional
+
+import timings
+
+READ_CHUNK = 65536
+
+JVM_OVERHEAD_MB = int(os.getenv("SANDBOX_JVM_OVERHEAD_MB", "256"))
+JVM_THREADS = int(os.getenv("SANDBOX_JVM_THREADS", "64"))
+
+RUN_UID_BASE = int(os.getenv("SANDBOX_UID_BASE") or "0")
+RUN_UID_COUNT = int(os.getenv("SANDBOX_UID_COUNT", "64"))
+RUN_UID_LOCK_DIR = os.getenv("SANDBOX_UID_LOCK_DIR", "/tmp/sandbox-uids")
+
+
+class ResourceLimits:
+    """Per-run limits; None or 0 leaves a resource unlimited"""
+
+    FIELDS = ("cpu_seconds", "memory_mb", "max_processes", "max_output_bytes", "cgroup_root", "jvm")
+
+    def __init__(self, cpu_seconds: Optional[int] = None, memory_mb: Optional[int] = None,
+                 max_processes: Optional[int] = None, max_output_bytes: Optional[int] = None,
+                 cgroup_root: Optional[str] = None, jvm: bool = False):
+        self.cpu_seconds = cpu_seconds or None
+        self.memory_mb = memory_mb or None
+        self.max_processes = max_processes or None
+        self.max_output_bytes = max_output_bytes or None
+        self.cgroup_root = cgroup_root or None
+        self.jvm = bool(jvm)
+
+    @classmethod
+    def from_env(cls) -> "ResourceLimits":
+        return cls(
+            cpu_seconds=int(os.getenv("SANDBOX_CPU_SECONDS", "10")),
+            memory_mb=int(os.getenv("SANDBOX_MEMORY_MB", "512")),
+            max_processes=int(os.getenv("SANDBOX_MAX_PROCESSES", "64")),
+            max_output_bytes=int(os.getenv("SANDBOX_MAX_OUTPUT_BYTES", str(1024 * 1024))),
+            cgroup_root=os.getenv("SANDBOX_CGROUP_ROOT")
+        )
+
+    @classmethod
+    def from_dict(cls, values: Optional[dict]) -> "ResourceLimits":
+        return cls(**{name: (values or {}).get(name) for name in cls.FIELDS})
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def replace(self, **changes) -> "ResourceLimits":
+        """Copy with some limits changed, e.g. replace(memory_mb=None)"""
+        return ResourceLimits(**{**self.as_dict(), **changes})
+
+    def apply(self, own_user: bool = False):
+        """
+        Set rlimits on the calling process; runs in the child before candidate code.
+        own_user says the child is about to drop to a uid only this run uses.
+        """
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        if self.cpu_seconds:
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 1))
+        if self.memory_mb and not self.jvm:
+            size = self.memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (size, size))
+        if self.max_processes and (own_user or not self.jvm):
+            count = self.max_processes + (JVM_THREADS if self.jvm else 0)
+            resource.setrlimit(resource.RLIMIT_NPROC, (count, count))
+
+
+class RunUser:
+    """
+    A uid from the SANDBOX_UID_BASE range held by one run. It is locked with
+    flock, so every process sharing the range (API, workers, pool workers)
+    hands out each uid to one run at a time.
+    """
+
+    def __init__(self, uid: int, lock_fd: int):
+        self.uid = uid
+        self._lock_fd = lock_fd
+
+    @classmethod
+    def acquire(cls, limits: ResourceLimits) -> Optional["RunUser"]:
+        """A free uid for a run, or None when runs keep the service's uid"""
+        if not RUN_UID_BASE or not limits.max_processes or os.geteuid() != 0:
+            return None
+        os.makedirs(RUN_UID_LOCK_DIR, exist_ok=True)
+        # Start somewhere random so concurrent runs rarely contend for one uid
+        start = random.randrange(RUN_UID_COUNT)
+        for attempt in range(RUN_UID_COUNT + 1):
+            uid = RUN_UID_BASE + (start + attempt) % RUN_UID_COUNT
+            fd = os.open(os.path.join(RUN_UID_LOCK_DIR, str(uid)), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            try:
+                # Every uid is taken: wait for the first one tried
+                fcntl.flock(fd, fcntl.LOCK_EX if attempt == RUN_UID_COUNT else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            except BaseException:
+                os.close(fd)
+                raise
+            return cls(uid, fd)
+
+    def enter(self):
+        """Drop to the uid; runs in the child after the limits and cgroup are set"""
+        os.close(self._lock_fd)
+        os.setgroups([])
+        os.setgid(self.uid)
+        os.setuid(self.uid)
+
+    def release(self):
+        """Kill whatever the run left running under the uid, then free it"""
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.setgid(self.uid)
+                os.setuid(self.uid)
+                # Every process this uid may signal, except this one
+                os.kill(-1, signal.SIGKILL)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        os.close(self._lock_fd)
+
+
+def process_limit_enforcement(limits: ResourceLimits) -> str:
+    """How max_processes is enforced for runs of this process, for /health and startup"""
+    if not limits.max_processes:
+        return "off"
+    if limits.cgroup_root:
+        return "cgroup"
+    if os.geteuid() != 0:
+        return "rlimit"
+    if RUN_UID_BASE:
+        return "run uids"
+    return "none (root ignores RLIMIT_NPROC; set SANDBOX_UID_BASE or SANDBOX_CGROUP_ROOT)"
+
+
+class Cgroup:
+    """Throwaway cgroup v2 group holding one run"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(cls, limits: ResourceLimits) -> Optional["Cgroup"]:
+        """New group under limits.cgroup_root, or None when cgroups are off or unusable"""
+        if not limits.cgroup_root:
+            return None
+        group = cls(os.path.join(limits.cgroup_root, f"run-{uuid.uuid4().hex}"))
+        pids_extra, memory_extra_mb = (JVM_THREADS, JVM_OVERHEAD_MB) if limits.jvm else (0, 0)
+        try:
+            os.mkdir(group.path)
+            if limits.max_processes:
+                group._write("pids.max", str(limits.max_processes + pids_extra))
+            if limits.memory_mb:
+                group._write("memory.max", str((limits.memory_mb + memory_extra_mb) * 1024 * 1024))
+                group._write("memory.swap.max", "0", required=False)
+        except OSError as e:
+            print(f"✗ Could not set up cgroup {group.path}: {e}")
+            group.remove()
+            return None
+        return group
+
+    def enter(self):
+        """Move the calling process into the group; runs in the child"""
+        try:
+            self._write("cgroup.procs", "0")
+        except OSError:
+            pass
+
+    def oom_killed(self) -> bool:
+        return self._event("memory.events", "oom_kill") > 0
+
+    def pids_exhausted(self) -> bool:
+        """Whether a fork or thread was refused by pids.max"""
+        return self._event("pids.events", "max") > 0
+
+    def _event(self, filename: str, event: str) -> int:
+        try:
+            with open(os.path.join(self.path, filename)) as f:
+                for line in f:
+                    name, _, value = line.partition(" ")
+                    if name == event:
+                        return int(value)
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def remove(self):
+        """Kill anything still in the group and delete it"""
+        self._write("cgroup.kill", "1", required=False)
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)
+
+    def _write(self, name: str, value: str, required: bool = True):
+        try:
+            with open(os.path.join(self.path, name), "w") as f:
+                f.write(value)
+        except OSError:
+            if required:
+                raise
+
+
+# Limits a run may report about itself (see python_worker)
+LIMITS = ("output", "cpu", "memory", "processes")
+
+# Share of the memory limit a failed run must have reached to count as stopped by it
+MEMORY_LIMIT_FRACTION = 0.9
+
+
+def limit_exceeded(status: Optional[int], rusage, limits: Optional[ResourceLimits],
+                   output_exceeded: bool = False, cgroup: Optional[Cgroup] = None,
+                   reported: Optional[str] = None) -> Optional[str]:
+    """
+    Which limit stopped a run: "output", "cpu", "memory", "processes" or None.
+    reported is the limit the run itself said it ran into, e.g. from a MemoryError.
+    """
+    if output_exceeded:
+        return "output"
+    if cgroup is not None and cgroup.oom_killed():
+        return "memory"
+    if cgroup is not None and cgroup.pids_exhausted():
+        return "processes"
+    if reported in LIMITS:
+        return reported
+    if limits is None or status is None:
+        return None
+    failed = os.WIFSIGNALED(status) or os.waitstatus_to_exitcode(status) != 0
+    if limits.cpu_seconds and os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        cpu_time = rusage.ru_utime + rusage.ru_stime if rusage else 0
+        if signum == signal.SIGXCPU or (signum == signal.SIGKILL and cpu_time >= limits.cpu_seconds):
+            return "cpu"
+    # A native program that failed on ENOMEM says nothing, but it was close to the cap
+    if (failed and limits.memory_mb and not limits.jvm and rusage
+            and rusage.ru_maxrss >= limits.memory_mb * 1024 * MEMORY_LIMIT_FRACTION):
+        return "memory"
+    return None
+
+
+class CancelToken:
+    """Lets another thread stop a run; the runner registers how to stop it"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback):
+        """Call callback on cancel (right away if already cancelled)"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class OutputBuffer:
+    """
+    Collects one output stream up to a byte cap and reports when it is exceeded.
+
+    With on_output, every kept chunk is also passed on as text while the run
+    is still going; a slow callback slows the reader, and so the program.
+    """
+
+    def __init__(self, limit: Optional[int], on_exceeded=None, on_output=None, name: str = "stdout"):
+        self.limit = limit
+        self.on_exceeded = on_exceeded
+        self.on_output = on_output
+        self.name = name
+        self.chunks = []
+        self.size = 0
+        self.exceeded = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def append(self, data: bytes):
+        if self.exceeded:
+            return
+        if self.limit is not None and self.size + len(data) > self.limit:
+            data = data[:self.limit - self.size]
+            self.exceeded = True
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.on_output is not None:
+            text = self._decoder.decode(data, final=self.exceeded)
+            if text:
+                self.on_output(self.name, text)
+        if self.exceeded and self.on_exceeded is not None:
+            self.on_exceeded()
+
+    def close(self):
+        """Pass on a trailing partial character, if any"""
+        if self.on_output is not None and not self.exceeded:
+            text = self._decoder.decode(b"", final=True)
+            if text:
+                self.on_output(self.name, text)
+
+    def text(self) -> str:
+        return b"".join(self.chunks).decode("utf-8", errors="replace")
+
+
+def wait_child(pid: int, deadline: float) -> Optional[tuple]:
+    """Wait for a child until the deadline; returns (status, rusage) or None if still running"""
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except OSError:
+            pidfd = None
+
+    delay = 0.0005
+    try:
+        while True:
+            reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+            if reaped:
+                return status, rusage
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if pidfd is not None:
+                select.select([pidfd], [], [], remaining)
+            else:
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.01)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def kill_group(pid: int):
+    """Kill a child and everything it spawned in its process group"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def usage_stats(rusage, wall_time: float) -> dict:
+    """Accounting fields shared by every runner"""
+    return {
+        "wall_time": round(wall_time, 4),
+        "cpu_time": round(rusage.ru_utime + rusage.ru_stime, 4) if rusage else None,
+        "max_rss_kb": rusage.ru_maxrss if rusage else None
+    }
+
+
+def _drain(stream, buffer: OutputBuffer):
+    # Keep reading past the cap so the child never blocks on a full pipe
+    for chunk in iter(lambda: stream.read1(READ_CHUNK), b""):
+        buffer.append(chunk)
+    buffer.close()
+    stream.close()
+
+
+def _feed(stream, data: bytes):
+    try:
+        if data:
+            stream.write(data)
+    except (BrokenPipeError, OSError):
+        pass
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+def run_process(argv: list, stdin_data: str = "", timeout: float = 10,
+                env: Optional[dict] = None, cwd: Optional[str] = None,
+                limits: Optional[ResourceLimits] = None, on_output=None,
+                cancel: Optional[CancelToken] = None) -> dict:
+    """
+    Run argv to completion, timeout, a resource limit or cancellation.
+
+    on_output(stream, text) receives output as it is produced.
+
+    Returns:
+        {"stdout", "stderr", "exit_code", "timed_out", "limit_exceeded", "cancelled",
+         "wall_time", "cpu_time", "max_rss_kb"}
+    """
+    spawn_started = time.perf_counter()
+    cgroup = Cgroup.create(limits) if limits is not None else None
+    user = RunUser.acquire(limits) if limits is not None else None
+
+    def enter_sandbox():
+        if cgroup is not None:
+            cgroup.enter()
+        limits.apply(own_user=user is not None)
+        if user is not None:
+            user.enter()
+
+    started = time.monotonic()
+    try:
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=cwd,
+            start_new_session=True,
+            preexec_fn=enter_sandbox if limits is not None else None
+        )
+    except BaseException:
+        if cgroup is not None:
+            cgroup.remove()
+        if user is not None:
+            user.release()
+        raise
+    finally:
+        timings.current().add("spawn", time.perf_counter() - spawn_started)
+
+    def stop():
+        kill_group(process.pid)
+
+    if cancel is not None:
+        cancel.register(stop)
+
+    cap = limits.max_output_bytes if limits is not None else None
+    stdout = OutputBuffer(cap, on_exceeded=stop, on_output=on_output, name="stdout")
+    stderr = OutputBuffer(cap, on_exceeded=stop, on_output=on_output, name="stderr")
+    threads = [
+        threading.Thread(target=_feed, args=(process.stdin, (stdin_data or "").encode()), daemon=True),
+        threading.Thread(target=_drain, args=(process.stdout, stdout), daemon=True),
+        threading.Thread(target=_drain, args=(process.stderr, stderr), daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+
+    with timings.stage("run"):
+        waited = wait_child(process.pid, started + timeout)
+    teardown_started = time.perf_counter()
+    timed_out = waited is None
+    # Whatever the program left behind in its group goes too
+    kill_group(process.pid)
+    if timed_out:
+        _, status, rusage = os.wait4(process.pid, 0)
+    else:
+        status, rusage = waited
+    wall_time = time.monotonic() - started
+
+    # We reaped the child ourselves; keep Popen from trying again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if cancel is not None:
+        cancel.unregister(stop)
+    for thread in threads:
+        thread.join(timeout=1)
+
+    exceeded = limit_exceeded(status, rusage, limits, stdout.exceeded or stderr.exceeded, cgroup)
+    if cgroup is not None:
+        cgroup.remove()
+    if user is not None:
+        user.release()
+    timings.current().add("teardown", time.perf_counter() - teardown_started)
+
+    return {
+        "stdout": stdout.text(),
+        "stderr": stderr.text(),
+        "exit_code": -1 if timed_out else process.returncode,
+        "timed_out": timed_out and exceeded is None,
+        "limit_exceeded": exceeded,
+        "cancelled": cancel is not None and cancel.cancelled,
+        **usage_stats(rusage, wall_time)
+    }
@@ -0,0 +1,180 @@
+"""
+Execution Scheduler
+Decides which waiting run gets the next free execution slot of a language.
+
+- Priority classes: submit > run > regrade, shared out by weighted fair
+  queuing (class weights, default 8:4:1), so a Submit overtakes queued Runs
+  but re-grades still make progress under load.
+- Within a class, candidates are served fairly: the next slot goes to the
+  candidate who has had the least service, not to whoever queued the most.
+- Each candidate has at most per_user_limit runs executing at once.
+
+Runs without a user_id share one anonymous flow and are not capped.
+
+Configuration (environment):
+- SCHEDULER_USER_CONCURRENCY: runs one candidate may execute at once
+- SCHEDULER_WEIGHTS: class weights, e.g. "submit=8,run=4,regrade=1"
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+PRIORITY_CLASSES = ("submit", "run", "regrade")
+
+DEFAULT_WEIGHTS = {"submit": 8, "run": 4, "regrade": 1}
+
+ANONYMOUS = ""
+
+# Recent wait times kept per class for the percentiles in stats()
+WAIT_SAMPLES = 1000
+
+
+def parse_weights(value: str) -> dict:
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if name.strip() in weights:
+            weights[name.strip()] = max(float(weight), 0.001)
+    return weights
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class FairScheduler:
+    """Slots of one language, handed out by class weight and per-candidate fairness"""
+
+    def __init__(self, capacity: int, per_user_limit: int, weights: dict):
+        self.capacity = capacity
+        self.per_user_limit = per_user_limit
+        self.weights = weights
+        self.running = 0
+        self._user_running = {}
+        # class -> user -> deque of (future, enqueued_at)
+        self._waiting = {klass: {} for klass in PRIORITY_CLASSES}
+        # Virtual clocks: one across classes, one per class across its users
+        self._vtime = 0.0
+        self._class_vtime = {klass: 0.0 for klass in PRIORITY_CLASSES}
+        self._class_clock = {klass: 0.0 for klass in PRIORITY_CLASSES}
+        self._user_vtime = {klass: {} for klass in PRIORITY_CLASSES}
+        self._class_running = {klass: 0 for klass in PRIORITY_CLASSES}
+        self._dispatched = {klass: 0 for klass in PRIORITY_CLASSES}
+        self._waits = {klass: deque(maxlen=WAIT_SAMPLES) for klass in PRIORITY_CLASSES}
+
+    async def acquire(self, user_id, klass: str):
+        """Wait for a slot; every successful acquire needs a matching release"""
+        user = user_id or ANONYMOUS
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[klass].setdefault(user, deque()).append((future, time.monotonic()))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller gave up; hand the slot on
+                self.release(user_id, klass)
+            else:
+                self._forget(klass, user, future)
+            raise
+
+    def release(self, user_id, klass: str):
+        user = user_id or ANONYMOUS
+        self.running -= 1
+        self._class_running[klass] -= 1
+        remaining = self._user_running.get(user, 0) - 1
+        if remaining > 0:
+            self._user_running[user] = remaining
+        else:
+            self._user_running.pop(user, None)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        classes = {}
+        for klass in PRIORITY_CLASSES:
+            waits = sorted(self._waits[klass])
+            classes[klass] = {
+                "queued": sum(len(queue) for queue in self._waiting[klass].values()),
+                "running": self._class_running[klass],
+                "dispatched": self._dispatched[klass],
+                "wait_p50": round(percentile(waits, 0.50), 4),
+                "wait_p95": round(percentile(waits, 0.95), 4),
+                "wait_max": round(waits[-1], 4) if waits else 0.0
+            }
+        return {"limit": self.capacity, "running": self.running, "classes": classes}
+
+    def _eligible(self, user: str) -> bool:
+        return user == ANONYMOUS or self._user_running.get(user, 0) < self.per_user_limit
+
+    def _dispatch(self):
+        while self.running < self.capacity:
+            picked = self._pick()
+            if picked is None:
+                return
+            klass, user = picked
+            future, enqueued_at = self._waiting[klass][user].popleft()
+            if not self._waiting[klass][user]:
+                del self._waiting[klass][user]
+
+            self.running += 1
+            self._class_running[klass] += 1
+            self._user_running[user] = self._user_running.get(user, 0) + 1
+            self._dispatched[klass] += 1
+            self._waits[klass].append(time.monotonic() - enqueued_at)
+            future.set_result(None)
+
+    def _pick(self):
+        """(class, user) with the earliest virtual finish time, or None if nobody can run"""
+        best = None
+        for klass, users in self._waiting.items():
+            candidates = [user for user, queue in users.items() if queue and self._eligible(user)]
+            if not candidates:
+                continue
+            start = max(self._class_vtime[klass], self._vtime)
+            finish = start + 1.0 / self.weights[klass]
+            if best is None or finish < best[0]:
+                best = (finish, start, klass, candidates)
+        if best is None:
+            return None
+
+        finish, start, klass, candidates = best
+        self._vtime = start
+        self._class_vtime[klass] = finish
+
+        clock = self._class_clock[klass]
+        user_vtime = self._user_vtime[klass]
+        # Least served candidate first; ties go to whoever has waited longest
+        user = min(
+            candidates,
+            key=lambda u: (max(user_vtime.get(u, 0.0), clock), self._waiting[klass][u][0][1])
+        )
+        user_start = max(user_vtime.get(user, 0.0), clock)
+        self._class_clock[klass] = user_start
+        user_vtime[user] = user_start + 1.0
+        # Candidates with no backlog of service need no entry
+        for name in [u for u, v in user_vtime.items() if v <= user_start and u not in self._waiting[klass]]:
+            del user_vtime[name]
+        return klass, user
+
+    def _forget(self, klass: str, user: str, future):
+        queue = self._waiting[klass].get(user)
+        if queue is None:
+            return
+        for entry in queue:
+            if entry[0] is future:
+                queue.remove(entry)
+                break
+        if not queue:
+            del self._waiting[klass][user]
+
+
+def create_scheduler(capacity: int) -> FairScheduler:
+    return FairScheduler(
+        capacity=capacity,
+        per_user_limit=int(os.getenv("SCHEDULER_USER_CONCURRENCY", "4")),
+        weights=parse_weights(os.getenv("SCHEDULER_WEIGHTS", ""))
+    )
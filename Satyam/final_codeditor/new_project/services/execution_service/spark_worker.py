@@ -0,0 +1,402 @@
+"""
+Warm PySpark Driver Worker
+Started by python_pool.PythonWorkerPool (see create_spark_pool_from_env),
+never by hand.
+
+One long-lived local[*] SparkSession per worker. Every job gets its own
+session from newSession() (separate SQL conf, temp views and UDFs), its own
+current database, and a job group so it can be cancelled. The job's
+SparkSession.builder.getOrCreate() returns that session, stop() is a no-op
+while the job runs, and everything the job registered is dropped afterwards.
+
+Candidate code runs in this long-lived interpreter (a driver talking to its
+JVM over Py4J cannot be forked), so the interpreter is checked after every
+job. What can be put back is restored: stdin, builtins, sys.path and
+friends, the working directory, environment, signal handlers, recursion
+limit and random state. The worker retires, and the pool replaces it, when
+a job leaves anything it cannot undo:
+- a thread still running
+- a changed attribute of an already imported module, or of a PySpark class
+- a newly imported module
+- files, jars, archives, Python files, checkpoint dir or conf added to the SparkContext
+Broadcasts made by the job are destroyed. Modules candidates commonly import
+are loaded at start (PYSPARK_POOL_PRELOAD), so new imports stay rare.
+
+Only the output cap of the job's limits applies here: CPU and memory are
+shared with the driver JVM and bounded by the job timeout instead.
+
+Job:    {"code": str, "stdin": str, "timeout": float, "limits": dict, "stream": bool}
+Result: {"stdout": str, "stderr": str, "exit_code": int, "timed_out": bool,
+         "limit_exceeded": str | None, "cancelled": bool, "wall_time": float,
+         "retire": bool}
+
+Streaming and cancellation (job id on the control pipe, then SIGUSR1) work
+as in python_worker; output is sent in batches every STREAM_INTERVAL_SECONDS.
+"""
+
+import builtins
+import contextlib
+import io
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+import uuid
+
+from python_worker import (
+    CONTROL_FD, DEFAULT_PRELOAD, cancel_current_job, current_job, exit_code_for, preload_modules, start_job
+)
+
+SPARK_PRELOAD = (
+    "pyspark.sql.functions,pyspark.sql.types,pyspark.sql.window,pyspark.sql.column,"
+    "pyspark.sql.dataframe,pyspark.sql.readwriter,pyspark.rdd,pyspark.storagelevel"
+)
+
+# sys lists a job may edit in place and that are put back after it
+RESTORED_SYS_LISTS = ("path", "meta_path", "path_hooks")
+
+RESTORED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1)
+
+# Classes whose methods must stay as the driver started them
+GUARDED_PACKAGES = ("pyspark", "py4j")
+
+_MISSING = object()
+
+# Time given to cancelled Spark jobs to unwind before the worker gives up on the thread
+CANCEL_GRACE_SECONDS = 3
+
+# How often streamed output is sent to the pool
+STREAM_INTERVAL_SECONDS = 0.1
+
+class OutputLimitExceeded(BaseException):
+    """Raised into candidate code when it writes past the output cap (not an Exception, so
+    a bare `except Exception` in the submission cannot swallow it)"""
+
+
+class CappedOutput(io.StringIO):
+    """Job stdout/stderr that stops the job once it holds more than limit characters"""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.exceeded = False
+        self._sent = 0
+
+    def unsent(self) -> str:
+        """Text written since the last call, for streaming"""
+        value = self.getvalue()
+        text, self._sent = value[self._sent:], len(value)
+        return text
+
+    def write(self, s):
+        if self.limit is not None and self.tell() + len(s) > self.limit:
+            super().write(s[:max(0, self.limit - self.tell())])
+            self.exceeded = True
+            raise OutputLimitExceeded()
+        return super().write(s)
+
+
+def snapshot_interpreter() -> dict:
+    """Interpreter state a job could change, taken right before it runs"""
+    modules = {name: (module, dict(vars(module))) for name, module in list(sys.modules.items())
+               if name != "__main__" and hasattr(module, "__dict__")}
+    methods = {}
+    for name, (module, attrs) in modules.items():
+        if name.split(".")[0] not in GUARDED_PACKAGES:
+            continue
+        for value in attrs.values():
+            if isinstance(value, type) and value.__module__ == name:
+                methods[value] = {attr: member for attr, member in vars(value).items() if callable(member)
+                                  or isinstance(member, (property, classmethod, staticmethod))}
+    return {
+        "modules": modules,
+        "methods": methods,
+        "builtins": dict(vars(builtins)),
+        "stdin": sys.stdin,
+        "sys_lists": {name: list(getattr(sys, name)) for name in RESTORED_SYS_LISTS},
+        "cwd": os.getcwd(),
+        "environ": dict(os.environ),
+        "signals": {signum: signal.getsignal(signum) for signum in RESTORED_SIGNALS},
+        "recursion_limit": sys.getrecursionlimit(),
+        "random": random.getstate(),
+        "threads": set(threading.enumerate())
+    }
+
+
+def restore_interpreter(saved: dict, job_thread: threading.Thread) -> list:
+    """Put back what a job changed and can be undone; returns what cannot, which retires the worker"""
+    sys.stdin = saved["stdin"]
+    current = vars(builtins)
+    for name in [name for name in current if name not in saved["builtins"]]:
+        del current[name]
+    current.update(saved["builtins"])
+    for name, items in saved["sys_lists"].items():
+        getattr(sys, name)[:] = items
+    try:
+        os.chdir(saved["cwd"])
+    except OSError:
+        pass
+    if dict(os.environ) != saved["environ"]:
+        os.environ.clear()
+        os.environ.update(saved["environ"])
+    for signum, handler in saved["signals"].items():
+        if handler is not None and signal.getsignal(signum) is not handler:
+            signal.signal(signum, handler)
+    sys.setrecursionlimit(saved["recursion_limit"])
+    random.setstate(saved["random"])
+
+    problems = []
+    for name, (module, attrs) in saved["modules"].items():
+        if sys.modules.get(name) is not module:
+            sys.modules[name] = module
+        now = vars(module)
+        changed = [attr for attr, value in attrs.items() if now.get(attr, _MISSING) is not value]
+        # Importing a submodule sets it on its package; anything else added is a change
+        changed += [attr for attr, value in now.items() if attr not in attrs
+                    and not (isinstance(value, types.ModuleType) and value.__name__ == f"{name}.{attr}")
+                    and attr != "__warningregistry__"]
+        if changed:
+            problems.append(f"module {name} changed ({', '.join(sorted(changed)[:5])})")
+    for cls, members in saved["methods"].items():
+        if any(vars(cls).get(attr, _MISSING) is not member for attr, member in members.items()):
+            problems.append(f"class {cls.__module__}.{cls.__qualname__} changed")
+    imported = sorted(name for name in sys.modules if name not in saved["modules"] and name != "__main__")
+    if imported:
+        problems.append(f"imported {', '.join(imported[:5])}")
+    threads = [t.name for t in threading.enumerate()
+               if t not in saved["threads"] and t is not job_thread and t.is_alive()]
+    if threads:
+        problems.append(f"left threads running ({', '.join(threads[:5])})")
+    return problems
+
+
+def context_state(sc) -> tuple:
+    """What a job can add to the shared SparkContext and no teardown can remove"""
+    jsc = sc._jsc.sc()
+    return (
+        tuple(sc._python_includes),
+        jsc.listFiles().size(),
+        jsc.listJars().size(),
+        jsc.listArchives().size(),
+        sc.getCheckpointDir(),
+        tuple(sorted(sc.getConf().getAll()))
+    )
+
+
+def create_base_session():
+    from pyspark.sql import SparkSession
+
+    warehouse = tempfile.mkdtemp(prefix="spark-warehouse-")
+    session = (
+        SparkSession.builder
+        .master(os.getenv("SPARK_MASTER", "local[*]"))
+        .appName("codeplay-spark-worker")
+        .config("spark.ui.enabled", "false")
+        .config("spark.sql.warehouse.dir", warehouse)
+        .config("spark.sql.shuffle.partitions", os.getenv("SPARK_SHUFFLE_PARTITIONS", "8"))
+        .getOrCreate()
+    )
+    session.sparkContext.setLogLevel("ERROR")
+    # Warm up the JVM side so the first candidate does not pay for it, and
+    # load what a job session imports so it is not taken for the job's imports
+    session.range(1).count()
+    with job_session(session, {"problems": []}):
+        pass
+    return session
+
+
+@contextlib.contextmanager
+def job_session(base, state: dict):
+    """Make a fresh session the one candidate code sees, and keep it from stopping the driver"""
+    from pyspark import SparkContext
+    from pyspark.sql import SparkSession
+
+    session = base.newSession()
+    database = f"job_{uuid.uuid4().hex}"
+    session.sql(f"CREATE DATABASE {database}")
+    session.catalog.setCurrentDatabase(database)
+
+    context_before = context_state(session.sparkContext)
+    broadcasts = []
+    saved = (SparkSession._instantiatedSession, SparkSession._activeSession,
+             SparkSession.stop, SparkContext.stop, SparkContext.broadcast)
+
+    def broadcast(self, value):
+        variable = saved[4](self, value)
+        broadcasts.append(variable)
+        return variable
+
+    SparkSession._instantiatedSession = session
+    SparkSession._activeSession = session
+    SparkSession.stop = lambda self: None
+    SparkContext.stop = lambda self: None
+    SparkContext.broadcast = broadcast
+    jvm = session.sparkContext._jvm
+    jvm.org.apache.spark.sql.SparkSession.setActiveSession(session._jsparkSession)
+    jvm.org.apache.spark.sql.SparkSession.setDefaultSession(session._jsparkSession)
+    try:
+        yield session
+    finally:
+        (SparkSession._instantiatedSession, SparkSession._activeSession,
+         SparkSession.stop, SparkContext.stop, SparkContext.broadcast) = saved
+        try:
+            jvm.org.apache.spark.sql.SparkSession.setActiveSession(base._jsparkSession)
+            jvm.org.apache.spark.sql.SparkSession.setDefaultSession(base._jsparkSession)
+            tear_down(session, database)
+            for variable in broadcasts:
+                variable.destroy()
+            if context_state(session.sparkContext) != context_before:
+                state["problems"].append("changed the SparkContext")
+        except Exception as e:
+            print(f"✗ Spark job teardown failed: {e}", file=sys.stderr)
+            state["problems"].append("teardown failed")
+
+
+def tear_down(session, database: str):
+    """Drop everything a job left behind in the shared driver"""
+    catalog = session.catalog
+    for table in catalog.listTables():
+        if table.isTemporary:
+            catalog.dropTempView(table.name)
+    for table in catalog.listTables("global_temp"):
+        catalog.dropGlobalTempView(table.name)
+    catalog.clearCache()
+    for rdd in session.sparkContext._jsc.getPersistentRDDs().values():
+        rdd.unpersist()
+    catalog.setCurrentDatabase("default")
+    session.sql(f"DROP DATABASE IF EXISTS {database} CASCADE")
+
+
+def run_code(code: str, stdin_data: str, stdout: CappedOutput, stderr: CappedOutput,
+             sc, job_group: str, outcome: dict):
+    """Thread body: execute candidate code like `python -c` would"""
+    sc.setJobGroup(job_group, "candidate job", interruptOnCancel=True)
+    main_module = types.ModuleType("__main__")
+    saved_main, saved_stdin = sys.modules.get("__main__"), sys.stdin
+    sys.modules["__main__"] = main_module
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            sys.stdin = io.StringIO(stdin_data)
+            try:
+                exec(compile(code, "<string>", "exec"), main_module.__dict__)
+            except SystemExit as e:
+                outcome["exit_code"] = exit_code_for(e)
+            except OutputLimitExceeded:
+                outcome["exit_code"] = 1
+            except BaseException:
+                outcome["exit_code"] = 1
+                etype, value, tb = sys.exc_info()
+                try:
+                    traceback.print_exception(etype, value, tb.tb_next if tb else None)
+                except OutputLimitExceeded:
+                    pass
+    finally:
+        sys.modules["__main__"] = saved_main
+        sys.stdin = saved_stdin
+
+
+def run_job(base, job: dict, emit=None) -> dict:
+    max_output = (job.get("limits") or {}).get("max_output_bytes")
+    stdout, stderr = CappedOutput(max_output), CappedOutput(max_output)
+    outcome = {"exit_code": 0}
+    state = {"problems": []}
+    job_group = f"job-{uuid.uuid4().hex}"
+    timeout = float(job.get("timeout", 30))
+    started = time.monotonic()
+    interpreter = snapshot_interpreter()
+
+    with job_session(base, state) as session:
+        sc = session.sparkContext
+        thread = threading.Thread(
+            target=run_code,
+            args=(job.get("code", ""), job.get("stdin") or "", stdout, stderr, sc, job_group, outcome),
+            daemon=True
+        )
+        thread.start()
+        streaming = emit is not None and job.get("stream")
+        deadline = started + timeout
+        while thread.is_alive() and not current_job["cancelled"]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            thread.join(min(remaining, STREAM_INTERVAL_SECONDS) if streaming else remaining)
+            if streaming:
+                send_output(emit, stdout, stderr)
+        cancelled = current_job["cancelled"]
+        timed_out = thread.is_alive() and not cancelled
+        if thread.is_alive():
+            sc.cancelJobGroup(job_group)
+            thread.join(CANCEL_GRACE_SECONDS)
+        if streaming and not timed_out:
+            send_output(emit, stdout, stderr)
+
+    if not thread.is_alive():
+        state["problems"] += restore_interpreter(interpreter, thread)
+    if state["problems"]:
+        print(f"✗ Retiring Spark worker: job {'; '.join(state['problems'])}", file=sys.stderr)
+
+    return {
+        "stdout": "" if timed_out else stdout.getvalue(),
+        "stderr": "" if timed_out else stderr.getvalue(),
+        "exit_code": -1 if timed_out or cancelled else outcome["exit_code"],
+        "timed_out": timed_out,
+        "limit_exceeded": "output" if stdout.exceeded or stderr.exceeded else None,
+        "cancelled": cancelled,
+        "wall_time": round(time.monotonic() - started, 4),
+        # A thread stuck in pure Python cannot be stopped, and other leftovers
+        # cannot be undone; either way the pool replaces this worker
+        "retire": thread.is_alive() or bool(state["problems"])
+    }
+
+
+def send_output(emit, stdout: CappedOutput, stderr: CappedOutput):
+    for name, buffer in (("stdout", stdout), ("stderr", stderr)):
+        text = buffer.unsent()
+        if text:
+            emit(name, text)
+
+
+def main():
+    # Same channel layout as python_worker: Spark's Python workers inherit
+    # fd 1, so it must not be the protocol pipe.
+    protocol_in = os.dup(0)
+    protocol_out = os.dup(1)
+    os.dup2(2, 1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    preload_modules(os.getenv("PYSPARK_POOL_PRELOAD", f"{DEFAULT_PRELOAD},{SPARK_PRELOAD}"))
+    base = create_base_session()
+    if CONTROL_FD >= 0:
+        os.set_blocking(CONTROL_FD, False)
+    signal.signal(signal.SIGUSR1, cancel_current_job)
+
+    jobs = os.fdopen(protocol_in, "rb")
+    results = os.fdopen(protocol_out, "wb")
+
+    def emit(stream: str, data: str):
+        results.write(json.dumps({"event": "output", "stream": stream, "data": data}).encode() + b"\n")
+        results.flush()
+
+    for line in jobs:
+        try:
+            job = json.loads(line)
+            start_job(job.get("job_id"))
+            result = run_job(base, job, emit)
+        except Exception as e:
+            result = {"stdout": "", "stderr": str(e), "exit_code": 1, "timed_out": False, "retire": True}
+        results.write(json.dumps(result).encode() + b"\n")
+        results.flush()
+        if result.get("retire"):
+            os._exit(1)
+
+
+if __name__ == "__main__":
+    main()
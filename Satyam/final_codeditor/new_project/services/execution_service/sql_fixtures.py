@@ -0,0 +1,139 @@
+"""
+SQL Fixture Store
+Per-problem SQLite databases (schema + seed data) that are built once, kept
+as serialized in-memory images and cloned into a fresh connection per run.
+
+Fixtures come from <SQL_FIXTURES_DIR>/<problem_id>.sql or are registered at
+runtime through register(). Scripts on disk are rebuilt when they change.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+FIXTURES_DIR = os.getenv(
+    "SQL_FIXTURES_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql_fixtures")
+)
+
+SAFE_PROBLEM_ID = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-")
+
+
+def build_image(script: str) -> bytes:
+    """Run a setup script in a scratch database and return its serialized image"""
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.executescript(script)
+        conn.commit()
+        return conn.serialize()
+    finally:
+        conn.close()
+
+
+def clone_image(image: bytes, **connect_args) -> sqlite3.Connection:
+    """Open a private, writable in-memory copy of a fixture image"""
+    conn = sqlite3.connect(":memory:", **connect_args)
+    conn.deserialize(image)
+    return conn
+
+
+def split_statements(script: str) -> list:
+    """Split a SQL script into complete statements (semicolons in literals are safe)"""
+    statements = []
+    current = ""
+    for piece in script.split(";"):
+        current += piece + ";"
+        if sqlite3.complete_statement(current):
+            if current.strip(" \t\r\n;"):
+                statements.append(current.strip())
+            current = ""
+    if current.strip(" \t\r\n;"):
+        statements.append(current.strip())
+    return statements
+
+
+class FixtureStore:
+    """Builds fixture images lazily and hands out cheap per-run clones"""
+
+    def __init__(self, fixtures_dir: str):
+        self.fixtures_dir = fixtures_dir
+        self._images = {}      # problem_id -> (script mtime, image bytes), from disk
+        self._registered = {}  # problem_id -> image bytes, registered at runtime
+        self._generations = {}  # problem_id -> registration count, part of version()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.clones = 0
+
+    def register(self, problem_id: str, script: str) -> int:
+        """Register (or replace) a setup script; returns the image size in bytes"""
+        image = build_image(script)
+        with self._lock:
+            self._registered[problem_id] = image
+            self._generations[problem_id] = self._generations.get(problem_id, 0) + 1
+            self.builds += 1
+        return len(image)
+
+    def version(self, problem_id: Optional[str]) -> str:
+        """Changes whenever the fixture a run of this problem would start from changes"""
+        if not problem_id:
+            return ""
+        with self._lock:
+            if problem_id in self._registered:
+                return f"registered:{self._generations[problem_id]}"
+        path = self._script_path(problem_id)
+        if path is None:
+            return ""
+        return f"file:{os.path.getmtime(path)}"
+
+    def image(self, problem_id: Optional[str]) -> Optional[bytes]:
+        """Serialized fixture for a problem, or None if it has no fixture"""
+        if not problem_id:
+            return None
+
+        with self._lock:
+            if problem_id in self._registered:
+                return self._registered[problem_id]
+
+        path = self._script_path(problem_id)
+        if path is None:
+            return None
+        version = os.path.getmtime(path)
+
+        with self._lock:
+            cached = self._images.get(problem_id)
+            if cached and cached[0] == version:
+                return cached[1]
+
+        with open(path, encoding="utf-8") as f:
+            image = build_image(f.read())
+        with self._lock:
+            self._images[problem_id] = (version, image)
+            self.builds += 1
+        print(f"✓ SQL fixture built for problem {problem_id} ({len(image)} bytes)")
+        return image
+
+    def connect(self, problem_id: Optional[str], **connect_args) -> sqlite3.Connection:
+        """Fresh connection for one run: a clone of the fixture, or a blank database"""
+        image = self.image(problem_id)
+        if image is None:
+            return sqlite3.connect(":memory:", **connect_args)
+        with self._lock:
+            self.clones += 1
+        return clone_image(image, **connect_args)
+
+    def stats(self) -> dict:
+        with self._lock:
+            images = [image for _, image in self._images.values()] + list(self._registered.values())
+            return {
+                "fixtures": len(images),
+                "bytes": sum(len(image) for image in images),
+                "builds": self.builds,
+                "clones": self.clones
+            }
+
+    def _script_path(self, problem_id: str) -> Optional[str]:
+        if not set(problem_id) <= SAFE_PROBLEM_ID:
+            return None
+        path = os.path.join(self.fixtures_dir, f"{problem_id}.sql")
+        return path if os.path.isfile(path) else None
@@ -0,0 +1,14 @@
+-- Fixture for problem 4: SQL - Employee Salary Analysis
+CREATE TABLE employees (
+    employee_name VARCHAR(100) NOT NULL,
+    salary INT NOT NULL,
+    department VARCHAR(50) NOT NULL
+);
+
+INSERT INTO employees (employee_name, salary, department) VALUES
+    ('john', 65000, 'sales'),
+    ('mary', 45000, 'sales'),
+    ('alice', 72000, 'hr'),
+    ('tom', 48000, 'hr'),
+    ('bob', 58000, 'it'),
+    ('eve', 46000, 'it');
@@ -0,0 +1,78 @@
+"""
+Stage Timings
+Where the time of one run goes:
+
+- queue_wait: waiting for a language slot (or, in queue mode, for a worker)
+- workspace_setup: scratch directory, source file, SQL fixture clone
+- compile: javac, or fetching classes from the compile cache
+- spawn: starting the process, or checking out a warm worker
+- run: the program itself
+- teardown: reaping, cgroup removal, workspace cleanup, returning workers
+
+Executors record stages on the timings bound to their thread (see bound()),
+so timings need not be passed through every executor signature. Code that
+runs with nothing bound records into a sink that discards everything.
+"""
+
+import contextlib
+import threading
+import time
+
+STAGES = ("queue_wait", "workspace_setup", "compile", "spawn", "run", "teardown")
+
+
+class StageTimings:
+    """Seconds spent per stage by one run; repeated stages add up"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def as_dict(self) -> dict:
+        return {stage: round(self.stages[stage], 4) for stage in STAGES if stage in self.stages}
+
+
+class _Discard(StageTimings):
+    def add(self, stage: str, seconds: float):
+        pass
+
+
+_DISCARD = _Discard()
+_local = threading.local()
+
+
+def current() -> StageTimings:
+    """The timings bound to this thread"""
+    return getattr(_local, "timings", None) or _DISCARD
+
+
+def stage(name: str):
+    """Time a block as one stage of the current run"""
+    return current().stage(name)
+
+
+@contextlib.contextmanager
+def bound(timings: StageTimings):
+    """Record the stages of everything run in this block on timings"""
+    previous = getattr(_local, "timings", None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def call_with(timings: StageTimings, func, *args):
+    """func(*args) with timings bound; for handing to an executor thread"""
+    with bound(timings):
+        return func(*args)
@@ -0,0 +1,219 @@
+"""
+Workspace Pool
+Scratch directories for compile jobs, kept on a RAM-backed filesystem
+(/dev/shm by default) so writing a source file and reading back its
+classes never touches the disk.
+
+Directories are created once and recycled: release() empties a workspace
+and puts it back. When every workspace is taken, an extra one is made and
+removed again on release. A janitor thread reclaims workspaces held longer
+than max_lease_seconds without a renew() (a job that died without
+releasing), and at start the pool clears out directories left behind by
+dead processes. A long holder, such as a batch running many cases, renews
+its lease as it goes. A reclaimed directory is deleted rather than reused,
+so a late release() by its old holder can never touch another job's
+workspace.
+
+Layout: <WORKSPACE_ROOT>/<pid>/ws-<n>, one subtree per process so API and
+worker processes on the same host never share a workspace.
+
+Configuration (environment):
+- WORKSPACE_ROOT: parent directory (default: /dev/shm/codeplay-workspaces,
+  or <tmp>/codeplay-workspaces without /dev/shm)
+- WORKSPACE_POOL_SIZE: workspaces kept ready
+- WORKSPACE_MAX_LEASE: seconds before a held workspace counts as leaked
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Optional
+
+# How often the janitor looks for leaked workspaces
+JANITOR_INTERVAL_SECONDS = 30
+
+
+def filesystem_type(path: str) -> str:
+    """Filesystem type of the mount holding path (e.g. tmpfs), from /proc/mounts"""
+    path = os.path.realpath(path)
+    best, kind = "", "unknown"
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1]
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) > len(best):
+                    best, kind = mount_point, fields[2]
+    except OSError:
+        pass
+    return kind
+
+
+def wipe(path: str):
+    """Remove everything inside a directory, keeping the directory"""
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WorkspacePool:
+    """Recycled scratch directories, ideally on tmpfs"""
+
+    def __init__(self, root: str, size: int, max_lease_seconds: float = 300):
+        self.parent = root
+        self.root = os.path.join(root, str(os.getpid()))
+        self.size = size
+        self.max_lease_seconds = max_lease_seconds
+        self.filesystem = "unknown"
+        self.acquired = 0
+        self.overflows = 0
+        self.reclaimed = 0
+        self._free = []
+        self._leases = {}  # path -> acquired at (monotonic)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._janitor = None
+
+    def start(self):
+        """Create the workspaces and start the janitor"""
+        os.makedirs(self.parent, exist_ok=True)
+        self._remove_orphans()
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root)
+        self.filesystem = filesystem_type(self.root)
+        with self._lock:
+            self._free = [self._create(f"ws-{n}") for n in range(self.size)]
+        self._janitor = threading.Thread(target=self._run_janitor, name="workspace-janitor", daemon=True)
+        self._janitor.start()
+        print(f"✓ Workspace pool ready ({self.size} workspaces on {self.filesystem} at {self.root})")
+
+    def shutdown(self):
+        self._stopping.set()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def acquire(self) -> str:
+        """An empty workspace; hand it back with release()"""
+        with self._lock:
+            path = self._free.pop() if self._free else None
+            if path is None:
+                self.overflows += 1
+            self.acquired += 1
+        if path is None:
+            path = self._create(f"ws-x-{uuid.uuid4().hex[:8]}")
+        with self._lock:
+            self._leases[path] = time.monotonic()
+        return path
+
+    def renew(self, path: str) -> bool:
+        """Restart the lease of a workspace still in use; False if it was already reclaimed"""
+        with self._lock:
+            if path not in self._leases:
+                return False
+            self._leases[path] = time.monotonic()
+            return True
+
+    def release(self, path: str):
+        with self._lock:
+            if self._leases.pop(path, None) is None:
+                # Already reclaimed by the janitor
+                return
+        self._recycle(path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "root": self.root,
+                "filesystem": self.filesystem,
+                "size": self.size,
+                "free": len(self._free),
+                "leased": len(self._leases),
+                "acquired": self.acquired,
+                "overflows": self.overflows,
+                "reclaimed": self.reclaimed
+            }
+
+    def _create(self, name: str) -> str:
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _recycle(self, path: str):
+        try:
+            wipe(path)
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        with self._lock:
+            if len(self._free) < self.size and not os.path.basename(path).startswith("ws-x-"):
+                self._free.append(path)
+                return
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _run_janitor(self):
+        while not self._stopping.wait(JANITOR_INTERVAL_SECONDS):
+            self.reclaim_leaked()
+
+    def reclaim_leaked(self) -> int:
+        """Take back workspaces held past max_lease_seconds"""
+        cutoff = time.monotonic() - self.max_lease_seconds
+        with self._lock:
+            leaked = [path for path, since in self._leases.items() if since < cutoff]
+            for path in leaked:
+                del self._leases[path]
+            self.reclaimed += len(leaked)
+        for path in leaked:
+            print(f"✗ Reclaiming leaked workspace {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            if os.path.basename(path).startswith("ws-x-"):
+                continue
+            # A fresh name: the old one stays unknown to the pool for good
+            replacement = self._create(f"ws-r-{uuid.uuid4().hex[:8]}")
+            with self._lock:
+                self._free.append(replacement)
+        return len(leaked)
+
+    def _remove_orphans(self):
+        """Delete the workspaces of processes that are gone"""
+        for name in os.listdir(self.parent):
+            if name.isdigit() and int(name) != os.getpid() and not process_alive(int(name)):
+                shutil.rmtree(os.path.join(self.parent, name), ignore_errors=True)
+
+
+def default_workspace_root() -> str:
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return os.path.join(shm, "codeplay-workspaces")
+    return os.path.join(tempfile.gettempdir(), "codeplay-workspaces")
+
+
+def create_workspace_pool_from_env() -> Optional[WorkspacePool]:
+    """Build the pool from environment settings, or None when WORKSPACE_POOL_SIZE is 0"""
+    size = int(os.getenv("WORKSPACE_POOL_SIZE", "8"))
+    if size <= 0:
+        return None
+    return WorkspacePool(
+        os.getenv("WORKSPACE_ROOT", default_workspace_root()),
+        size,
+        float(os.getenv("WORKSPACE_MAX_LEASE", "300"))
+    )
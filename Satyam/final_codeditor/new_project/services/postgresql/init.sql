@@ -1,5 +1,17 @@
 -- PostgreSQL Initialization Script for CodePlay
--- Creates test_answer table for storing candidate test submissions
+-- Creates test_answer table for storing candidate test submissions.
+-- Every statement is idempotent: run it again on an existing database
+-- (psql -f init.sql) to bring an older schema up to date.
+
+-- Code bodies, stored once each: keyed by the SHA-256 of the code, zstd-compressed
+-- from TEXT_COMPRESS_MIN_BYTES up and stored as they are below it
+CREATE TABLE IF NOT EXISTS code_blob (
+    hash CHAR(64) PRIMARY KEY,
+    body BYTEA NOT NULL,
+    size INTEGER NOT NULL,
+    compression VARCHAR(16) NOT NULL DEFAULT 'zstd',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
 
 -- Create test_answer table
 CREATE TABLE IF NOT EXISTS test_answer (
@@ -7,10 +19,13 @@ CREATE TABLE IF NOT EXISTS test_answer (
     candidate_id VARCHAR(255) NOT NULL,
     problem_id VARCHAR(255) NOT NULL,
     language VARCHAR(50) NOT NULL,
-    code TEXT NOT NULL,
+    code TEXT,
+    code_hash CHAR(64) REFERENCES code_blob(hash),
     stdin TEXT DEFAULT '',
     stdout TEXT DEFAULT '',
+    stdout_z BYTEA,
     output TEXT DEFAULT '',
+    output_z BYTEA,
     status VARCHAR(50) DEFAULT 'pending',
     is_passed BOOLEAN DEFAULT FALSE,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -18,21 +33,53 @@ CREATE TABLE IF NOT EXISTS test_answer (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Defaults changed since code_blob was first created
+ALTER TABLE code_blob ALTER COLUMN compression SET DEFAULT 'zstd';
+
+-- Columns added since test_answer was first created
+ALTER TABLE test_answer ALTER COLUMN code DROP NOT NULL;
+ALTER TABLE test_answer ADD COLUMN IF NOT EXISTS code_hash CHAR(64) REFERENCES code_blob(hash);
+ALTER TABLE test_answer ADD COLUMN IF NOT EXISTS stdout_z BYTEA;
+ALTER TABLE test_answer ADD COLUMN IF NOT EXISTS output_z BYTEA;
+
 -- Create indexes for faster queries
-CREATE INDEX idx_candidate_id ON test_answer(candidate_id);
-CREATE INDEX idx_problem_id ON test_answer(problem_id);
-CREATE INDEX idx_candidate_problem ON test_answer(candidate_id, problem_id);
-CREATE INDEX idx_timestamp ON test_answer(timestamp);
-CREATE INDEX idx_status ON test_answer(status);
+-- Keyset pages of GET /test-answers/{candidate_id}: newest first by (timestamp, id),
+-- optionally for one problem. They also serve plain candidate_id lookups.
+CREATE INDEX IF NOT EXISTS idx_candidate_timestamp_id ON test_answer(candidate_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_candidate_problem_timestamp_id ON test_answer(candidate_id, problem_id, timestamp DESC, id DESC);
+-- Superseded by the two above on databases created before them
+DROP INDEX IF EXISTS idx_candidate_id;
+DROP INDEX IF EXISTS idx_candidate_problem;
+CREATE INDEX IF NOT EXISTS idx_problem_id ON test_answer(problem_id);
+-- Identical submissions: every answer with the same code
+CREATE INDEX IF NOT EXISTS idx_code_hash ON test_answer(code_hash);
+CREATE INDEX IF NOT EXISTS idx_timestamp ON test_answer(timestamp);
+CREATE INDEX IF NOT EXISTS idx_status ON test_answer(status);
+
+-- Batches stored through POST /test-answers/bulk, by the client's idempotency key,
+-- so a retried batch returns its original ids instead of inserting again
+CREATE TABLE IF NOT EXISTS test_answer_batch (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    request_hash CHAR(64) NOT NULL,
+    answer_count INTEGER NOT NULL,
+    answer_ids INTEGER[],
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
 
 -- Add comments
 COMMENT ON TABLE test_answer IS 'Stores test submissions from candidates with code, execution results, and pass/fail status';
 COMMENT ON COLUMN test_answer.candidate_id IS 'ID of the candidate taking the test';
 COMMENT ON COLUMN test_answer.problem_id IS 'ID of the coding problem';
 COMMENT ON COLUMN test_answer.language IS 'Programming language used (python, java, sql, pyspark)';
-COMMENT ON COLUMN test_answer.code IS 'The code submitted by candidate';
+COMMENT ON COLUMN test_answer.code IS 'The code submitted by candidate, inline (rows written before code_blob)';
+COMMENT ON COLUMN test_answer.code_hash IS 'SHA-256 of the code submitted by candidate, in code_blob';
 COMMENT ON COLUMN test_answer.stdin IS 'Input provided to the code (from sample_input or manual)';
 COMMENT ON COLUMN test_answer.stdout IS 'Raw output from code execution';
 COMMENT ON COLUMN test_answer.output IS 'Processed output for comparison';
+COMMENT ON COLUMN test_answer.stdout_z IS 'stdout zstd-compressed when large (stdout is then NULL)';
+COMMENT ON COLUMN test_answer.output_z IS 'output zstd-compressed when large (output is then NULL)';
 COMMENT ON COLUMN test_answer.status IS 'Execution status: pending, success, error, timeout';
 COMMENT ON COLUMN test_answer.is_passed IS 'Whether output matches expected sample_output';
+COMMENT ON TABLE test_answer_batch IS 'Idempotency keys of bulk test answer uploads and the ids they were stored under';
+COMMENT ON TABLE code_blob IS 'Content-addressed code bodies referenced by test_answer.code_hash and MongoDB code_submissions';
+COMMENT ON COLUMN code_blob.compression IS 'How body is stored: zstd, none (short code), or zlib (blobs written before zstd)';
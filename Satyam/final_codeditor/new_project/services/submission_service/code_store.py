@@ -0,0 +1,86 @@
+"""
+Content-Addressed Code Store
+Code bodies are stored once in the PostgreSQL code_blob table, keyed by the
+SHA-256 of their text and zstd-compressed once they reach
+TEXT_COMPRESS_MIN_BYTES (blobs written before zstd stay zlib; the
+compression column says which). test_answer rows and MongoDB
+code_submissions reference them by code_hash, so identical code from many
+candidates or attempts is one blob, and finding identical submissions is an
+index lookup on code_hash.
+
+Rows written before code_blob existed keep their code inline; readers use
+the inline code when a row has no hash. Drafts are not stored here: they
+change on every save and are kept as checkpoints plus deltas instead.
+"""
+
+import hashlib
+from typing import Iterable, List, Tuple
+
+import text_store
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def compress(code: str) -> Tuple[bytes, str]:
+    """(body, compression) to store code as; short code is left as it is"""
+    data = code.encode()
+    if len(data) < text_store.TEXT_COMPRESS_MIN_BYTES:
+        return data, "none"
+    return text_store.compress(data), "zstd"
+
+
+def decompress(body: bytes, compression: str) -> str:
+    return text_store.decompress(body, compression).decode()
+
+
+async def store_blobs(cursor, codes: Iterable[str]) -> List[str]:
+    """Store each distinct code once; returns the hash of every code, in order"""
+    codes = list(codes)
+    hashes, blobs = [], {}
+    for code in codes:
+        digest = code_hash(code)
+        hashes.append(digest)
+        if digest not in blobs:
+            body, compression = compress(code)
+            blobs[digest] = (digest, body, len(code.encode()), compression)
+    # Known blobs are skipped by the primary key; concurrent writers of the same blob wait for each other.
+    # Inserting in hash order means two transactions sharing blobs lock them in the same order and never deadlock.
+    await cursor.executemany(
+        "INSERT INTO code_blob (hash, body, size, compression) VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (hash) DO NOTHING RETURNING hash, octet_length(body) AS stored, compression",
+        [blobs[digest] for digest in sorted(blobs)],
+        returning=True
+    )
+    # Only blobs written here take up space; a code already stored costs nothing more
+    written = {}
+    while True:
+        for row in await cursor.fetchall():
+            written[row["hash"]] = row
+        if not cursor.nextset():
+            break
+    for digest, code in zip(hashes, codes):
+        row = written.pop(digest, None)
+        text_store.stats.record("code", len(code.encode()), row["stored"] if row else 0,
+                                compressed=bool(row) and row["compression"] == "zstd")
+    return hashes
+
+
+async def load_blobs(cursor, hashes: Iterable[str]) -> dict:
+    """Code by hash for every known hash in hashes"""
+    wanted = list(set(hashes))
+    if not wanted:
+        return {}
+    await cursor.execute("SELECT hash, body, compression FROM code_blob WHERE hash = ANY(%s)", (wanted,))
+    return {row["hash"]: decompress(row["body"], row["compression"]) for row in await cursor.fetchall()}
+
+
+async def attach_code(cursor, rows: List[dict]) -> List[dict]:
+    """Fill in "code" of rows that selected it but reference a blob instead of holding it inline"""
+    missing = [row for row in rows if "code" in row and row["code"] is None and row.get("code_hash")]
+    if missing:
+        codes = await load_blobs(cursor, [row["code_hash"] for row in missing])
+        for row in missing:
+            row["code"] = codes.get(row["code_hash"])
+    return rows
@@ -0,0 +1,204 @@
+"""
+Draft Write-Behind Buffer
+Autosaves land in memory keyed by draft_id; a save is merged into the
+pending update of the same draft (later fields win, appended deltas add
+up), so each draft gets at most one write per flush. A background task
+flushes everything pending to MongoDB with one unordered bulk_write every
+DRAFT_FLUSH_INTERVAL seconds, or sooner once DRAFT_BUFFER_MAX drafts are
+pending.
+
+Durability: the whole buffer is flushed on shutdown, and a candidate's
+draft is flushed before their submission is stored. A flush that fails
+keeps the updates that did not land pending, merged under any saves made
+meanwhile. A hard crash loses at most one interval of autosaves.
+
+Every write is safe to repeat, since a failed flush may have partly
+landed. Each draft gets one pipeline update (MongoDB 4.2+) that sets its
+fields and rebuilds each appended list as the stored items minus the new
+ones, followed by the new ones. A retried append is never stored twice and
+keeps its order.
+
+Flushes run one at a time, so an older version of a draft can never land
+after a newer one. Reads check the buffer first; with several API
+processes, a draft is only visible to the process that buffered it until
+it is flushed.
+
+Configuration (environment):
+- DRAFT_FLUSH_INTERVAL: seconds between flushes
+- DRAFT_BUFFER_MAX: pending drafts that trigger an early flush
+"""
+
+import asyncio
+import time
+from typing import Callable, Iterable, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+def merge(update: dict, fields: dict, append: Optional[dict] = None):
+    """Fold a later update into a pending one; setting a list field drops earlier appends to it"""
+    for field in fields:
+        update["push"].pop(field, None)
+    update["set"].update(fields)
+    for field, items in (append or {}).items():
+        if field in update["set"]:
+            update["set"][field] = list(update["set"][field]) + list(items)
+        else:
+            update["push"].setdefault(field, []).extend(items)
+
+
+def mongo_update(update: dict) -> list:
+    """Update pipeline applying a pending update; applying it twice changes nothing"""
+    # $literal, so stored text starting with "$" is never read as a field path
+    fields = {field: {"$literal": value} for field, value in update["set"].items()}
+    for field, items in update["push"].items():
+        fields[field] = {"$concatArrays": [
+            {"$filter": {
+                "input": {"$ifNull": [f"${field}", []]},
+                "cond": {"$not": [{"$in": ["$$this", {"$literal": items}]}]}
+            }},
+            {"$literal": items}
+        ]}
+    return [{"$set": fields}]
+
+
+class DraftBuffer:
+    def __init__(self, get_collection: Callable, interval: float = 2.0, max_pending: int = 5000):
+        self.get_collection = get_collection
+        self.interval = interval
+        self.max_pending = max_pending
+        self.saves = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def put(self, draft_id: str, fields: dict, append: Optional[dict] = None):
+        """
+        Buffer an update of a draft: fields to set, and items to append to
+        list fields (e.g. {"deltas": [delta]}). Merged into any pending update
+        of the same draft.
+        """
+        self.saves += 1
+        update = self._pending.pop(draft_id, None)
+        if update is not None:
+            self.coalesced += 1
+        else:
+            update = {"set": {}, "push": {}}
+        merge(update, fields, append)
+        self._pending[draft_id] = update
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def get(self, draft_id: str, stored: Optional[dict] = None) -> Optional[dict]:
+        """The stored draft document with its pending update applied, as the next flush will leave it"""
+        update = self._pending.get(draft_id)
+        if update is None:
+            return stored
+        draft = dict(stored or {}, draft_id=draft_id)
+        draft.update(update["set"])
+        for field, items in update["push"].items():
+            draft[field] = list(draft.get(field) or []) + items
+        return draft
+
+    async def flush(self, draft_ids: Optional[Iterable[str]] = None) -> int:
+        """Write pending drafts (all of them, or just draft_ids); returns how many were written"""
+        async with self._lock:
+            if draft_ids is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {draft_id: self._pending.pop(draft_id) for draft_id in draft_ids
+                         if draft_id in self._pending}
+            if not batch:
+                return 0
+            collection = self.get_collection()
+            started = time.perf_counter()
+            owners = list(batch)
+            operations = [UpdateOne({"draft_id": draft_id}, mongo_update(batch[draft_id]), upsert=True)
+                          for draft_id in owners]
+            try:
+                if collection is None:
+                    raise RuntimeError("MongoDB is not connected")
+                await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                failed = {owners[error["index"]] for error in e.details.get("writeErrors", [])}
+                self._requeue({draft_id: batch[draft_id] for draft_id in failed})
+                print(f"✗ Draft flush failed for {len(failed)} of {len(batch)} drafts, kept pending: "
+                      f"{e.details.get('writeErrors', [{}])[0].get('errmsg')}")
+                self.written += len(batch) - len(failed)
+                return len(batch) - len(failed)
+            except Exception as e:
+                # Some writes may have landed; repeating them is harmless
+                self._requeue(batch)
+                print(f"✗ Draft flush of {len(batch)} failed, kept pending: {e}")
+                return 0
+            self.flushes += 1
+            self.written += len(batch)
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+            return len(batch)
+
+    def _requeue(self, failed: dict):
+        """Put updates that did not land back, under any saves made since"""
+        if not failed:
+            return
+        self.failures += 1
+        for draft_id, update in failed.items():
+            newer = self._pending.pop(draft_id, None)
+            if newer is not None:
+                merge(update, newer["set"], newer["push"])
+            self._pending[draft_id] = update
+
+    async def delete(self, draft_id: str):
+        """Drop a draft from the buffer and from MongoDB, so no pending flush can bring it back"""
+        async with self._lock:
+            self._pending.pop(draft_id, None)
+            collection = self.get_collection()
+            if collection is None:
+                raise RuntimeError("MongoDB is not connected")
+            await collection.delete_one({"draft_id": draft_id})
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still pending"""
+        if self._task is not None:
+            # Let a flush in progress finish rather than cancel it halfway
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        written = await self.flush()
+        if self._pending:
+            print(f"✗ {len(self._pending)} drafts could not be written at shutdown")
+        elif written:
+            print(f"✓ Flushed {written} buffered drafts")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "saves": self.saves,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+            "last_flush_ms": self.last_flush_ms,
+            "interval": self.interval
+        }
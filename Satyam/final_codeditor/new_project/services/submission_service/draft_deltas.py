@@ -0,0 +1,126 @@
+"""
+Delta-Encoded Drafts
+Instead of the full code on every autosave, a client may send the edits
+since the version it last saved:
+
+    {"base_version": 41, "edits": [{"offset": 120, "length": 3, "text": "sum"}]}
+
+Each edit replaces `length` characters (code points) at `offset` with
+`text`; edits apply in order, each to the result of the one before. When
+base_version is not the stored version (another tab saved, or the server
+lost its copy), or the result does not match the client's "checksum"
+(text_checksum of the text it has), the save is refused as a conflict and
+the client sends the full code instead.
+
+A draft document in code_drafts holds a checkpoint and the deltas since:
+
+- code: full text as of checkpoint_version
+- deltas: [{"version": n, "edits": [...]}, ...] after the checkpoint
+- version: version of the newest delta (the current text)
+
+A full save, DRAFT_CHECKPOINT_EVERY deltas, or deltas outgrowing the
+checkpoint text start a new checkpoint. The closed segment (checkpoint plus
+its deltas) is archived in code_draft_history, which keeps the whole edit
+history of a draft. Documents saved before deltas existed read as a
+checkpoint at version 0.
+
+Current texts are kept in an in-process LRU (DRAFT_STATE_CACHE drafts) so a
+patch applies without reading MongoDB; a miss rebuilds the draft from its
+document.
+"""
+
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class PatchError(ValueError):
+    pass
+
+
+def apply_edits(code: str, edits: List[dict]) -> str:
+    """code with each {"offset", "length", "text"} edit applied in order"""
+    for edit in edits:
+        offset, length = edit.get("offset"), edit.get("length", 0)
+        if not isinstance(offset, int) or not isinstance(length, int):
+            raise PatchError("edit offset and length must be integers")
+        if offset < 0 or length < 0 or offset + length > len(code):
+            raise PatchError(f"edit {offset}+{length} is outside the {len(code)}-character draft")
+        code = code[:offset] + (edit.get("text") or "") + code[offset + length:]
+    return code
+
+
+def text_checksum(text: str) -> str:
+    """CRC-32 of the UTF-8 text in hex, as the editor computes it"""
+    return f"{zlib.crc32(text.encode()):08x}"
+
+
+def edits_size(edits: List[dict]) -> int:
+    return sum(len(edit.get("text") or "") + 16 for edit in edits)
+
+
+class DraftState:
+    """Checkpoint plus deltas of one draft, and the text they add up to"""
+
+    def __init__(self, checkpoint: str, checkpoint_version: int, deltas: List[dict] = None):
+        self.checkpoint = checkpoint
+        self.checkpoint_version = checkpoint_version
+        # Versions only grow; a delta stored twice by an older flush is applied once
+        self.deltas, version = [], checkpoint_version
+        for delta in deltas or []:
+            if delta["version"] > version:
+                self.deltas.append(delta)
+                version = delta["version"]
+        code = checkpoint
+        for delta in self.deltas:
+            code = apply_edits(code, delta["edits"])
+        self.code = code
+
+    @property
+    def version(self) -> int:
+        return self.deltas[-1]["version"] if self.deltas else self.checkpoint_version
+
+    @property
+    def delta_size(self) -> int:
+        return sum(edits_size(delta["edits"]) for delta in self.deltas)
+
+    @classmethod
+    def from_document(cls, doc: Optional[dict]) -> Optional["DraftState"]:
+        if not doc:
+            return None
+        return cls(doc.get("code") or "", doc.get("checkpoint_version", 0), doc.get("deltas"))
+
+    def segment(self) -> dict:
+        """The checkpoint and its deltas, as archived in code_draft_history"""
+        return {
+            "checkpoint_version": self.checkpoint_version,
+            "code": self.checkpoint,
+            "deltas": self.deltas,
+            "version": self.version
+        }
+
+
+class DraftStates:
+    """LRU of current draft states by draft_id"""
+
+    def __init__(self, size: int = 10000):
+        self.size = size
+        self._states = OrderedDict()
+
+    def get(self, draft_id: str) -> Optional[DraftState]:
+        state = self._states.get(draft_id)
+        if state is not None:
+            self._states.move_to_end(draft_id)
+        return state
+
+    def put(self, draft_id: str, state: DraftState):
+        self._states[draft_id] = state
+        self._states.move_to_end(draft_id)
+        while len(self._states) > self.size:
+            self._states.popitem(last=False)
+
+    def discard(self, draft_id: str):
+        self._states.pop(draft_id, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
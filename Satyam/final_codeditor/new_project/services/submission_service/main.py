@@ -8,18 +8,31 @@ Database Structure:
 - PostgreSQL: test_answer table (primary storage for test submissions)
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from typing import Optional, List
 from datetime import datetime
+import base64
+import contextlib
+import csv
+import hashlib
+import io
 import os
 import uuid
 import json
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import zlib
+from psycopg.conninfo import make_conninfo
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from code_store import attach_code, load_blobs, store_blobs
+from draft_buffer import DraftBuffer
+from draft_deltas import DraftState, DraftStates, PatchError, apply_edits, edits_size, text_checksum
+from text_store import COMPRESSED_COLUMNS, pack, unpack, stats as text_stats
 
 app = FastAPI(title="Submission Service", version="1.0.0")
 
@@ -44,6 +57,31 @@ POSTGRES_CONFIG = {
     "database": os.getenv("POSTGRES_DB", "codeplay_db")
 }
 
+# Connection pools, created once at startup and shared by all requests
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "20"))
+# Longest a request waits for a free PostgreSQL connection
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
+
+# Page sizes of the history lists (GET /test-answers, GET /submissions)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "1000"))
+
+# Rows an export fetches from its server-side cursor per round trip
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+
+# Most answers one POST /test-answers/bulk may carry
+TEST_ANSWER_BULK_MAX = int(os.getenv("TEST_ANSWER_BULK_MAX", "5000"))
+
+# Draft autosaves are buffered and written to MongoDB in bulk (see draft_buffer.py)
+DRAFT_FLUSH_INTERVAL = float(os.getenv("DRAFT_FLUSH_INTERVAL", "2"))
+DRAFT_BUFFER_MAX = int(os.getenv("DRAFT_BUFFER_MAX", "5000"))
+# Drafts are stored as checkpoints plus deltas (see draft_deltas.py)
+DRAFT_CHECKPOINT_EVERY = int(os.getenv("DRAFT_CHECKPOINT_EVERY", "50"))
+DRAFT_STATE_CACHE = int(os.getenv("DRAFT_STATE_CACHE", "10000"))
+
 # ======================= REQUEST MODELS =======================
 
 # Request Models
@@ -69,24 +107,134 @@ class TestAnswerRequest(BaseModel):
     is_passed: bool = False
     expected_output: str = ""
 
+class BulkTestAnswerRequest(BaseModel):
+    """Many test answers stored in one transaction; a retry with the same idempotency_key stores nothing"""
+    answers: List[TestAnswerRequest]
+    idempotency_key: Optional[str] = None
+
+class DraftEdit(BaseModel):
+    offset: int
+    length: int = 0
+    text: str = ""
+
 class DraftRequest(BaseModel):
+    """Either the full code, or the edits since base_version (see draft_deltas.py)"""
     candidate_id: str  # Changed from user_id
     problem_id: str
     language: str
-    code: str
+    code: Optional[str] = None
+    base_version: Optional[int] = None
+    edits: Optional[List[DraftEdit]] = None
+    # text_checksum of the text the edits should produce
+    checksum: Optional[str] = None
     cursor_position: Optional[int] = 0
     status: str = "draft"
 
-def get_mongodb_client():
-    """Get MongoDB connection"""
+# ======================= CONNECTION POOLS =======================
+
+# Both drivers are asyncio-native, so a handler waiting on the database
+# yields the event loop to other requests instead of blocking it
+mongo_client: Optional[AsyncIOMotorClient] = None
+
+postgres_pool = AsyncConnectionPool(
+    make_conninfo(
+        host=POSTGRES_CONFIG["host"],
+        port=POSTGRES_CONFIG["port"],
+        user=POSTGRES_CONFIG["user"],
+        password=POSTGRES_CONFIG["password"],
+        dbname=POSTGRES_CONFIG["database"],
+        connect_timeout=5
+    ),
+    min_size=POSTGRES_POOL_MIN,
+    max_size=POSTGRES_POOL_MAX,
+    timeout=POSTGRES_POOL_TIMEOUT,
+    kwargs={"row_factory": dict_row},
+    open=False
+)
+
+@app.on_event("startup")
+async def startup():
+    """Open the MongoDB client and the PostgreSQL pool once for the whole app"""
+    global mongo_client
+    mongo_client = AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=5000
+    )
     try:
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')
-        print("✓ MongoDB connected")
-        return client
+        await mongo_client.admin.command('ping')
+        print(f"✓ MongoDB connected (pool of up to {MONGO_MAX_POOL_SIZE})")
     except Exception as e:
-        print(f"✗ MongoDB connection failed: {e} - Running in MOCK_MODE")
-        return None
+        print(f"✗ MongoDB connection failed: {e} - will keep retrying")
+    try:
+        db = mongo_client.codeplay
+        await db.code_drafts.create_index("draft_id", unique=True)
+        await db.code_draft_history.create_index([("draft_id", 1), ("checkpoint_version", 1)])
+        # Backs the keyset pages of GET /submissions/{candidate_id}
+        await db.code_submissions.create_index([("candidate_id", 1), ("timestamp", -1), ("_id", -1)])
+    except Exception as e:
+        print(f"✗ MongoDB indexes not created: {e}")
+    # Connections are opened in the background, and retried while PostgreSQL is down
+    await postgres_pool.open(wait=False)
+    print(f"✓ PostgreSQL pool opening ({POSTGRES_POOL_MIN}-{POSTGRES_POOL_MAX} connections)")
+    draft_buffer.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Buffered drafts are written before the client they need is closed
+    await draft_buffer.stop()
+    if mongo_client is not None:
+        mongo_client.close()
+    await postgres_pool.close()
+
+@contextlib.asynccontextmanager
+async def postgres_connection(timeout: float = POSTGRES_POOL_TIMEOUT):
+    """A pooled connection, or None when PostgreSQL is unreachable or the pool stays exhausted"""
+    try:
+        conn = await postgres_pool.getconn(timeout=timeout)
+    except PoolTimeout:
+        print(f"✗ No PostgreSQL connection free after {timeout}s")
+        yield None
+        return
+    except Exception as e:
+        print(f"✗ PostgreSQL connection failed: {e}")
+        yield None
+        return
+    try:
+        yield conn
+    finally:
+        # Reads leave a transaction open; end it here so the next borrower starts clean
+        if conn.info.transaction_status != TransactionStatus.IDLE and not conn.closed:
+            await conn.rollback()
+        await postgres_pool.putconn(conn)
+
+def postgres_pool_stats() -> dict:
+    stats = postgres_pool.get_stats()
+    return {
+        "min": POSTGRES_POOL_MIN,
+        "max": POSTGRES_POOL_MAX,
+        "open": stats.get("pool_size", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "waits": stats.get("requests_queued", 0),
+        "timeouts": stats.get("requests_errors", 0)
+    }
+
+def get_mongodb():
+    """The codeplay database on the shared MongoDB client"""
+    return mongo_client.codeplay if mongo_client is not None else None
+
+def draft_id_for(candidate_id: str, problem_id: str) -> str:
+    return f"{candidate_id}_{problem_id}_draft"
+
+draft_buffer = DraftBuffer(
+    lambda: get_mongodb().code_drafts if mongo_client is not None else None,
+    interval=DRAFT_FLUSH_INTERVAL,
+    max_pending=DRAFT_BUFFER_MAX
+)
+
+draft_states = DraftStates(DRAFT_STATE_CACHE)
 
 def convert_mongo_doc(doc: dict) -> dict:
     """Convert MongoDB document to JSON-serializable dict"""
@@ -102,26 +250,66 @@ def convert_mongo_doc(doc: dict) -> dict:
             result[key] = value
     return result
 
-# ======================= POSTGRESQL FUNCTIONS =======================
+# ======================= HISTORY PAGES =======================
+
+# Fields the history lists can return; list views leave out the large text ones with fields=
+TEST_ANSWER_FIELDS = (
+    "id", "candidate_id", "problem_id", "language", "code", "code_hash", "stdin", "stdout", "output",
+    "status", "is_passed", "timestamp"
+)
+SUBMISSION_FIELDS = (
+    "submission_id", "candidate_id", "problem_id", "language", "code", "code_hash", "stdin", "status", "timestamp"
+)
+
+def stored_columns(fields: tuple) -> tuple:
+    """Columns to read for fields: code may live in code_blob, so its hash is read with it"""
+    if "code" in fields and "code_hash" not in fields:
+        return fields + ("code_hash",)
+    return fields
+
+def test_answer_columns(fields: tuple, decompress: bool = False) -> tuple:
+    """
+    SELECT list for fields of test_answer: compressed text comes with its
+    _z twin to decompress, or otherwise just a flag saying it is compressed
+    """
+    columns = stored_columns(fields)
+    for column in COMPRESSED_COLUMNS:
+        if column in fields:
+            columns += (f"{column}_z",) if decompress else (f"{column}_z IS NOT NULL AS {column}_compressed",)
+    return columns
+
+def drop_unrequested(rows: List[dict], fields: tuple) -> List[dict]:
+    if "code" in fields and "code_hash" not in fields:
+        for row in rows:
+            row.pop("code_hash", None)
+    return rows
+
+def parse_fields(fields: Optional[str], allowed: tuple, always: tuple) -> tuple:
+    """The requested subset of allowed (all of it when fields is empty), plus the always fields"""
+    if not fields:
+        return allowed
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+    return tuple(field for field in allowed if field in requested or field in always)
 
-def get_postgres_connection():
-    """Get PostgreSQL connection"""
+def encode_cursor(timestamp, row_id) -> str:
+    """Opaque position after the row with this (timestamp, id)"""
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([timestamp, str(row_id)]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
     try:
-        conn = psycopg2.connect(
-            host=POSTGRES_CONFIG["host"],
-            port=POSTGRES_CONFIG["port"],
-            user=POSTGRES_CONFIG["user"],
-            password=POSTGRES_CONFIG["password"],
-            database=POSTGRES_CONFIG["database"],
-            connect_timeout=5
-        )
-        print("✓ PostgreSQL connected")
-        return conn
-    except Exception as e:
-        print(f"✗ PostgreSQL connection failed: {e}")
-        return None
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return timestamp, row_id
+    except Exception:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+# ======================= POSTGRESQL FUNCTIONS =======================
 
-def save_test_answer_to_postgres(test_answer: TestAnswerRequest) -> dict:
+async def save_test_answer_to_postgres(test_answer: TestAnswerRequest) -> dict:
     """
     Save test answer to PostgreSQL test_answer table
     
@@ -134,38 +322,48 @@ def save_test_answer_to_postgres(test_answer: TestAnswerRequest) -> dict:
             "status": str
         }
     """
-    conn = get_postgres_connection()
-    if not conn:
-        return {
-            "status": "error",
-            "message": "PostgreSQL connection failed"
-        }
-    
+    async with postgres_connection() as conn:
+        if not conn:
+            return {
+                "status": "error",
+                "message": "PostgreSQL connection failed"
+            }
+        return await insert_test_answer(conn, test_answer)
+
+async def insert_test_answer(conn, test_answer: TestAnswerRequest) -> dict:
+    cursor = conn.cursor()
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # The code goes to code_blob once; the row references it by hash
+        [code_hash] = await store_blobs(cursor, [test_answer.code])
+        
+        # Large stdout/output is truncated and compressed (see text_store.py)
+        stdout, stdout_z = pack("stdout", test_answer.stdout)
+        output, output_z = pack("output", test_answer.output)
         
         # Insert into test_answer table
         insert_query = """
             INSERT INTO test_answer 
-            (candidate_id, problem_id, language, code, stdin, stdout, output, status, is_passed)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, candidate_id, problem_id, language, status, is_passed, timestamp
+            (candidate_id, problem_id, language, code_hash, stdin, stdout, stdout_z, output, output_z, status, is_passed)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id, candidate_id, problem_id, language, code_hash, status, is_passed, timestamp
         """
         
-        cursor.execute(insert_query, (
+        await cursor.execute(insert_query, (
             test_answer.candidate_id,
             test_answer.problem_id,
             test_answer.language,
-            test_answer.code,
+            code_hash,
             test_answer.stdin,
-            test_answer.stdout,
-            test_answer.output,
+            stdout,
+            stdout_z,
+            output,
+            output_z,
             test_answer.status,
             test_answer.is_passed
         ))
         
-        result = cursor.fetchone()
-        conn.commit()
+        result = await cursor.fetchone()
+        await conn.commit()
         
         print(f"✓ Test answer saved to PostgreSQL: ID {result['id']}")
         
@@ -174,6 +372,7 @@ def save_test_answer_to_postgres(test_answer: TestAnswerRequest) -> dict:
             "candidate_id": result["candidate_id"],
             "problem_id": result["problem_id"],
             "language": result["language"],
+            "code_hash": result["code_hash"],
             "status": result["status"],
             "is_passed": result["is_passed"],
             "timestamp": result["timestamp"].isoformat() if result["timestamp"] else None
@@ -181,49 +380,188 @@ def save_test_answer_to_postgres(test_answer: TestAnswerRequest) -> dict:
         
     except Exception as e:
         print(f"Error saving to PostgreSQL: {e}")
-        conn.rollback()
+        await conn.rollback()
         return {
             "status": "error",
             "message": str(e)
         }
     finally:
-        cursor.close()
-        conn.close()
+        await cursor.close()
 
-def get_test_answers_postgres(candidate_id: str) -> List[dict]:
-    """Fetch all test answers for a candidate from PostgreSQL"""
-    conn = get_postgres_connection()
-    if not conn:
-        return []
+TEST_ANSWER_COLUMNS = (
+    "candidate_id", "problem_id", "language", "code_hash", "stdin", "stdout", "stdout_z", "output", "output_z",
+    "status", "is_passed"
+)
+
+async def save_code_blob(code: str) -> Optional[str]:
+    """Store code in code_blob; its hash, or None when PostgreSQL is unavailable"""
+    async with postgres_connection() as conn:
+        if not conn:
+            return None
+        try:
+            async with conn.transaction(), conn.cursor() as cursor:
+                [code_hash] = await store_blobs(cursor, [code])
+            return code_hash
+        except Exception as e:
+            print(f"Error saving code blob: {e}")
+            return None
+
+async def load_code_blobs(hashes: List[str]) -> dict:
+    """Code by hash from code_blob, for documents that keep only the hash"""
+    if not hashes:
+        return {}
+    async with postgres_connection() as conn:
+        if not conn:
+            return {}
+        try:
+            async with conn.cursor() as cursor:
+                return await load_blobs(cursor, hashes)
+        except Exception as e:
+            print(f"Error loading code blobs: {e}")
+            return {}
+
+async def attach_submission_code(submissions: List[dict]) -> List[dict]:
+    """Fill in code of MongoDB submissions that reference a blob"""
+    codes = await load_code_blobs([sub["code_hash"] for sub in submissions
+                                   if sub.get("code") is None and sub.get("code_hash")])
+    for sub in submissions:
+        if sub.get("code") is None and sub.get("code_hash"):
+            sub["code"] = codes.get(sub["code_hash"])
+    return submissions
+
+async def save_test_answers_bulk(answers: List[TestAnswerRequest], idempotency_key: Optional[str]) -> dict:
+    """Save many test answers with one COPY in one transaction"""
+    async with postgres_connection() as conn:
+        if not conn:
+            return {
+                "status": "error",
+                "message": "PostgreSQL connection failed"
+            }
+        return await copy_test_answers(conn, answers, idempotency_key)
+
+async def copy_test_answers(conn, answers: List[TestAnswerRequest], idempotency_key: Optional[str]) -> dict:
+    # A key reused for different answers is a client bug, not a retry
+    request_hash = hashlib.sha256(
+        json.dumps([answer.model_dump() for answer in answers], sort_keys=True).encode()
+    ).hexdigest()
+    replayed = False
+    try:
+        async with conn.transaction(), conn.cursor() as cursor:
+            if idempotency_key:
+                # Concurrent retries wait here on the key until the first one commits
+                await cursor.execute("""
+                    INSERT INTO test_answer_batch (idempotency_key, request_hash, answer_count)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (idempotency_key) DO NOTHING
+                    RETURNING idempotency_key
+                """, (idempotency_key, request_hash, len(answers)))
+                replayed = await cursor.fetchone() is None
+            
+            if replayed:
+                await cursor.execute(
+                    "SELECT request_hash, answer_ids, created_at AS timestamp FROM test_answer_batch "
+                    "WHERE idempotency_key = %s",
+                    (idempotency_key,)
+                )
+                batch = await cursor.fetchone()
+                if batch["request_hash"] != request_hash:
+                    return {
+                        "status": "error",
+                        "message": f"Idempotency key {idempotency_key} was already used for different answers"
+                    }
+                ids, timestamp = batch["answer_ids"], batch["timestamp"]
+            else:
+                # Ids are drawn up front so COPY can write them and each row maps back to its answer
+                await cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence('test_answer', 'id')) AS id, "
+                    "CURRENT_TIMESTAMP::timestamp AS timestamp FROM generate_series(1, %s)",
+                    (len(answers),)
+                )
+                rows = await cursor.fetchall()
+                ids = [row["id"] for row in rows]
+                timestamp = rows[0]["timestamp"]
+                # A closing test has many identical answers; each distinct code is stored once
+                hashes = await store_blobs(cursor, [answer.code for answer in answers])
+                async with cursor.copy(
+                    f"COPY test_answer (id, {', '.join(TEST_ANSWER_COLUMNS)}) FROM STDIN"
+                ) as copy:
+                    for answer_id, code_hash, answer in zip(ids, hashes, answers):
+                        values = {**answer.model_dump(), "code_hash": code_hash}
+                        for column in COMPRESSED_COLUMNS:
+                            values[column], values[f"{column}_z"] = pack(column, values[column])
+                        await copy.write_row((answer_id, *(values[column] for column in TEST_ANSWER_COLUMNS)))
+                if idempotency_key:
+                    await cursor.execute(
+                        "UPDATE test_answer_batch SET answer_ids = %s WHERE idempotency_key = %s",
+                        (ids, idempotency_key)
+                    )
+    except Exception as e:
+        print(f"Error bulk saving to PostgreSQL: {e}")
+        return {
+            "status": "error",
+            "message": str(e)
+        }
     
+    print(f"✓ {len(ids)} test answers {'already saved' if replayed else 'saved'} to PostgreSQL")
+    
+    return {
+        "status": "duplicate" if replayed else "saved",
+        "idempotency_key": idempotency_key,
+        "count": len(ids),
+        "timestamp": timestamp.isoformat() if timestamp else None,
+        "answers": [
+            {
+                "index": index,
+                "id": answer_id,
+                "candidate_id": answer.candidate_id,
+                "problem_id": answer.problem_id,
+                "status": answer.status,
+                "is_passed": answer.is_passed
+            }
+            for index, (answer_id, answer) in enumerate(zip(ids, answers))
+        ]
+    }
+
+async def get_test_answers_postgres(candidate_id: str, limit: int, after: Optional[tuple] = None,
+                                    fields: tuple = TEST_ANSWER_FIELDS, problem_id: Optional[str] = None) -> List[dict]:
+    """Fetch one page of a candidate's test answers from PostgreSQL, newest first"""
+    async with postgres_connection() as conn:
+        if not conn:
+            return []
+        return await select_test_answers(conn, candidate_id, limit, after, fields, problem_id)
+
+async def select_test_answers(conn, candidate_id: str, limit: int, after: Optional[tuple],
+                              fields: tuple, problem_id: Optional[str]) -> List[dict]:
+    cursor = conn.cursor()
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        select_query = """
-            SELECT * FROM test_answer 
-            WHERE candidate_id = %s 
-            ORDER BY timestamp DESC
+        # Keyset pagination: rows strictly after the cursor in (timestamp, id)
+        # order, served by idx_candidate_timestamp_id without an OFFSET scan
+        conditions = ["candidate_id = %s"]
+        params = [candidate_id]
+        if problem_id is not None:
+            conditions.append("problem_id = %s")
+            params.append(problem_id)
+        if after is not None:
+            conditions.append("(timestamp, id) < (%s, %s)")
+            params.extend(after)
+        select_query = f"""
+            SELECT {', '.join(test_answer_columns(fields))} FROM test_answer 
+            WHERE {' AND '.join(conditions)} 
+            ORDER BY timestamp DESC, id DESC
+            LIMIT %s
         """
+        params.append(limit)
         
-        cursor.execute(select_query, (candidate_id,))
-        results = cursor.fetchall()
+        await cursor.execute(select_query, params)
+        results = drop_unrequested(await attach_code(cursor, await cursor.fetchall()), fields)
         
         # Convert to list of dicts
         answers = []
         for row in results:
-            answers.append({
-                "id": row["id"],
-                "candidate_id": row["candidate_id"],
-                "problem_id": row["problem_id"],
-                "language": row["language"],
-                "code": row["code"],
-                "stdin": row["stdin"],
-                "stdout": row["stdout"],
-                "output": row["output"],
-                "status": row["status"],
-                "is_passed": row["is_passed"],
-                "timestamp": row["timestamp"].isoformat() if row["timestamp"] else None
-            })
+            if row.get("timestamp"):
+                row["timestamp"] = row["timestamp"].isoformat()
+            answers.append(row)
         
         return answers
         
@@ -231,24 +569,27 @@ def get_test_answers_postgres(candidate_id: str) -> List[dict]:
         print(f"Error fetching from PostgreSQL: {e}")
         return []
     finally:
-        cursor.close()
-        conn.close()
+        await cursor.close()
 
-def get_test_answer_postgres(answer_id: int) -> Optional[dict]:
+async def get_test_answer_postgres(answer_id: int) -> Optional[dict]:
     """Fetch specific test answer from PostgreSQL"""
-    conn = get_postgres_connection()
-    if not conn:
-        return None
-    
+    async with postgres_connection() as conn:
+        if not conn:
+            return None
+        return await select_test_answer(conn, answer_id)
+
+async def select_test_answer(conn, answer_id: int) -> Optional[dict]:
+    cursor = conn.cursor()
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         select_query = "SELECT * FROM test_answer WHERE id = %s"
-        cursor.execute(select_query, (answer_id,))
-        result = cursor.fetchone()
+        await cursor.execute(select_query, (answer_id,))
+        result = await cursor.fetchone()
         
         if not result:
             return None
+        await attach_code(cursor, [result])
+        unpack(result)
         
         return {
             "id": result["id"],
@@ -256,6 +597,7 @@ def get_test_answer_postgres(answer_id: int) -> Optional[dict]:
             "problem_id": result["problem_id"],
             "language": result["language"],
             "code": result["code"],
+            "code_hash": result["code_hash"],
             "stdin": result["stdin"],
             "stdout": result["stdout"],
             "output": result["output"],
@@ -268,33 +610,93 @@ def get_test_answer_postgres(answer_id: int) -> Optional[dict]:
         print(f"Error fetching from PostgreSQL: {e}")
         return None
     finally:
-        cursor.close()
-        conn.close()
+        await cursor.close()
+
+async def stream_test_answers(conn, conditions: List[str], params: list, fields: tuple):
+    """Rows matching conditions, EXPORT_BATCH_ROWS at a time, from a server-side cursor"""
+    # A named cursor keeps the result set in PostgreSQL; only one batch is in memory here
+    cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+    blob_cursor = conn.cursor()
+    try:
+        await cursor.execute(
+            f"SELECT {', '.join(test_answer_columns(fields, decompress=True))} FROM test_answer "
+            f"WHERE {' AND '.join(conditions) or 'TRUE'} ORDER BY id",
+            params
+        )
+        while True:
+            rows = await cursor.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            if "code" in fields:
+                rows = drop_unrequested(await attach_code(blob_cursor, rows), fields)
+            yield [unpack(row) for row in rows]
+    finally:
+        await blob_cursor.close()
+        await cursor.close()
+
+def ndjson_chunks(batches):
+    async def chunks():
+        async for rows in batches:
+            yield "".join(json.dumps(row, default=str) + "\n" for row in rows).encode()
+    return chunks()
+
+def gzip_csv_chunks(batches, fields: tuple):
+    async def chunks():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        async for rows in batches:
+            writer.writerows([row[field] for field in fields] for row in rows)
+            chunk = compressor.compress(buffer.getvalue().encode())
+            buffer.seek(0)
+            buffer.truncate()
+            if chunk:
+                yield chunk
+        yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
+    return chunks()
 
 # ========================= API ENDPOINTS =========================
 
 @app.get("/health")
 async def health():
-    """Health check endpoint - check both databases"""
-    mongo_client = get_mongodb_client()
-    postgres_conn = get_postgres_connection()
-    
-    mongodb_status = "connected" if mongo_client else "disconnected"
-    postgres_status = "connected" if postgres_conn else "disconnected"
+    """Health check endpoint - check both databases through the shared pools"""
+    mongodb_status = "disconnected"
+    if mongo_client is not None:
+        try:
+            await mongo_client.admin.command('ping')
+            mongodb_status = "connected"
+        except Exception as e:
+            print(f"✗ MongoDB ping failed: {e}")
     
-    if mongo_client:
-        mongo_client.close()
-    if postgres_conn:
-        postgres_conn.close()
+    postgres_status = "disconnected"
+    async with postgres_connection(timeout=2) as conn:
+        if conn:
+            try:
+                await conn.execute("SELECT 1")
+                postgres_status = "connected"
+            except Exception as e:
+                print(f"✗ PostgreSQL check failed: {e}")
     
     return {
         "status": "healthy",
         "service": "Submission Service",
         "port": 8003,
         "mongodb": mongodb_status,
-        "postgresql": postgres_status
+        "postgresql": postgres_status,
+        "pools": {
+            "mongodb": {"max": MONGO_MAX_POOL_SIZE, "min": MONGO_MIN_POOL_SIZE},
+            "postgresql": postgres_pool_stats()
+        },
+        "draft_buffer": {**draft_buffer.stats(), "cached_states": len(draft_states)},
+        "text_storage": text_stats.as_dict()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Raw vs stored bytes of large text columns, in Prometheus text format"""
+    return text_stats.render()
+
 @app.post("/submission")
 async def submit_code(req: SubmissionRequest):
     """
@@ -314,24 +716,30 @@ async def submit_code(req: SubmissionRequest):
         "timestamp": datetime.utcnow().isoformat()
     }
     
+    # The last autosave must be durable before the submission is recorded
+    await draft_buffer.flush([draft_id_for(req.candidate_id, req.problem_id)])
+    
+    # Keep only the hash when the code reached code_blob, the code itself otherwise
+    code_hash = await save_code_blob(req.code)
+    if code_hash:
+        submission["code_hash"] = code_hash
+        del submission["code"]
+    
     # Save to MongoDB
-    client = get_mongodb_client()
-    if client:
+    db = get_mongodb()
+    if db is not None:
         try:
-            db = client.codeplay
-            result = db.code_submissions.insert_one(submission)
-            client.close()
+            result = await db.code_submissions.insert_one(submission)
             print(f"✓ Submission saved to MongoDB: {result.inserted_id}")
         except Exception as e:
             print(f"Error saving to MongoDB: {e}")
-            if client:
-                client.close()
     
     return {
         "submission_id": submission.get("submission_id"),
         "candidate_id": req.candidate_id,
         "problem_id": req.problem_id,
         "language": req.language,
+        "code_hash": code_hash,
         "status": "submitted",
         "timestamp": submission["timestamp"]
     }
@@ -349,30 +757,204 @@ async def save_test_answer(req: TestAnswerRequest):
     - status: success, error, timeout
     """
     
-    result = save_test_answer_to_postgres(req)
+    result = await save_test_answer_to_postgres(req)
     return result
 
+@app.post("/test-answers/bulk")
+async def save_test_answers(req: BulkTestAnswerRequest):
+    """
+    Save many test answers at once, e.g. every result of a test as it closes
+    
+    All answers are written in one transaction or none are. The response
+    lists the id of each answer by its index in the request. Send an
+    idempotency_key to make retries safe: a repeat of a stored batch
+    returns the same ids with status "duplicate" and writes nothing.
+    """
+    
+    if not req.answers:
+        raise HTTPException(status_code=422, detail="No answers to save")
+    if len(req.answers) > TEST_ANSWER_BULK_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {TEST_ANSWER_BULK_MAX} answers per request"
+        )
+    
+    return await save_test_answers_bulk(req.answers, req.idempotency_key)
+
 @app.get("/submissions/{candidate_id}")
-async def get_submissions(candidate_id: str):
-    """Fetch all submissions for a candidate"""
+async def get_submissions(
+    candidate_id: str,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Fetch a candidate's submissions, newest first, one page at a time
+    
+    Pass next_cursor from the response as cursor to get the following page;
+    fields=problem_id,language,status leaves out the code.
+    """
     
-    submissions = await get_user_submissions(candidate_id)
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and not ObjectId.is_valid(after[1]):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    submissions, next_cursor = await get_user_submissions(
+        candidate_id, limit, after, parse_fields(fields, SUBMISSION_FIELDS, ("timestamp",))
+    )
     
     return {
         "candidate_id": candidate_id,
         "count": len(submissions),
-        "submissions": submissions
+        "submissions": submissions,
+        "next_cursor": next_cursor
     }
 
 @app.get("/test-answers/{candidate_id}")
-async def get_test_answers(candidate_id: str):
-    """Fetch all test answers for a candidate from PostgreSQL"""
+async def get_test_answers(
+    candidate_id: str,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    problem_id: Optional[str] = None
+):
+    """
+    Fetch a candidate's test answers from PostgreSQL, newest first, one page at a time
     
-    answers = get_test_answers_postgres(candidate_id)
+    Pass next_cursor from the response as cursor to get the following page;
+    fields=problem_id,status,is_passed skips the code and output columns.
+    """
+    
+    after = None
+    if cursor:
+        timestamp, answer_id = decode_cursor(cursor)
+        try:
+            after = (datetime.fromisoformat(timestamp), int(answer_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+    answers = await get_test_answers_postgres(
+        candidate_id, limit, after, parse_fields(fields, TEST_ANSWER_FIELDS, ("id", "timestamp")), problem_id
+    )
     
     return {
         "candidate_id": candidate_id,
         "count": len(answers),
+        "test_answers": answers,
+        "next_cursor": encode_cursor(answers[-1]["timestamp"], answers[-1]["id"]) if len(answers) == limit else None
+    }
+
+@app.get("/export/test-answers")
+async def export_test_answers(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    candidate_id: Optional[List[str]] = Query(None),
+    problem_id: Optional[str] = None,
+    language: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = None
+):
+    """
+    Stream test answers for offline analysis, as NDJSON or gzip-compressed CSV
+    
+    Filter by candidate_id (repeat it for a cohort), problem_id, language and
+    a [since, until) time range. Rows are read from a server-side cursor and
+    written as they arrive, so memory use does not grow with the export.
+    """
+    
+    conditions, params = [], []
+    if candidate_id:
+        conditions.append("candidate_id = ANY(%s)")
+        params.append(candidate_id)
+    if problem_id is not None:
+        conditions.append("problem_id = %s")
+        params.append(problem_id)
+    if language is not None:
+        conditions.append("language = %s")
+        params.append(language)
+    if since is not None:
+        conditions.append("timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < %s")
+        params.append(until)
+    selected = parse_fields(fields, TEST_ANSWER_FIELDS, ("id",))
+    
+    # The connection is held for the whole stream and returned when it ends
+    resources = contextlib.AsyncExitStack()
+    conn = await resources.enter_async_context(postgres_connection())
+    if not conn:
+        await resources.aclose()
+        raise HTTPException(status_code=503, detail="PostgreSQL connection failed")
+    
+    async def batches():
+        try:
+            async with conn.transaction():
+                async for rows in stream_test_answers(conn, conditions, params, selected):
+                    yield rows
+        except Exception as e:
+            print(f"Error exporting from PostgreSQL: {e}")
+            raise
+        finally:
+            await resources.aclose()
+    
+    if format == "csv":
+        return StreamingResponse(
+            gzip_csv_chunks(batches(), selected),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="test_answers.csv.gz"'}
+        )
+    return StreamingResponse(ndjson_chunks(batches()), media_type="application/x-ndjson")
+
+@app.get("/code/{code_hash}")
+async def get_code(code_hash: str, limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX)):
+    """
+    A stored code body and the test answers that submitted exactly this code
+    
+    Identical code shares one hash, so finding identical submissions is an
+    index lookup rather than a comparison of code text.
+    """
+    
+    async with postgres_connection() as conn:
+        if not conn:
+            raise HTTPException(status_code=503, detail="PostgreSQL connection failed")
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT hash, size, octet_length(body) AS stored_size, created_at FROM code_blob WHERE hash = %s",
+                    (code_hash,)
+                )
+                blob = await cursor.fetchone()
+                if not blob:
+                    raise HTTPException(status_code=404, detail="Code not found")
+                code = (await load_blobs(cursor, [code_hash]))[code_hash]
+                await cursor.execute(
+                    "SELECT COUNT(*) AS answers, COUNT(DISTINCT candidate_id) AS candidates "
+                    "FROM test_answer WHERE code_hash = %s",
+                    (code_hash,)
+                )
+                counts = await cursor.fetchone()
+                await cursor.execute("""
+                    SELECT id, candidate_id, problem_id, language, status, is_passed, timestamp
+                    FROM test_answer WHERE code_hash = %s
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT %s
+                """, (code_hash, limit))
+                answers = await cursor.fetchall()
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error fetching code blob: {e}")
+            raise HTTPException(status_code=503, detail="Failed to fetch code")
+    
+    for answer in answers:
+        answer["timestamp"] = answer["timestamp"].isoformat() if answer["timestamp"] else None
+    return {
+        "code_hash": blob["hash"],
+        "code": code,
+        "size": blob["size"],
+        "stored_size": blob["stored_size"],
+        "created_at": blob["created_at"].isoformat() if blob["created_at"] else None,
+        "answer_count": counts["answers"],
+        "candidate_count": counts["candidates"],
         "test_answers": answers
     }
 
@@ -380,7 +962,7 @@ async def get_test_answers(candidate_id: str):
 async def get_test_answer(answer_id: int):
     """Fetch specific test answer from PostgreSQL"""
     
-    answer = get_test_answer_postgres(answer_id)
+    answer = await get_test_answer_postgres(answer_id)
     
     if not answer:
         raise HTTPException(status_code=404, detail="Test answer not found")
@@ -391,111 +973,239 @@ async def get_test_answer(answer_id: int):
 async def get_submission(submission_id: str):
     """Fetch specific submission from MongoDB"""
     
-    client = get_mongodb_client()
-    if client:
+    db = get_mongodb()
+    if db is not None:
         try:
-            db = client.codeplay
-            submission = db.code_submissions.find_one({"submission_id": submission_id})
-            client.close()
+            submission = await db.code_submissions.find_one({"submission_id": submission_id})
             
             if submission:
-                return convert_mongo_doc(submission)
+                [submission] = await attach_submission_code([convert_mongo_doc(submission)])
+                return submission
         except Exception as e:
             print(f"Error fetching from MongoDB: {e}")
-            client.close() if client else None
     
     raise HTTPException(status_code=404, detail="Submission not found")
 
 # ======================= DRAFT FUNCTIONS =======================
 
-async def get_user_submissions(candidate_id: str) -> List[dict]:
-    """Fetch user submissions from MongoDB"""
+async def get_user_submissions(candidate_id: str, limit: int, after: Optional[tuple] = None,
+                               fields: tuple = SUBMISSION_FIELDS) -> tuple:
+    """Fetch one page of user submissions from MongoDB, newest first; returns (submissions, next_cursor)"""
     
-    client = get_mongodb_client()
-    if client:
+    db = get_mongodb()
+    if db is not None:
         try:
-            db = client.codeplay
-            submissions = list(db.code_submissions.find({"candidate_id": candidate_id}))
-            client.close()
+            query = {"candidate_id": candidate_id}
+            if after is not None:
+                timestamp, last_id = after
+                query["$or"] = [
+                    {"timestamp": {"$lt": timestamp}},
+                    {"timestamp": timestamp, "_id": {"$lt": ObjectId(last_id)}}
+                ]
+            submissions = await db.code_submissions.find(
+                query, {field: 1 for field in stored_columns(fields)}
+            ).sort([("timestamp", -1), ("_id", -1)]).limit(limit).to_list(length=limit)
             
-            return [convert_mongo_doc(sub) for sub in submissions]
+            next_cursor = None
+            if len(submissions) == limit:
+                next_cursor = encode_cursor(submissions[-1].get("timestamp"), submissions[-1]["_id"])
+            submissions = [convert_mongo_doc(sub) for sub in submissions]
+            if "code" in fields:
+                submissions = drop_unrequested(await attach_submission_code(submissions), fields)
+            return submissions, next_cursor
         except Exception as e:
             print(f"Error fetching from MongoDB: {e}")
     
-    return []
+    return [], None
+
+async def load_draft_state(draft_id: str) -> Optional[DraftState]:
+    """Current checkpoint and deltas of a draft: cached, or rebuilt from MongoDB plus pending saves"""
+    state = draft_states.get(draft_id)
+    if state is not None:
+        return state
+    stored = None
+    db = get_mongodb()
+    if db is not None:
+        stored = await db.code_drafts.find_one({"draft_id": draft_id})
+    # A save may have cached a newer state while this one was loading
+    state = draft_states.get(draft_id) or DraftState.from_document(draft_buffer.get(draft_id, stored))
+    if state is not None:
+        draft_states.put(draft_id, state)
+    return state
+
+async def archive_draft_segment(draft_id: str, state: DraftState):
+    """Keep a closed checkpoint and its deltas in the draft's edit history"""
+    db = get_mongodb()
+    if db is None:
+        return
+    try:
+        await db.code_draft_history.insert_one({
+            "draft_id": draft_id,
+            **state.segment(),
+            "archived_at": datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        print(f"Error archiving draft history: {e}")
 
 @app.post("/draft")
 async def save_draft(req: DraftRequest):
-    """Auto-save draft for session recovery"""
+    """
+    Auto-save draft for session recovery
     
+    Send either the full code, or base_version plus the edits made since.
+    A conflict response means base_version is stale: send the full code.
+    """
+    
+    draft_id = draft_id_for(req.candidate_id, req.problem_id)
     draft = {
         "candidate_id": req.candidate_id,
         "problem_id": req.problem_id,
         "language": req.language,
-        "code": req.code,
         "cursor_position": req.cursor_position,
         "status": "draft",
         "timestamp": datetime.utcnow().isoformat(),
         "last_saved": datetime.utcnow().isoformat()
     }
     
-    client = get_mongodb_client()
-    if client:
+    if req.code is None and req.edits is None:
+        raise HTTPException(status_code=422, detail="Send code or base_version with edits")
+    
+    try:
+        state = await load_draft_state(draft_id)
+    except Exception as e:
+        print(f"Error loading draft: {e}")
+        return {"status": "error", "message": "Failed to save draft"}
+    
+    if req.code is None:
+        if state is None or req.base_version != state.version:
+            return {
+                "status": "conflict",
+                "draft_id": draft_id,
+                "version": state.version if state else None,
+                "message": "Draft changed since base_version - send the full code"
+            }
+        edits = [edit.model_dump() for edit in req.edits]
         try:
-            db = client.codeplay
-            draft_id = f"{req.candidate_id}_{req.problem_id}_draft"
-            result = db.code_drafts.update_one(
-                {"draft_id": draft_id},
-                {"$set": draft},
-                upsert=True
-            )
-            client.close()
-            print(f"✓ Draft saved: {draft_id}")
-            return {"status": "saved", "draft_id": draft_id}
-        except Exception as e:
-            print(f"Error saving draft to MongoDB: {e}")
-            client.close() if client else None
+            code = apply_edits(state.code, edits)
+        except PatchError as e:
+            return {"status": "conflict", "draft_id": draft_id, "version": state.version, "message": str(e)}
+        if req.checksum is not None and text_checksum(code) != req.checksum:
+            return {
+                "status": "conflict",
+                "draft_id": draft_id,
+                "version": state.version,
+                "message": "Edits do not produce the editor's text - send the full code"
+            }
+        version = state.version + 1
+        full = (len(state.deltas) + 1 >= DRAFT_CHECKPOINT_EVERY
+                or state.delta_size + edits_size(edits) > len(code))
+        if not full:
+            delta = {"version": version, "edits": edits}
+            state.deltas.append(delta)
+            state.code = code
+            # Only the delta is sent to MongoDB; the checkpoint text stays as it is
+            draft_buffer.put(draft_id, {**draft, "version": version}, append={"deltas": [delta]})
+            return {"status": "saved", "draft_id": draft_id, "version": version}
+    else:
+        code = req.code
+        version = state.version + 1 if state else 1
     
-    return {"status": "error", "message": "Failed to save draft"}
+    draft_states.put(draft_id, DraftState(code, version))
+    draft_buffer.put(draft_id, {
+        **draft, "code": code, "checkpoint_version": version, "deltas": [], "version": version
+    })
+    # Full saves from clients that never send edits would only repeat snapshots
+    if state is not None and (state.deltas or req.code is None):
+        await archive_draft_segment(draft_id, state)
+    return {"status": "saved", "draft_id": draft_id, "version": version}
 
 @app.get("/draft/{candidate_id}/{problem_id}")
 async def get_draft(candidate_id: str, problem_id: str):
     """Retrieve draft for session recovery"""
     
-    draft_id = f"{candidate_id}_{problem_id}_draft"
+    draft_id = draft_id_for(candidate_id, problem_id)
     
-    client = get_mongodb_client()
-    if client:
+    db = get_mongodb()
+    if db is not None:
         try:
-            db = client.codeplay
-            draft = db.code_drafts.find_one({"draft_id": draft_id})
-            client.close()
+            draft = draft_buffer.get(draft_id, await db.code_drafts.find_one({"draft_id": draft_id}))
             
             if draft:
-                return convert_mongo_doc(draft)
+                state = draft_states.get(draft_id) or DraftState.from_document(draft)
+                draft = convert_mongo_doc(draft)
+                draft.pop("deltas", None)
+                draft.pop("checkpoint_version", None)
+                draft.update(code=state.code, version=state.version)
+                return draft
         except Exception as e:
             print(f"Error fetching draft: {e}")
-            client.close() if client else None
     
     return {"status": "no_draft", "message": "No saved draft for this problem"}
 
+@app.get("/draft/{candidate_id}/{problem_id}/history")
+async def get_draft_history(candidate_id: str, problem_id: str, version: Optional[int] = None):
+    """
+    Edit history of a draft: its checkpoints and how many deltas followed each,
+    or with ?version=N the code as it was at version N
+    """
+    
+    draft_id = draft_id_for(candidate_id, problem_id)
+    
+    db = get_mongodb()
+    if db is None:
+        raise HTTPException(status_code=503, detail="MongoDB is not connected")
+    try:
+        segments = await db.code_draft_history.find(
+            {"draft_id": draft_id}, {"_id": 0}
+        ).sort("checkpoint_version", 1).to_list(length=None)
+        current = await load_draft_state(draft_id)
+    except Exception as e:
+        print(f"Error fetching draft history: {e}")
+        raise HTTPException(status_code=503, detail="Failed to fetch draft history")
+    if current is not None:
+        segments.append(current.segment())
+    
+    if version is None:
+        return {
+            "draft_id": draft_id,
+            "version": current.version if current else None,
+            "checkpoints": [
+                {
+                    "checkpoint_version": segment["checkpoint_version"],
+                    "deltas": len(segment["deltas"]),
+                    "last_version": segment["version"],
+                    "archived_at": segment.get("archived_at")
+                }
+                for segment in segments
+            ]
+        }
+    
+    for segment in segments:
+        if segment["checkpoint_version"] <= version <= segment["version"]:
+            deltas = [delta for delta in segment["deltas"] if delta["version"] <= version]
+            return {
+                "draft_id": draft_id,
+                "version": version,
+                "code": DraftState(segment["code"], segment["checkpoint_version"], deltas).code
+            }
+    raise HTTPException(status_code=404, detail=f"Version {version} is not in this draft's history")
+
 @app.delete("/draft/{candidate_id}/{problem_id}")
 async def delete_draft(candidate_id: str, problem_id: str):
-    """Delete draft after submission"""
+    """Delete draft after submission; its edit history is kept"""
     
-    draft_id = f"{candidate_id}_{problem_id}_draft"
+    draft_id = draft_id_for(candidate_id, problem_id)
     
-    client = get_mongodb_client()
-    if client:
-        try:
-            db = client.codeplay
-            result = db.code_drafts.delete_one({"draft_id": draft_id})
-            client.close()
-            print(f"✓ Draft deleted: {draft_id}")
-            return {"status": "deleted"}
-        except Exception as e:
-            print(f"Error deleting draft: {e}")
-            client.close() if client else None
+    try:
+        state = await load_draft_state(draft_id)
+        draft_states.discard(draft_id)
+        await draft_buffer.delete(draft_id)
+        if state is not None:
+            await archive_draft_segment(draft_id, state)
+        print(f"✓ Draft deleted: {draft_id}")
+        return {"status": "deleted"}
+    except Exception as e:
+        print(f"Error deleting draft: {e}")
     
     return {"status": "error", "message": "Failed to delete draft"}
 
@@ -0,0 +1,121 @@
+"""
+Large Text Columns
+A print-heavy run can leave megabytes of stdout. At write time, stdout and
+output longer than TEXT_MAX_BYTES are cut to their head and tail around a
+marker saying how much was dropped, and text of at least
+TEXT_COMPRESS_MIN_BYTES is zstd-compressed into the column's _z twin
+(stdout_z, output_z) with the plain column left NULL. Shorter text stays
+plain, where compression would cost more than it saves.
+
+Compressed text is decompressed only where one answer is returned in full
+(GET /test-answer/{answer_id}) and in exports; history pages return it as
+null with "<column>_compressed": true.
+
+Raw and stored byte counts per column are reported by /health and
+GET /metrics.
+
+Configuration (environment):
+- TEXT_MAX_BYTES: longest stdout/output kept
+- TEXT_COMPRESS_MIN_BYTES: shortest text worth compressing
+"""
+
+import os
+import zlib
+from typing import Optional, Tuple
+
+import zstandard
+
+TEXT_MAX_BYTES = int(os.getenv("TEXT_MAX_BYTES", str(1024 * 1024)))
+TEXT_COMPRESS_MIN_BYTES = int(os.getenv("TEXT_COMPRESS_MIN_BYTES", "4096"))
+
+COMPRESSED_COLUMNS = ("stdout", "output")
+
+# Requests are handled on one event loop thread, so one (de)compressor serves them all
+_compressor = zstandard.ZstdCompressor(level=3)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def compress(data: bytes) -> bytes:
+    return _compressor.compress(data)
+
+
+def decompress(body: bytes, compression: str = "zstd") -> bytes:
+    if compression == "zstd":
+        return _decompressor.decompress(bytes(body))
+    if compression == "zlib":
+        return zlib.decompress(body)
+    return bytes(body)
+
+
+def truncate(text: str, max_bytes: int) -> Tuple[str, int]:
+    """text cut to its first and last bytes around a marker, and how many bytes were dropped"""
+    data = text.encode()
+    if len(data) <= max_bytes:
+        return text, 0
+    head = max_bytes * 3 // 4
+    tail = max_bytes - head
+    dropped = len(data) - head - tail
+    marker = f"\n... [{dropped} bytes truncated] ...\n"
+    return data[:head].decode(errors="ignore") + marker + data[-tail:].decode(errors="ignore"), dropped
+
+
+class TextStats:
+    """Bytes received vs stored per column, since the process started"""
+
+    def __init__(self):
+        self.columns = {}
+
+    def record(self, column: str, raw: int, stored: int, truncated: bool = False, compressed: bool = False):
+        totals = self.columns.setdefault(
+            column, {"values": 0, "raw_bytes": 0, "stored_bytes": 0, "truncated": 0, "compressed": 0}
+        )
+        totals["values"] += 1
+        totals["raw_bytes"] += raw
+        totals["stored_bytes"] += stored
+        totals["truncated"] += truncated
+        totals["compressed"] += compressed
+
+    def as_dict(self) -> dict:
+        return {column: dict(totals) for column, totals in sorted(self.columns.items())}
+
+    def render(self) -> str:
+        """Prometheus text exposition of the totals"""
+        lines = []
+        for metric, key, documentation in (
+            ("submission_text_raw_bytes_total", "raw_bytes", "Bytes of text received, before truncation and compression"),
+            ("submission_text_stored_bytes_total", "stored_bytes", "Bytes of text written to the database"),
+            ("submission_text_truncated_total", "truncated", "Values cut to TEXT_MAX_BYTES"),
+            ("submission_text_compressed_total", "compressed", "Values stored compressed")
+        ):
+            lines.append(f"# HELP {metric} {documentation}")
+            lines.append(f"# TYPE {metric} counter")
+            for column, totals in sorted(self.columns.items()):
+                lines.append(f'{metric}{{column="{column}"}} {totals[key]}')
+        return "\n".join(lines) + "\n"
+
+
+stats = TextStats()
+
+
+def pack(column: str, text: Optional[str]) -> Tuple[Optional[str], Optional[bytes]]:
+    """(plain, compressed) values to store for text; exactly one of them is set"""
+    text = text or ""
+    raw = len(text.encode())
+    text, dropped = truncate(text, TEXT_MAX_BYTES)
+    data = text.encode()
+    if len(data) < TEXT_COMPRESS_MIN_BYTES:
+        stats.record(column, raw, len(data), truncated=dropped > 0)
+        return text, None
+    packed = compress(data)
+    stats.record(column, raw, len(packed), truncated=dropped > 0, compressed=True)
+    return None, packed
+
+
+def unpack(row: dict) -> dict:
+    """Replace the compressed twins selected with a row by the text they hold"""
+    for column in COMPRESSED_COLUMNS:
+        if f"{column}_z" in row:
+            packed = row.pop(f"{column}_z")
+            if packed is not None:
+                row[column] = decompress(packed).decode()
+    return row